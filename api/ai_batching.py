@@ -0,0 +1,121 @@
+"""
+Batched AI Prompting
+====================
+
+Asking for suggestions one element at a time repeats the same long
+instruction block for every headline, subheadline, description and CTA on a
+page. A batch prompt lists all of a page's elements once, asks for a JSON
+object keyed by element number, and is parsed back into per-element
+suggestion lists.
+
+Large pages are split into chunks so each reply fits the completion budget.
+Elements a reply does not cover (or a reply that is not valid JSON at all)
+come back as None so the caller can fall back to per-element prompts.
+
+Environment Variables:
+- AI_BATCH_PROMPTS: set to 'false' to always prompt per element
+- AI_BATCH_SIZE: maximum elements per batch request (default 8)
+"""
+
+import json
+import os
+import re
+
+AI_BATCH_PROMPTS = os.environ.get('AI_BATCH_PROMPTS', 'true').lower() == 'true'
+AI_BATCH_SIZE = int(os.environ.get('AI_BATCH_SIZE', '8'))
+
+# Completion budget: ten short suggestions per element plus JSON overhead
+TOKENS_PER_ELEMENT = 350
+BASE_TOKENS = 200
+MAX_BATCH_TOKENS = 4000
+
+SUGGESTIONS_PER_ELEMENT = 10
+
+
+def chunk_items(items, size=AI_BATCH_SIZE):
+    """Split items into batches of at most size"""
+    size = max(1, size)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def batch_max_tokens(count):
+    return min(MAX_BATCH_TOKENS, BASE_TOKENS + TOKENS_PER_ELEMENT * count)
+
+
+def build_batch_prompt(items, context, guidelines):
+    """
+    Build one prompt covering several elements
+    items: list of dicts with 'content', 'content_type' and 'language'
+    guidelines: content type -> one line of requirements for that type
+    """
+    lines = [
+        f"Website Context: {context if context else 'General website'}",
+        "",
+        f"Below are {len(items)} text elements from the same web page. For EACH element, write "
+        f"{SUGGESTIONS_PER_ELEMENT} improved, SEO and conversion-optimized alternatives.",
+        "",
+        "Requirements by element type:"
+    ]
+
+    seen_types = []
+    for item in items:
+        if item['content_type'] not in seen_types:
+            seen_types.append(item['content_type'])
+    for content_type in seen_types:
+        requirements = guidelines.get(content_type, guidelines.get('default', ''))
+        lines.append(f"- {content_type}: {requirements}")
+
+    lines += [
+        "",
+        "Write each element's alternatives in the language shown for it, keep its core message, "
+        "and make every alternative unique.",
+        "",
+        "Elements:"
+    ]
+    for number, item in enumerate(items, 1):
+        content = item['content'].replace('"', "'")
+        lines.append(f"{number}. [{item['content_type']}, {item['language']}] \"{content}\"")
+
+    example = ', '.join(f'"{number}": ["...", "..."]' for number in range(1, min(len(items), 2) + 1))
+    lines += [
+        "",
+        f"Respond with ONLY a JSON object mapping each element number to an array of exactly "
+        f"{SUGGESTIONS_PER_ELEMENT} strings, for example: {{{example}}}",
+        "No explanations and no markdown."
+    ]
+    return '\n'.join(lines)
+
+
+def _clean_suggestion(value):
+    if not isinstance(value, str):
+        return ''
+    suggestion = re.sub(r'^\d+[.)]\s*', '', value.strip()).strip()
+    return suggestion.strip('"').strip("'").strip()
+
+
+def parse_batch_reply(reply, count):
+    """
+    Parse a batch reply into one suggestion list per element
+    Returns None when the reply is not a JSON object at all; otherwise a list
+    with None for every element the reply did not cover
+    """
+    text = re.sub(r'^```(?:json)?\s*|\s*```$', '', (reply or '').strip())
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end <= start:
+        return None
+
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    results = []
+    for number in range(1, count + 1):
+        value = data.get(str(number))
+        suggestions = []
+        if isinstance(value, list):
+            suggestions = [s for s in (_clean_suggestion(v) for v in value) if s]
+        results.append(suggestions[:SUGGESTIONS_PER_ELEMENT] or None)
+    return results
@@ -0,0 +1,250 @@
+"""
+AI Call Accounting
+==================
+
+Every AI suggestion request is recorded with its prompt and completion
+tokens, latency, status and whether it was answered from the suggestion
+cache or shared the reply of an identical call already in flight (coalesced).
+Records are rolled up in-process per endpoint, per content type and per user
+so rate limits can be sized and expensive prompts found.
+
+The endpoint and user come from a context variable set once per HTTP request
+(set_call_context). Work handed to a ContextThreadPoolExecutor keeps the
+context of the code that submitted it, so AI calls made by worker threads are
+still attributed to the request that caused them.
+
+Token counts come from the provider's `usage` block. When a reply has none
+(streamed replies usually don't) they are estimated at ~4 characters per
+token and the record is flagged as estimated.
+
+Environment Variables:
+- AI_METRICS: set to 'false' to stop recording
+- AI_METRICS_EXPORT: JSONL file every record is appended to (default: no export)
+- AI_METRICS_MAX_USERS: distinct users tracked before the rest are grouped as '(other)' (default 500)
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+AI_METRICS_ENABLED = os.environ.get('AI_METRICS', 'true').lower() == 'true'
+AI_METRICS_EXPORT = os.environ.get('AI_METRICS_EXPORT', '')
+AI_METRICS_MAX_USERS = int(os.environ.get('AI_METRICS_MAX_USERS', '500'))
+
+# Latencies kept per rollup for percentiles
+LATENCY_SAMPLES = 512
+RECENT_CALLS = 20
+OTHER_USERS = '(other)'
+
+_call_context = contextvars.ContextVar('ai_call_context', default={'endpoint': 'unknown', 'user': 'anonymous'})
+
+
+def set_call_context(endpoint, user=None):
+    """Attribute AI calls made from now on in this context to endpoint and user"""
+    _call_context.set({'endpoint': endpoint or 'unknown', 'user': user or 'anonymous'})
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks run in a copy of the submitting thread's context"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _estimate(text):
+    return len(text or '') // 4
+
+
+class AICall:
+    """One provider call being tracked; filled in by observe() and set_usage()"""
+
+    def __init__(self, content_type, prompt):
+        self.content_type = content_type
+        self.prompt = prompt
+        self.status = 'error'
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.completion_text = None
+
+    def observe(self, response):
+        self.status = 'ok' if response.status_code < 400 else f'http_{response.status_code}'
+        # Streamed bodies must not be read here; JSON replies report their usage
+        if self.status == 'ok' and 'json' in response.headers.get('Content-Type', ''):
+            try:
+                self.set_usage(response.json().get('usage'))
+            except (ValueError, AttributeError):
+                pass
+
+    def set_usage(self, usage):
+        if isinstance(usage, dict):
+            self.prompt_tokens = usage.get('prompt_tokens', self.prompt_tokens)
+            self.completion_tokens = usage.get('completion_tokens', self.completion_tokens)
+
+
+class _Rollup:
+    def __init__(self):
+        self.calls = 0
+        self.provider_calls = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.estimated = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def add(self, record):
+        self.calls += 1
+        if record['cache_hit']:
+            self.cache_hits += 1
+            return
+        if record['coalesced']:
+            self.coalesced += 1
+            return
+        self.provider_calls += 1
+        self.errors += record['status'] != 'ok'
+        self.estimated += record['estimated']
+        self.prompt_tokens += record['prompt_tokens']
+        self.completion_tokens += record['completion_tokens']
+        self.latency_total += record['latency_ms']
+        self.latency_max = max(self.latency_max, record['latency_ms'])
+        self.latencies.append(record['latency_ms'])
+
+    def snapshot(self):
+        ordered = sorted(self.latencies)
+
+        def percentile(fraction):
+            return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1) if ordered else None
+
+        return {
+            'calls': self.calls,
+            'provider_calls': self.provider_calls,
+            'cache_hits': self.cache_hits,
+            'cache_hit_rate': round(self.cache_hits / self.calls, 4) if self.calls else None,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.prompt_tokens + self.completion_tokens,
+            'estimated_token_calls': self.estimated,
+            'latency_ms': {
+                'avg': round(self.latency_total / self.provider_calls, 1) if self.provider_calls else None,
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(self.latency_max, 1)
+            }
+        }
+
+
+class AIMetrics:
+    """In-process registry of AI call records with per-endpoint, content type and user rollups"""
+
+    def __init__(self, enabled=AI_METRICS_ENABLED, export_path=AI_METRICS_EXPORT, max_users=AI_METRICS_MAX_USERS):
+        self.enabled = enabled
+        self.export_path = export_path
+        self.max_users = max(1, max_users)
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._export = None
+        self.totals = _Rollup()
+        self.by_endpoint = {}
+        self.by_content_type = {}
+        self.by_user = {}
+        self.recent = deque(maxlen=RECENT_CALLS)
+
+    def record(self, content_type, status='ok', latency=0.0, prompt_tokens=0, completion_tokens=0,
+               cache_hit=False, coalesced=False, estimated=False):
+        """Record one AI call; latency in seconds"""
+        if not self.enabled:
+            return
+        context = _call_context.get()
+        record = {
+            'time': time.time(),
+            'endpoint': context['endpoint'],
+            'user': context['user'],
+            'content_type': content_type or 'unknown',
+            'status': status,
+            'latency_ms': round(latency * 1000, 1),
+            'prompt_tokens': prompt_tokens or 0,
+            'completion_tokens': completion_tokens or 0,
+            'cache_hit': cache_hit,
+            'coalesced': coalesced,
+            'estimated': estimated
+        }
+        with self._lock:
+            self.totals.add(record)
+            self.by_endpoint.setdefault(record['endpoint'], _Rollup()).add(record)
+            self.by_content_type.setdefault(record['content_type'], _Rollup()).add(record)
+            user = record['user']
+            if user not in self.by_user and len(self.by_user) >= self.max_users:
+                user = OTHER_USERS
+            self.by_user.setdefault(user, _Rollup()).add(record)
+            self.recent.append(record)
+            self._write(record)
+
+    def _write(self, record):
+        # Called with self._lock held
+        if not self.export_path:
+            return
+        try:
+            if self._export is None:
+                self._export = open(self.export_path, 'a', encoding='utf-8', buffering=1)
+            self._export.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.warning(f"AI metrics export to {self.export_path} disabled: {e}")
+            self.export_path = ''
+
+    def record_cache_hit(self, content_type):
+        self.record(content_type, cache_hit=True)
+
+    def record_coalesced(self, content_type):
+        self.record(content_type, coalesced=True)
+
+    @contextmanager
+    def track(self, content_type, prompt):
+        """Time one provider call; call.observe(response) inside the block"""
+        call = AICall(content_type, prompt)
+        started = time.perf_counter()
+        try:
+            yield call
+        except requests.exceptions.Timeout:
+            call.status = 'timeout'
+            raise
+        finally:
+            estimated = call.prompt_tokens is None or call.completion_tokens is None
+            self.record(
+                content_type,
+                status=call.status,
+                latency=time.perf_counter() - started,
+                prompt_tokens=_estimate(call.prompt) if call.prompt_tokens is None else call.prompt_tokens,
+                completion_tokens=(_estimate(call.completion_text) if call.completion_tokens is None
+                                   else call.completion_tokens),
+                estimated=estimated
+            )
+
+    def snapshot(self):
+        """Rollups for the metrics endpoint"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'since': self.started,
+                'export_path': self.export_path or None,
+                'totals': self.totals.snapshot(),
+                'by_endpoint': {key: rollup.snapshot() for key, rollup in self.by_endpoint.items()},
+                'by_content_type': {key: rollup.snapshot() for key, rollup in self.by_content_type.items()},
+                'by_user': {key: rollup.snapshot() for key, rollup in self.by_user.items()},
+                'recent_calls': list(self.recent)
+            }
+
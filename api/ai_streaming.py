@@ -0,0 +1,76 @@
+"""
+Streaming AI Suggestions
+========================
+
+Helpers for consuming the provider's OpenAI-compatible token stream and
+re-publishing suggestions to browsers as Server-Sent Events.
+
+The provider sends `data: {json}` lines whose choices[0].delta.content hold
+a few tokens each, ending with `data: [DONE]`. Tokens are reassembled into
+lines so each numbered suggestion can be forwarded the moment its line ends.
+"""
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # keep reverse proxies from buffering the stream
+}
+
+
+def iter_chat_deltas(response, usage=None):
+    """
+    Yield content fragments from a streamed chat completion response
+    A `usage` block in the stream (sent by some providers on the last chunk) is copied into usage
+    """
+    # Lines are decoded here: SSE is always UTF-8, but requests would guess ISO-8859-1
+    # for a text/event-stream Content-Type that names no charset
+    for raw_line in response.iter_lines():
+        raw_line = raw_line.decode('utf-8', errors='replace')
+        if not raw_line or not raw_line.startswith('data:'):
+            continue
+        payload = raw_line[len('data:'):].strip()
+        if payload == '[DONE]':
+            break
+        try:
+            chunk = json.loads(payload)
+        except ValueError:
+            logger.warning(f"Skipping malformed stream chunk: {payload[:100]}")
+            continue
+        if usage is not None and isinstance(chunk.get('usage'), dict):
+            usage.update(chunk['usage'])
+        choices = chunk.get('choices') or [{}]
+        content = (choices[0].get('delta') or {}).get('content')
+        if content:
+            yield content
+
+
+class LineAssembler:
+    """Turn arbitrary text fragments into complete lines"""
+
+    def __init__(self):
+        self._buffer = ''
+
+    def feed(self, fragment):
+        """Add a fragment and return the lines it completed"""
+        self._buffer += fragment
+        *lines, self._buffer = self._buffer.split('\n')
+        return lines
+
+    def flush(self):
+        """Return whatever is left as a final line (possibly empty)"""
+        line, self._buffer = self._buffer, ''
+        return line
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def wants_event_stream(request, data):
+    """True when the client asked for SSE via "stream": true or its Accept header"""
+    return data.get('stream') is True or 'text/event-stream' in request.headers.get('Accept', '')
@@ -0,0 +1,290 @@
+"""
+Adaptive Concurrency Control for AI Requests
+============================================
+
+One controller per process sits in front of every call to the AI provider:
+
+- The number of requests in flight adapts AIMD-style. Each success raises
+  the limit by 1/limit (about +1 per round of requests), and a 429, 5xx or
+  timeout halves it, at most once per DECREASE_INTERVAL so that a burst of
+  failures from one overload counts once.
+- Retry-After on a throttled response pauses new requests until it passes.
+- A rolling tokens-per-minute budget is charged with an estimate when a
+  request starts and corrected with the reported usage when it ends. The
+  budget comes from AI_TOKENS_PER_MINUTE or, if unset, from the provider's
+  x-ratelimit-limit-tokens-minute header once one has been seen.
+- Throttled and 5xx responses are retried a bounded number of times.
+
+status() exposes the current limit, usage and recent throttle events.
+
+Environment Variables:
+- AI_MAX_IN_FLIGHT: ceiling for concurrent requests (default 8)
+- AI_MIN_IN_FLIGHT: floor the limit is never cut below (default 1)
+- AI_INITIAL_IN_FLIGHT: starting limit (default 4)
+- AI_TOKENS_PER_MINUTE: token budget per rolling minute (default 0 = learn from headers)
+- AI_CONNECT_TIMEOUT / AI_READ_TIMEOUT: per-request timeouts in seconds (default 5 / 60)
+- AI_MAX_RETRIES: retries for throttled or 5xx responses (default 2)
+- AI_QUEUE_TIMEOUT: longest a request waits for a slot in seconds (default 60)
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+AI_MAX_IN_FLIGHT = int(os.environ.get('AI_MAX_IN_FLIGHT', '8'))
+AI_MIN_IN_FLIGHT = int(os.environ.get('AI_MIN_IN_FLIGHT', '1'))
+AI_INITIAL_IN_FLIGHT = int(os.environ.get('AI_INITIAL_IN_FLIGHT', '4'))
+AI_TOKENS_PER_MINUTE = int(os.environ.get('AI_TOKENS_PER_MINUTE', '0'))
+AI_CONNECT_TIMEOUT = float(os.environ.get('AI_CONNECT_TIMEOUT', '5'))
+AI_READ_TIMEOUT = float(os.environ.get('AI_READ_TIMEOUT', '60'))
+AI_MAX_RETRIES = int(os.environ.get('AI_MAX_RETRIES', '2'))
+AI_QUEUE_TIMEOUT = float(os.environ.get('AI_QUEUE_TIMEOUT', '60'))
+
+# requests-style (connect, read) timeout for provider calls
+AI_REQUEST_TIMEOUT = (AI_CONNECT_TIMEOUT, AI_READ_TIMEOUT)
+
+TOKEN_WINDOW_SECONDS = 60.0
+DECREASE_INTERVAL = 2.0
+MAX_BACKOFF_SECONDS = 8.0
+RECENT_EVENTS = 50
+
+
+class AIThrottleTimeout(Exception):
+    """Raised when no request slot frees up within the queue timeout"""
+
+
+def estimate_tokens(prompt, max_tokens):
+    """Rough token cost of a request before the provider reports usage (~4 chars per token)"""
+    return len(prompt) // 4 + max_tokens
+
+
+def _parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP-date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestOutcome:
+    """What one provider call did, filled in by observe() and read by the controller"""
+
+    def __init__(self, estimated_tokens):
+        self.estimated_tokens = estimated_tokens
+        self.kind = 'error'
+        self.status_code = None
+        self.retry_after = None
+        self.tokens_used = None
+        self.tokens_limit = None
+
+    def observe(self, response):
+        self.status_code = response.status_code
+        if response.status_code == 429:
+            self.kind = 'throttled'
+        elif response.status_code >= 500:
+            self.kind = 'server_error'
+        elif response.status_code < 400:
+            self.kind = 'ok'
+        else:
+            self.kind = 'client_error'
+
+        headers = response.headers
+        self.retry_after = _parse_retry_after(headers.get('Retry-After'))
+        try:
+            self.tokens_limit = int(headers.get('x-ratelimit-limit-tokens-minute', ''))
+        except ValueError:
+            pass
+
+        # Streamed bodies must not be read here; JSON replies report their usage
+        if self.kind == 'ok' and 'json' in headers.get('Content-Type', ''):
+            try:
+                self.tokens_used = int(response.json().get('usage', {}).get('total_tokens'))
+            except (ValueError, TypeError, AttributeError):
+                pass
+
+
+class AdaptiveConcurrencyController:
+    """Process-wide AIMD limit, Retry-After pauses and token budget for AI calls"""
+
+    def __init__(self, min_limit=AI_MIN_IN_FLIGHT, initial_limit=AI_INITIAL_IN_FLIGHT,
+                 max_limit=AI_MAX_IN_FLIGHT, tokens_per_minute=AI_TOKENS_PER_MINUTE,
+                 max_retries=AI_MAX_RETRIES, queue_timeout=AI_QUEUE_TIMEOUT):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.tokens_per_minute = max(0, tokens_per_minute)
+        self._budget_configured = self.tokens_per_minute > 0
+        self.max_retries = max(0, max_retries)
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._reserved_tokens = 0
+        self._usage = deque()
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self.events = deque(maxlen=RECENT_EVENTS)
+        self.counters = {
+            'requests': 0,
+            'successes': 0,
+            'throttled': 0,
+            'server_errors': 0,
+            'timeouts': 0,
+            'retries': 0,
+            'decreases': 0,
+            'queued': 0,
+            'queue_timeouts': 0
+        }
+
+    def _event(self, kind, **detail):
+        self.events.append({'time': time.time(), 'event': kind, **detail})
+
+    def _tokens_in_window(self, now):
+        while self._usage and self._usage[0][0] <= now - TOKEN_WINDOW_SECONDS:
+            self._usage.popleft()
+        return sum(tokens for _, tokens in self._usage) + self._reserved_tokens
+
+    def _wait_needed(self, now, estimated_tokens):
+        """0 if a request may start now, else seconds to wait (None = until a release)"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.tokens_per_minute:
+            used = self._tokens_in_window(now)
+            # A single oversized request may still go through an otherwise idle window
+            if used and used + estimated_tokens > self.tokens_per_minute:
+                if self._usage:
+                    return max(0.05, self._usage[0][0] + TOKEN_WINDOW_SECONDS - now)
+                return None
+        return 0
+
+    def acquire(self, estimated_tokens, block=True):
+        """
+        Take a request slot, waiting up to the queue timeout for one
+        With block=False returns False at once instead of waiting; True when a slot was taken
+        """
+        deadline = time.monotonic() + self.queue_timeout
+        with self._cond:
+            queued = False
+            while True:
+                now = time.monotonic()
+                wait = self._wait_needed(now, estimated_tokens)
+                if wait == 0:
+                    break
+                if not block:
+                    return False
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.counters['queue_timeouts'] += 1
+                    raise AIThrottleTimeout(f'No AI request slot within {self.queue_timeout:g}s')
+                if not queued:
+                    queued = True
+                    self.counters['queued'] += 1
+                self._cond.wait(remaining if wait is None else min(wait, remaining))
+
+            self.in_flight += 1
+            self._reserved_tokens += estimated_tokens
+            self.counters['requests'] += 1
+        return True
+
+    def release(self, outcome):
+        with self._cond:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self._reserved_tokens -= outcome.estimated_tokens
+            used = outcome.tokens_used if outcome.tokens_used is not None else outcome.estimated_tokens
+            self._usage.append((now, used))
+
+            if outcome.tokens_limit and not self._budget_configured and outcome.tokens_limit != self.tokens_per_minute:
+                self.tokens_per_minute = outcome.tokens_limit
+                self._event('budget_learned', tokens_per_minute=outcome.tokens_limit)
+
+            if outcome.kind == 'ok':
+                self.counters['successes'] += 1
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            elif outcome.kind in ('throttled', 'server_error', 'timeout'):
+                self.counters[{'throttled': 'throttled', 'server_error': 'server_errors',
+                               'timeout': 'timeouts'}[outcome.kind]] += 1
+                if now - self._last_decrease >= DECREASE_INTERVAL:
+                    previous = self.limit
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+                    self.counters['decreases'] += 1
+                    self._event('decrease', reason=outcome.kind, status=outcome.status_code,
+                                limit_from=round(previous, 2), limit_to=round(self.limit, 2))
+                    logger.warning(f"AI concurrency limit cut to {int(self.limit)} after {outcome.kind}")
+
+            if outcome.retry_after:
+                self.paused_until = max(self.paused_until, now + outcome.retry_after)
+                self._event('retry_after', seconds=round(outcome.retry_after, 2))
+
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, estimated_tokens):
+        """Hold one request slot; call outcome.observe(response) inside the block"""
+        self.acquire(estimated_tokens)
+        with self.held(estimated_tokens) as outcome:
+            yield outcome
+
+    @contextmanager
+    def held(self, estimated_tokens):
+        """Like slot() for a slot already taken with acquire(); releases it at the end of the block"""
+        outcome = RequestOutcome(estimated_tokens)
+        try:
+            yield outcome
+        except requests.exceptions.Timeout:
+            outcome.kind = 'timeout'
+            raise
+        finally:
+            self.release(outcome)
+
+    def request(self, send, estimated_tokens):
+        """Call send() (which returns a response) under the controller, retrying throttled and 5xx replies"""
+        for attempt in range(self.max_retries + 1):
+            with self.slot(estimated_tokens) as outcome:
+                response = send()
+                outcome.observe(response)
+
+            if outcome.kind not in ('throttled', 'server_error') or attempt == self.max_retries:
+                return response
+
+            with self._cond:
+                self.counters['retries'] += 1
+            logger.warning(f"AI request got HTTP {response.status_code}, retry {attempt + 1}/{self.max_retries}")
+            if not outcome.retry_after:
+                # Retry-After pauses every caller through acquire(); otherwise back off here
+                time.sleep(min(MAX_BACKOFF_SECONDS, 0.5 * 2 ** attempt))
+        return response
+
+    def status(self):
+        """Current limit, usage and recent throttle events"""
+        with self._cond:
+            now = time.monotonic()
+            return {
+                'limit': int(self.limit),
+                'limit_exact': round(self.limit, 2),
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'in_flight': self.in_flight,
+                'paused_for_seconds': round(max(0.0, self.paused_until - now), 2),
+                'tokens_per_minute': self.tokens_per_minute or None,
+                'tokens_last_minute': self._tokens_in_window(now),
+                **self.counters,
+                'recent_events': list(self.events)
+            }
@@ -0,0 +1,659 @@
+"""
+Single-parse Change Engine
+==========================
+
+/apply-changes used to re-parse the whole document, call get_text() on
+every element and serialize back to a string for each change. ChangeEngine
+parses at most once, indexes the document's text nodes and applies every
+change to that index.
+
+Changes that match the source exactly are replaced in the source string
+while no other change has needed the tree, so a request made only of exact
+matches is never parsed. The first change that needs more parses the
+document once and it and every later change work on the parsed tree.
+
+The index is the list of visible text nodes in document order and their
+concatenation, so text split across inline tags ("Save <b>50%</b> today")
+is one continuous string. A match is a span of that string. Replacing a span
+rewrites only the text nodes it covers and keeps the markup around them.
+
+The first change that gets past an exact match locates every change still
+waiting at once with a TextLocator (text_locator.py): one normalized
+projection of the visible text (NFKC, case-folded, entity-decoded,
+whitespace collapsed) searched for all the change strings in a single
+Aho-Corasick pass. Each located span is carried through the edits made
+before its change comes up and checked again before use; a change whose
+span was disturbed, or that only matches text written by an earlier
+change, falls back to a regex search.
+
+Changes that carry an element id from the scrape's element map are applied
+first, straight to that element in the source (element_ids.py). The rest,
+and any whose element no longer holds their text, are located with the
+same fallback order as before, and the strategy that succeeded is reported:
+
+0. element_id - the element named by the change's id
+1. emoji    - text with leading emojis (matched without them, NFC-normalized
+               or entity-decoded)
+2. direct   - exact text
+3. text_node - whitespace-insensitive match inside one text node
+4. element  - whitespace-insensitive match across several text nodes
+5. regex    - case-insensitive, whitespace-insensitive match
+
+The result is never re-serialized from the tree. Each text node is matched
+to its range in the source with one HTMLParser pass, and edited nodes are
+written back into those ranges, so everything the changes didn't touch
+(attribute quoting, entities, whitespace) stays byte for byte as it was.
+The same ranges give the edits as patches: [start, end) replacements of
+the round's input HTML, which is all a client holding that HTML needs.
+Patch offsets are in UTF-16 code units, the way JavaScript indexes strings,
+so a browser can splice them with slice() even when the page has emoji or
+other characters outside the Basic Multilingual Plane. If the text nodes
+can't be matched to the source the tree is serialized and no patches are
+available.
+
+An engine can take several rounds of changes. WarmEngines keeps the engines
+of recently edited stored documents, so the next round of edits to the same
+document skips reading it from the store again, and parsing it again when
+an earlier round built the tree. Engines that have only edited the source
+are kept too.
+
+Environment Variables:
+- WARM_DOCUMENTS: parsed documents kept for further edits (default 4, 0 disables)
+- WARM_DOCUMENT_CHARS: total size of the kept documents in characters (default 32000000)
+"""
+
+import html
+import logging
+import os
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+from bs4.element import CData, Comment, Declaration, Doctype, NavigableString, ProcessingInstruction
+
+from element_ids import find_element, locate_by_id, parse_element_id, text_key
+from text_locator import TextLocator, block_of, normalize_pattern
+
+logger = logging.getLogger(__name__)
+
+WARM_DOCUMENTS = int(os.environ.get('WARM_DOCUMENTS', '4'))
+WARM_DOCUMENT_CHARS = int(os.environ.get('WARM_DOCUMENT_CHARS', '32000000'))
+
+EMOJI_PATTERN = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002702-\U000027B0"  # dingbats
+    "\U000024C2-\U0001F251"
+    "✅✓☑️"  # checkmarks
+    "]+", flags=re.UNICODE
+)
+
+# Text inside these is not page copy
+NON_TEXT_ELEMENTS = frozenset(['script', 'style', 'template', 'noscript'])
+NON_TEXT_STRINGS = (Comment, Declaration, Doctype, ProcessingInstruction)
+# Strings that are not character data in the source
+MARKUP_STRINGS = NON_TEXT_STRINGS + (CData,)
+# Characters that take two UTF-16 code units (a surrogate pair) in a JavaScript string
+ASTRAL_PATTERN = re.compile('[\U00010000-\U0010FFFF]')
+
+STRATEGIES = ('emoji', 'direct', 'text_node', 'element', 'regex')
+
+
+def utf16_length(text):
+    """Length of text as a JavaScript string"""
+    return len(text) + sum(1 for _ in ASTRAL_PATTERN.finditer(text))
+
+
+def _utf16_offsets(text, offsets):
+    """Code point offsets into text as UTF-16 code unit offsets"""
+    astral = [match.start() for match in ASTRAL_PATTERN.finditer(text)]
+    if not astral:
+        return list(offsets)
+    return [offset + bisect_left(astral, offset) for offset in offsets]
+
+
+def _flexible_pattern(text, flags=0):
+    """Regex matching text's words separated by any (or no) whitespace, or None for blank text"""
+    words = text.split()
+    if not words:
+        return None
+    return re.compile(r'\s*'.join(re.escape(word) for word in words), flags)
+
+
+def _squeezed(text):
+    return ''.join(text.split())
+
+
+def _markup_text(text):
+    """Visible text of a change string that contains markup"""
+    if '<' in text and '>' in text:
+        return BeautifulSoup(text, 'html.parser').get_text()
+    return text
+
+
+class SourcePatches:
+    """
+    Non-overlapping replacements of [start, end) ranges of a base string, kept in base offsets
+    Each edit is given in offsets of the current text: the base with every patch so far applied
+    """
+
+    def __init__(self, base, patches=()):
+        self.base = base
+        self.patches = list(patches)
+
+    def replace(self, start, end, text):
+        before, overlapping, after = [], [], []
+        delta = 0
+        delta_before = 0
+        for patch in self.patches:
+            patch_start, patch_end, patch_text = patch
+            current_start = patch_start + delta
+            current_end = current_start + len(patch_text)
+            if current_end < start:
+                before.append(patch)
+                delta_before += len(patch_text) - (patch_end - patch_start)
+            elif current_start > end:
+                after.append(patch)
+            else:
+                overlapping.append((patch, current_start))
+            delta += len(patch_text) - (patch_end - patch_start)
+
+        if not overlapping:
+            base_start, base_end, prefix, suffix = start - delta_before, end - delta_before, '', ''
+        else:
+            (first_start, _, first_text), first_current = overlapping[0]
+            (_, last_end, last_text), last_current = overlapping[-1]
+            delta_through = delta_before + sum(len(t) - (e - s) for (s, e, t), _ in overlapping)
+            if start < first_current:
+                base_start, prefix = start - delta_before, ''
+            else:
+                base_start, prefix = first_start, first_text[:start - first_current]
+            if end > last_current + len(last_text):
+                base_end, suffix = end - delta_through, ''
+            else:
+                base_end, suffix = last_end, last_text[end - last_current:]
+        self.patches = before + [(base_start, base_end, prefix + text + suffix)] + after
+
+    def render(self):
+        pieces = []
+        position = 0
+        for start, end, text in self.patches:
+            pieces.append(self.base[position:start])
+            pieces.append(text)
+            position = end
+        pieces.append(self.base[position:])
+        return ''.join(pieces)
+
+
+class _TextRuns(HTMLParser):
+    """Source ranges of the runs of character data, in the order html.parser trees hold them"""
+
+    def __init__(self, source):
+        super().__init__(convert_charrefs=False)
+        self.runs = []
+        self._start = None
+        self.line_starts = [0]
+        for match in re.finditer('\n', source):
+            self.line_starts.append(match.end())
+
+    def _offset(self):
+        line, column = self.getpos()
+        return self.line_starts[line - 1] + column
+
+    def _data(self, *args):
+        if self._start is None:
+            self._start = self._offset()
+
+    def _markup(self, *args):
+        if self._start is not None:
+            self.runs.append((self._start, self._offset()))
+            self._start = None
+
+    handle_data = handle_entityref = handle_charref = _data
+    handle_starttag = handle_endtag = handle_startendtag = _markup
+    handle_comment = handle_decl = handle_pi = unknown_decl = _markup
+
+
+def _string_ranges(source, soup):
+    """{id(string): (start, end)} source range of every character-data string in soup, or None"""
+    finder = _TextRuns(source)
+    finder.feed(source)
+    finder.close()
+    if finder._start is not None:
+        finder.runs.append((finder._start, len(source)))
+    strings = [
+        node for node in soup.descendants
+        if isinstance(node, NavigableString) and not isinstance(node, MARKUP_STRINGS)
+    ]
+    if len(strings) != len(finder.runs):
+        return None
+    ranges = {}
+    for node, (start, end) in zip(strings, finder.runs):
+        raw = source[start:end]
+        # The tree keeps whitespace-only strings as a single space or newline
+        if str(node) != html.unescape(raw) and (node.strip() or raw.strip()):
+            return None
+        ranges[id(node)] = (start, end)
+    return ranges
+
+
+class ChangeEngine:
+    """Apply many text changes to one parsed document"""
+
+    def __init__(self, html_content):
+        self.source = html_content
+        self.soup = None
+        self.changed = False
+        # Edits made to the source before it was parsed, in offsets of this round's input
+        self._patches = SourcePatches(html_content)
+        # Source range of each text node (None when they could not be matched up) and their new texts
+        self.ranges = None
+        self._node_edits = {}
+        # Originals of the changes not applied yet, set by apply_all so they can be located together
+        self.upcoming = ()
+        self._located = None
+        # (start, old end, new length) of each edit to the joined text since the changes were located
+        self._edits = []
+
+    def _parse(self):
+        """Build the tree and text index from the source as edited so far (at most once)"""
+        self.soup = BeautifulSoup(self.source, 'html.parser')
+        self.nodes = [
+            node for node in self.soup.find_all(string=True)
+            if not isinstance(node, NON_TEXT_STRINGS)
+            and not any(parent.name in NON_TEXT_ELEMENTS for parent in node.parents)
+        ]
+        string_ranges = _string_ranges(self.source, self.soup)
+        if string_ranges is None:
+            logger.warning("Text nodes could not be matched to the source; changes will re-serialize the page")
+        else:
+            self.ranges = [string_ranges[id(node)] for node in self.nodes]
+        self._rebuild()
+
+    def _locate_upcoming(self):
+        """Find every pending change's text in one pass over the normalized projection"""
+        segments = []
+        previous_block = None
+        for node, start in zip(self.nodes, self.starts):
+            block = block_of(node)
+            segments.append((str(node), start, block is not previous_block))
+            previous_block = block
+        patterns = [normalize_pattern(_markup_text(original)) for original in self.upcoming
+                    if isinstance(original, str)]
+        self._located = TextLocator(segments).find_first(patterns)
+        self._edits = []
+
+    def _located_span(self, text):
+        """Span of text found by the locator, moved past later edits; None if missing or disturbed"""
+        if self._located is None:
+            self._locate_upcoming()
+        pattern = normalize_pattern(text)
+        span = self._located.get(pattern)
+        if span is None:
+            return None
+        start, end = span
+        for edit_start, edit_end, length in self._edits:
+            if end <= edit_start:
+                continue
+            if start < edit_end:
+                return None
+            start += length - (edit_end - edit_start)
+            end += length - (edit_end - edit_start)
+        # Block boundaries count as a space in the projection but may have none in the text
+        if _squeezed(normalize_pattern(self.joined[start:end])) != _squeezed(pattern):
+            return None
+        return start, end
+
+    def _locate(self, original):
+        """Current span of original's visible text, matched ignoring case and whitespace"""
+        text = _markup_text(original)
+        span = self._located_span(text)
+        if span is None:
+            pattern = _flexible_pattern(text, re.IGNORECASE)
+            match = pattern.search(self.joined) if pattern else None
+            span = match.span() if match else None
+        return span
+
+    def _apply_to_source(self, original, modified):
+        """
+        Before the tree is needed, exact matches are replaced in the source string itself,
+        as the emoji and direct strategies always did; returns the strategy name or None
+        """
+        emojis = EMOJI_PATTERN.findall(original)
+        if emojis:
+            without_emojis = EMOJI_PATTERN.sub('', original).strip()
+            position = self.source.find(without_emojis) if without_emojis else -1
+            if position >= 0:
+                self._edit_source(position, position + len(without_emojis), ''.join(emojis) + modified)
+                return 'emoji'
+        position = self.source.find(original)
+        if position >= 0:
+            self._edit_source(position, position + len(original), modified)
+            return 'direct'
+        return None
+
+    def _edit_source(self, start, end, replacement):
+        self._patches.replace(start, end, replacement)
+        self.source = self.source[:start] + replacement + self.source[end:]
+
+    def _rebuild(self):
+        """Compute the concatenated text and node offsets (cheap: no tree walk)"""
+        texts = [str(node) for node in self.nodes]
+        self.starts = []
+        position = 0
+        for text in texts:
+            self.starts.append(position)
+            position += len(text)
+        self.joined = ''.join(texts)
+
+    def _splice(self, first, last, start, end, replacement):
+        """
+        Update the index after text nodes first..last, covering joined text [start, end),
+        were rewritten so that span reads replacement; the nodes left in that range are
+        already in self.nodes[first:last + 1] (removed ones as None)
+        """
+        self._edits.append((start, end, len(replacement)))
+        kept = [index for index in range(first, last + 1) if self.nodes[index] is not None]
+        position = self.starts[first]
+        starts = []
+        for index in kept:
+            starts.append(position)
+            position += len(str(self.nodes[index]))
+        shift = len(replacement) - (end - start)
+        if self.ranges is not None:
+            self.ranges[first:last + 1] = [self.ranges[index] for index in kept]
+        self.nodes[first:last + 1] = [self.nodes[index] for index in kept]
+        self.starts[first:] = starts + [offset + shift for offset in self.starts[last + 1:]]
+        self.joined = self.joined[:start] + replacement + self.joined[end:]
+        self.changed = True
+
+    def _node_at(self, offset):
+        return bisect_right(self.starts, offset) - 1
+
+    def _set_node_text(self, index, text):
+        node = self.nodes[index]
+        if self.ranges is not None:
+            self._node_edits[self.ranges[index]] = text
+        if text:
+            replacement = NavigableString(text)
+            node.replace_with(replacement)
+            self.nodes[index] = replacement
+        else:
+            node.extract()
+            self.nodes[index] = None
+
+    def replace_span(self, start, end, replacement):
+        """Replace joined-text characters [start, end) with replacement"""
+        first, last = self._node_at(start), self._node_at(max(start, end - 1))
+        first_text = str(self.nodes[first])
+        prefix = first_text[:start - self.starts[first]]
+        suffix = str(self.nodes[last])[end - self.starts[last]:]
+
+        if first == last:
+            self._set_node_text(first, prefix + replacement + suffix)
+        else:
+            self._set_node_text(first, prefix + replacement)
+            for index in range(first + 1, last):
+                self._set_node_text(index, '')
+            self._set_node_text(last, suffix)
+        self._splice(first, last, start, end, replacement)
+
+    # --- strategies ---------------------------------------------------------
+
+    def _try_element_id(self, change):
+        """Replace the text of the element named by change['id'] in the parsed tree"""
+        parsed = parse_element_id(change.get('id'))
+        element = find_element(self.soup, parsed[2]) if parsed else None
+        if element is None:
+            return False
+        inside = {id(node) for node in element.find_all(string=True)}
+        indexes = [index for index, node in enumerate(self.nodes) if id(node) in inside]
+        if not indexes:
+            return False
+        start = self.starts[indexes[0]]
+        end = self.starts[indexes[-1]] + len(str(self.nodes[indexes[-1]]))
+        key = text_key(self.joined[start:end])
+        if key != text_key(change['original']) and key != parsed[1]:
+            return False
+        self.replace_span(start, end, change['modified'])
+        return True
+
+    def _find_exact(self, needle):
+        position = self.joined.find(needle) if needle else -1
+        return (position, position + len(needle)) if position >= 0 else None
+
+    def _try_emoji(self, original, modified):
+        emojis = EMOJI_PATTERN.findall(original)
+        if not emojis:
+            return False
+        without_emojis = EMOJI_PATTERN.sub('', original).strip()
+        span = self._find_exact(without_emojis)
+        if span:
+            before = self.joined[max(0, span[0] - 8):span[0]].rstrip()
+            if before and EMOJI_PATTERN.match(before[-1]):
+                # The page already shows the emojis in front of the text: keep them and change the text
+                self.replace_span(*span, EMOJI_PATTERN.sub('', modified).strip())
+            else:
+                self.replace_span(*span, ''.join(emojis) + modified)
+            return True
+        for variant in (unicodedata.normalize('NFC', original), html.unescape(original)):
+            span = self._find_exact(variant) if variant != original else None
+            if span:
+                self.replace_span(*span, modified)
+                return True
+        return False
+
+    def _try_direct(self, original, modified):
+        for needle in dict.fromkeys((original, html.unescape(original), _markup_text(original))):
+            span = self._find_exact(needle)
+            if span:
+                self.replace_span(*span, modified)
+                return True
+        return False
+
+    def _try_text_node(self, original, modified, span):
+        if span is None or _squeezed(self.joined[span[0]:span[1]]) != _squeezed(_markup_text(original)):
+            return False
+        if self._node_at(span[0]) != self._node_at(span[1] - 1):
+            return False
+        self.replace_span(*span, modified)
+        return True
+
+    def _try_element(self, original, modified, span):
+        if span is None or _squeezed(self.joined[span[0]:span[1]]) != _squeezed(_markup_text(original)):
+            return False
+        self.replace_span(*span, modified)
+        return True
+
+    def _try_regex(self, original, modified, span):
+        if span is None:
+            return False
+        self.replace_span(*span, modified)
+        return True
+
+    def apply(self, original, modified):
+        """Apply one change; returns the name of the strategy that matched, or None"""
+        if not original or not original.strip():
+            return None
+        if self.soup is None:
+            strategy = self._apply_to_source(original, modified)
+            if strategy is not None:
+                return strategy
+            self._parse()
+        if self._try_emoji(original, modified):
+            return 'emoji'
+        if self._try_direct(original, modified):
+            return 'direct'
+        span = self._locate(original)
+        for name in STRATEGIES[2:]:
+            if getattr(self, f'_try_{name}')(original, modified, span):
+                return name
+        return None
+
+    def apply_all(self, changes):
+        """
+        Apply [{original, modified, id?, span?}, ...] in order, or {id: {original, modified}, ...}
+        Returns a report entry per change: its index (and id), whether it applied and the strategy used
+        """
+        if isinstance(changes, dict):
+            changes = [
+                {**change, 'id': element_id} if isinstance(change, dict) else change
+                for element_id, change in changes.items()
+            ]
+        self._start_round()
+        by_id = set()
+        tried_on_source = self.soup is None and any(isinstance(change, dict) and change.get('id') for change in changes)
+        if tried_on_source:
+            for index, start, end, replacement in locate_by_id(
+                    self.source, [change if isinstance(change, dict) else {} for change in changes]):
+                # Splices come from the end of the page back, so each leaves the earlier offsets valid
+                self._patches.replace(start, end, replacement)
+                by_id.add(index)
+            if by_id:
+                self.source = self._patches.render()
+
+        report = []
+        originals = [change.get('original') if isinstance(change, dict) else None for change in changes]
+        for index, change in enumerate(changes):
+            if not isinstance(change, dict) or 'original' not in change or 'modified' not in change:
+                report.append({'index': index, 'applied': False, 'strategy': None, 'reason': 'invalid change'})
+                continue
+            if index in by_id or (not tried_on_source and self.soup is not None and change.get('id')
+                                  and self._try_element_id(change)):
+                strategy = 'element_id'
+            else:
+                self.upcoming = originals[index:]
+                strategy = self.apply(change['original'], change['modified'])
+                if strategy is None:
+                    logger.warning(f"Could not find text to replace: '{str(change['original'])[:50]}...'")
+            entry = {'index': index, 'applied': strategy is not None, 'strategy': strategy}
+            if change.get('id'):
+                entry['id'] = change['id']
+            report.append(entry)
+        return report
+
+    def _start_round(self):
+        """Make the document as edited so far the input that the next changes and patches refer to"""
+        self._located = None
+        if not self._patches.patches and not self.changed:
+            return
+        source = self.html()
+        if self.ranges is not None and self._node_edits:
+            edits = sorted((span, html.escape(text, quote=False)) for span, text in self._node_edits.items())
+            ranges = []
+            shift = 0
+            position = 0
+            for start, end in self.ranges:
+                while position < len(edits) and edits[position][0][0] < start:
+                    (edit_start, edit_end), text = edits[position]
+                    shift += len(text) - (edit_end - edit_start)
+                    position += 1
+                if position < len(edits) and edits[position][0] == (start, end):
+                    text = edits[position][1]
+                    ranges.append((start + shift, start + shift + len(text)))
+                    shift += len(text) - (end - start)
+                    position += 1
+                else:
+                    ranges.append((start + shift, end + shift))
+            self.ranges = ranges
+        self.source = source
+        self._patches = SourcePatches(source)
+        self._node_edits = {}
+        self.changed = False
+
+    def patches(self):
+        """
+        This round's edits as [{start, end, html}]: replacements of [start, end) of the HTML
+        the round started from, in order and never overlapping (apply them from the last
+        one back); None when the tree was edited but its text nodes could not be matched
+        to the source. Offsets are UTF-16 code units, as JavaScript indexes strings
+        """
+        if self.changed and self.ranges is None:
+            return None
+        patches = SourcePatches(self._patches.base, self._patches.patches)
+        if self._node_edits:
+            # Node ranges are in offsets of the source as parsed, which is the base with the patches applied
+            for (start, end), text in sorted(self._node_edits.items(), reverse=True):
+                patches.replace(start, end, html.escape(text, quote=False))
+        offsets = _utf16_offsets(patches.base, [offset for start, end, _ in patches.patches for offset in (start, end)])
+        return [
+            {'start': offsets[2 * index], 'end': offsets[2 * index + 1], 'html': text}
+            for index, (_, _, text) in enumerate(patches.patches)
+        ]
+
+    def html(self):
+        """The document with all changes applied, spliced into the source (re-serialized only as a fallback)"""
+        if not self.changed:
+            return self.source
+        if self.ranges is None:
+            return str(self.soup)
+        pieces = []
+        position = 0
+        for (start, end), text in sorted(self._node_edits.items()):
+            pieces.append(self.source[position:start])
+            pieces.append(html.escape(text, quote=False))
+            position = end
+        pieces.append(self.source[position:])
+        return ''.join(pieces)
+
+
+class WarmEngines:
+    """
+    LRU of ChangeEngines for recently edited stored documents, keyed by document id
+    An engine is taken out while a request edits it, so no two requests share one
+    """
+
+    def __init__(self, max_documents=WARM_DOCUMENTS, max_chars=WARM_DOCUMENT_CHARS):
+        self.max_documents = max_documents
+        self.max_chars = max_chars
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def take(self, document_id):
+        """The warm engine for document_id, removed from the cache, or None"""
+        with self._lock:
+            entry = self._engines.pop(document_id, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.chars -= entry[1]
+            return entry[0]
+
+    def put(self, document_id, engine, size):
+        """Keep engine, whose document is now stored as document_id and is size characters long"""
+        if self.max_documents <= 0 or size > self.max_chars:
+            return
+        with self._lock:
+            previous = self._engines.pop(document_id, None)
+            if previous is not None:
+                self.chars -= previous[1]
+            self._engines[document_id] = (engine, size)
+            self.chars += size
+            while len(self._engines) > self.max_documents or self.chars > self.max_chars:
+                _, (_, evicted_size) = self._engines.popitem(last=False)
+                self.chars -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': len(self._engines),
+                'chars': self.chars,
+                'max_documents': self.max_documents,
+                'max_chars': self.max_chars,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
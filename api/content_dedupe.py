@@ -0,0 +1,89 @@
+"""
+Duplicate Collapsing Before AI Enrichment
+=========================================
+
+The same text is often extracted more than once from a page: one h1 matches
+'h1', '[class*="title"]', '.hero h1' and 'header h1', and a CTA appears in
+both the header and the footer. group_duplicates() finds which extracted
+items are copies of an earlier one so only the first of each group is sent
+to the AI provider, and its suggestions are reused for every copy.
+
+Two items are duplicates when they share a content type and either
+- their normalized text is equal (Unicode NFKC, case-folded, punctuation
+  dropped, whitespace collapsed), or
+- the Jaccard similarity of their character shingles reaches the threshold
+  (near-duplicates such as "Everything you need to run your business in one
+  place" / "Everything you need to run your business, all in one place")
+
+Environment Variables:
+- CONTENT_DEDUPE: set to 'false' to enrich every extracted item separately
+- CONTENT_DEDUPE_THRESHOLD: shingle Jaccard similarity treated as a duplicate (default 0.8)
+"""
+
+import os
+import re
+import unicodedata
+
+CONTENT_DEDUPE_ENABLED = os.environ.get('CONTENT_DEDUPE', 'true').lower() == 'true'
+CONTENT_DEDUPE_THRESHOLD = float(os.environ.get('CONTENT_DEDUPE_THRESHOLD', '0.8'))
+
+# Characters per shingle
+SHINGLE_SIZE = 3
+
+
+def normalize_text(text):
+    """Comparison form of a piece of text: NFKC, case-folded, no punctuation, single spaces"""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    words = re.sub(r'[^\w\s]', ' ', text).split()
+    # Text made only of punctuation keeps its characters so it is not equal to every other such text
+    return ' '.join(words) if words else ' '.join(text.split())
+
+
+def shingles(normalized, size=SHINGLE_SIZE):
+    """Set of overlapping character n-grams of already normalized text"""
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def group_duplicates(items, threshold=CONTENT_DEDUPE_THRESHOLD, enabled=CONTENT_DEDUPE_ENABLED):
+    """
+    For each (text, content_type) in items, the index of the first item it duplicates
+    (its own index when it is unique). Items of different content types never match.
+    """
+    if not enabled:
+        return list(range(len(items)))
+
+    leaders = []
+    exact = {}
+    # content_type -> [(index, shingle set)] of items that lead a group
+    candidates = {}
+    for index, (text, content_type) in enumerate(items):
+        normalized = normalize_text(text)
+        leader = exact.get((content_type, normalized))
+
+        if leader is None and threshold < 1.0:
+            grams = shingles(normalized)
+            best = 0.0
+            for candidate, candidate_grams in candidates.get(content_type, ()):
+                # |A & B| / |A | B| can only reach the threshold when the sizes are close enough
+                small, large = sorted((len(grams), len(candidate_grams)))
+                if small < threshold * large:
+                    continue
+                similarity = jaccard(grams, candidate_grams)
+                if similarity >= threshold and similarity > best:
+                    leader, best = candidate, similarity
+            if leader is None:
+                candidates.setdefault(content_type, []).append((index, grams))
+
+        if leader is None:
+            leader = index
+        exact.setdefault((content_type, normalized), leader)
+        leaders.append(leader)
+    return leaders
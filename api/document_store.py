@@ -0,0 +1,1084 @@
+"""
+Stored HTML Documents
+=====================
+
+Self-contained scrapes, /store-html uploads and /apply-changes revisions
+are kept for /serve-html. They used to go into plain dicts that were never
+emptied, so a long-running worker grew by a few MB per scrape until it
+was killed. DocumentStore bounds them:
+
+- a total size cap in bytes; the least recently used documents are evicted
+  to make room for new ones
+- a time to live per document (the store default unless given), after
+  which it is gone whether or not the store is full
+- pinning: pinned documents are never evicted or expired, but count towards
+  the cap, so a document larger than the room left beside the pinned ones
+  is refused with DocumentTooLarge
+
+DocumentStore keeps documents in process memory. Two persistent stores
+with the same interface let every worker on a host see every document,
+and keep them across restarts and serverless cold starts:
+
+- FileDocumentStore: one file per document (plus a small JSON sidecar with
+  its metadata, lifetime and pin) under a directory sharded by a hash of
+  the id, written atomically with a rename
+- SQLiteDocumentStore: a blob table in a SQLite file in WAL mode, with the
+  bookkeeping in a separate table so reading a document never waits on,
+  or is invalidated by, access-time updates
+
+Documents are content-addressed: store() files html under the SHA-256 of
+its UTF-8 bytes and returns that id. Storing content that is already there
+costs a hash and a lookup: the existing document gains a reference, its
+lifetime is extended (and it is pinned if asked) and no second copy is
+compressed or written, so size grows with unique documents, not with
+requests. Ids can be computed by anyone who has the content, so they are
+not proof of ownership: a reference taken for an owner (owner_key() of a
+release token handed to whoever stored it) can only be dropped by
+release() with that owner, and the document is removed with the last
+reference. References taken without an owner are never released. They
+guard against early release only; the size cap and lifetimes still apply
+to every document. Since an id names one content for good, /serve-html
+can hand out strong ETags and let clients cache a document indefinitely
+(is_content_id tells such ids from older ones).
+
+Reference counts are updated atomically across workers: in a transaction
+by the SQLite store, and under an exclusive lock on a file in the store's
+directory by the file store (flock; where that is unavailable, as on
+Windows, only threads of one process are serialized).
+
+Neither persistent store keeps documents in memory. /serve-html streams them straight from
+the file (sendfile where the server supports it) or the blob in chunks.
+
+Every store keeps documents gzip-compressed, compressed once when they are
+stored. Self-contained pages shrink several-fold, in memory, on disk and on
+the wire: open() hands out the stored bytes as they are for clients that
+accept gzip and inflates them while streaming for those that don't.
+Documents stored uncompressed (before compression, or with it turned off)
+are still read and served as they are.
+Both enforce the size cap and lifetimes across all workers with collect().
+The SQLite store runs it after every write. Scanning a directory costs a
+read of every sidecar, so the file store keeps a running estimate of the
+bytes stored instead (its last scan plus its own writes since) and scans
+only when that estimate passes the cap, and at least once per
+SWEEP_INTERVAL to take in other workers' writes; once over the cap it
+evicts down to EVICTION_TARGET of it, so a full store is not rescanned on
+every write. compact() also reclaims space (orphaned files and
+empty shard directories, or free pages and the WAL). Last access is
+recorded at most once a minute per document, so serving stays read-only.
+
+Environment Variables:
+- DOCUMENT_STORE_MAX_BYTES: total size of stored documents (default 268435456 = 256 MB)
+- DOCUMENT_STORE_TTL: seconds a document is kept (default 86400, 0 keeps documents until evicted)
+- DOCUMENT_STORE_BACKEND: 'memory' (default), 'file' or 'sqlite'
+- DOCUMENT_STORE_PATH: directory (file) or database file (sqlite); defaults to the temp directory
+- DOCUMENT_STORE_GZIP_LEVEL: gzip level documents are stored at (default 6, 0 stores them uncompressed)
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_STORE_MAX_BYTES = int(os.environ.get('DOCUMENT_STORE_MAX_BYTES', str(256 * 1024 * 1024)))
+DOCUMENT_STORE_TTL = float(os.environ.get('DOCUMENT_STORE_TTL', '86400'))
+DOCUMENT_STORE_BACKEND = os.environ.get('DOCUMENT_STORE_BACKEND', 'memory').lower()
+DOCUMENT_STORE_PATH = os.environ.get('DOCUMENT_STORE_PATH', '')
+DOCUMENT_STORE_GZIP_LEVEL = int(os.environ.get('DOCUMENT_STORE_GZIP_LEVEL', '6'))
+
+# Seconds between sweeps for expired documents (lookups also drop them as they find them)
+SWEEP_INTERVAL = 60.0
+# Seconds a persistent document's last access may be out of date before it is rewritten
+ACCESS_RESOLUTION = 60.0
+# Seconds a stray temporary or half-written file is left alone, in case a write is still in progress
+ORPHAN_GRACE = 300.0
+# Fraction of the cap the file store evicts down to once it is over it
+EVICTION_TARGET = 0.9
+# Ids persistent stores accept; anything else is treated as not stored
+_ID_RE = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+_GZIP_MAGIC = b'\x1f\x8b'
+_CONTENT_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class DocumentTooLarge(Exception):
+    """Raised when a document can't fit in the store even after evicting every unpinned one"""
+
+
+def _too_large(size, max_bytes, pinned_bytes):
+    return DocumentTooLarge(
+        f'Document of {size} bytes does not fit in the document store ({max_bytes} bytes, {pinned_bytes} pinned)'
+    )
+
+
+def content_id(html):
+    """Id of html in the store: hex SHA-256 of its UTF-8 bytes"""
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+
+def new_release_token():
+    """Secret handed to whoever stores a document; store its owner_key() with the reference"""
+    return secrets.token_urlsafe(24)
+
+
+def owner_key(token):
+    """What a store records for a release token (its SHA-256, so tokens are never kept)"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def is_content_id(document_id):
+    """Whether document_id is a content hash, so the document under it can never change"""
+    return isinstance(document_id, str) and _CONTENT_ID_RE.match(document_id) is not None
+
+
+def _extended(expires, pinned, now, ttl):
+    """Expiry of a document stored again, for ttl from now: whichever lasts longer"""
+    if pinned or expires is None or ttl <= 0:
+        return None
+    return max(expires, now + ttl)
+
+
+def _encode(html, level):
+    """
+    (stored form, UTF-8 length) of html: gzipped unless level is 0, with mtime 0
+    so that equal pages store equal bytes
+    """
+    body = html.encode('utf-8')
+    return (gzip.compress(body, compresslevel=level, mtime=0) if level > 0 else body), len(body)
+
+
+def _decode(body):
+    if body[:2] == _GZIP_MAGIC:
+        body = gzip.decompress(body)
+    return body.decode('utf-8')
+
+
+class _Inflating(gzip.GzipFile):
+    """Decompressing reader that closes the stored document with it and never offers its raw fileno"""
+
+    def fileno(self):
+        # A server would sendfile() the compressed bytes underneath
+        raise io.UnsupportedOperation('fileno')
+
+    def close(self):
+        source = self.fileobj
+        super().close()
+        if source is not None:
+            source.close()
+
+
+def _reader(body, size, gzip_ok):
+    """
+    (file, length, Content-Encoding or None) serving a stored body of size bytes:
+    as stored when it is uncompressed or the client accepts gzip, else inflated
+    """
+    compressed = body.read(2) == _GZIP_MAGIC
+    body.seek(0)
+    if not compressed:
+        return body, size, None
+    if gzip_ok:
+        return body, size, 'gzip'
+    # The gzip trailer ends with the uncompressed length (mod 2**32)
+    body.seek(-4, os.SEEK_END)
+    length = int.from_bytes(body.read(4), 'little')
+    body.seek(0)
+    return _Inflating(fileobj=body, mode='rb'), length, None
+
+
+class _Document:
+    __slots__ = ('body', 'metadata', 'size', 'stored', 'expires', 'pinned', 'refs', 'owners')
+
+    def __init__(self, body, metadata, size, stored, expires, pinned, refs, owners):
+        self.body = body
+        self.metadata = metadata
+        self.size = size
+        self.stored = stored
+        self.expires = expires
+        self.pinned = pinned
+        self.refs = refs
+        self.owners = owners
+
+
+class DocumentStore:
+    """Size-capped LRU of HTML documents with per-document TTL and pinning"""
+
+    def __init__(self, max_bytes=DOCUMENT_STORE_MAX_BYTES, ttl=DOCUMENT_STORE_TTL,
+                 gzip_level=DOCUMENT_STORE_GZIP_LEVEL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.gzip_level = gzip_level
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+        self.bytes = 0
+        self.pinned_bytes = 0
+        self.counters = {
+            'stores': 0,
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'evicted_bytes': 0,
+            'expirations': 0,
+            'rejected': 0,
+            'stored_html_bytes': 0,
+            'stored_bytes': 0,
+            'deduplicated': 0
+        }
+
+    def _drop(self, document_id, counter):
+        # Called with self._lock held
+        document = self._documents.pop(document_id)
+        self.bytes -= document.size
+        if document.pinned:
+            self.pinned_bytes -= document.size
+        if counter:
+            self.counters[counter] += 1
+        return document
+
+    def _live(self, document_id, now):
+        """The document if it is stored and not expired (dropping it if it is); lock held"""
+        document = self._documents.get(document_id)
+        if document is not None and document.expires is not None and document.expires <= now:
+            self._drop(document_id, 'expirations')
+            return None
+        return document
+
+    def _sweep(self, now):
+        # Called with self._lock held
+        if time.monotonic() < self._next_sweep:
+            return
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+        expired = [
+            document_id for document_id, document in self._documents.items()
+            if document.expires is not None and document.expires <= now
+        ]
+        for document_id in expired:
+            self._drop(document_id, 'expirations')
+
+    def put(self, document_id, html, metadata=None, ttl=None, pinned=False, owner=None):
+        """
+        Store html under document_id, replacing any document already there (whose
+        references it keeps, plus one, taken for owner if given). metadata is kept
+        alongside and returned by metadata(); ttl overrides the store's default
+        (0 never expires). Raises DocumentTooLarge if it can't fit.
+        """
+        body, length = _encode(html, self.gzip_level)
+        size = sys.getsizeof(body)
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            previous = self._live(document_id, now)
+            room = self.max_bytes - self.pinned_bytes + (previous.size if previous and previous.pinned else 0)
+            if size > room:
+                self.counters['rejected'] += 1
+                raise _too_large(size, self.max_bytes, self.pinned_bytes)
+            if previous is not None:
+                self._drop(document_id, None)
+
+            while self._documents and self.bytes + size > self.max_bytes:
+                victim = next(
+                    (candidate for candidate, document in self._documents.items() if not document.pinned), None
+                )
+                if victim is None:
+                    break
+                self.counters['evicted_bytes'] += self._drop(victim, 'evictions').size
+
+            self._documents[document_id] = _Document(
+                body, dict(metadata or {}), size, now, now + ttl if ttl > 0 and not pinned else None, pinned,
+                previous.refs + 1 if previous is not None else 1,
+                (previous.owners if previous is not None else []) + ([owner] if owner else [])
+            )
+            self.bytes += size
+            if pinned:
+                self.pinned_bytes += size
+            self.counters['stores'] += 1
+            self.counters['stored_html_bytes'] += length
+            self.counters['stored_bytes'] += len(body)
+
+    def store(self, html, metadata=None, ttl=None, pinned=False, owner=None):
+        """
+        Store html under its content id and return the id; content already stored gains a reference
+        owner (an owner_key()) is the only one that can release the reference later
+        """
+        document_id = content_id(html)
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            document = self._live(document_id, now)
+            if document is not None:
+                document.refs += 1
+                if owner:
+                    document.owners.append(owner)
+                document.expires = _extended(document.expires, pinned or document.pinned, now, ttl)
+                if pinned and not document.pinned:
+                    document.pinned = True
+                    self.pinned_bytes += document.size
+                self._documents.move_to_end(document_id)
+                self.counters['deduplicated'] += 1
+                return document_id
+        self.put(document_id, html, metadata, ttl, pinned, owner)
+        return document_id
+
+    def release(self, document_id, owner):
+        """
+        Drop the reference owner took on a document, removing it with the last
+        False if it isn't stored or owner holds no reference to it
+        """
+        with self._lock:
+            document = self._live(document_id, time.time())
+            if document is None or not owner or owner not in document.owners:
+                return False
+            document.owners.remove(owner)
+            document.refs -= 1
+            if document.refs <= 0:
+                self._drop(document_id, None)
+            return True
+
+    def get(self, document_id):
+        """The stored HTML for document_id, or None if it was never stored, evicted or expired"""
+        with self._lock:
+            document = self._live(document_id, time.time())
+            if document is None:
+                self.counters['misses'] += 1
+                return None
+            self._documents.move_to_end(document_id)
+            self.counters['hits'] += 1
+            body = document.body
+        return _decode(body)
+
+    def open(self, document_id, gzip_ok=False):
+        """
+        (binary file, length in bytes, Content-Encoding or None) streaming the stored
+        UTF-8 HTML, gzipped if the client accepts it; None if not stored
+        """
+        with self._lock:
+            document = self._live(document_id, time.time())
+            if document is None:
+                self.counters['misses'] += 1
+                return None
+            self._documents.move_to_end(document_id)
+            self.counters['hits'] += 1
+            body = document.body
+        return _reader(io.BytesIO(body), len(body), gzip_ok)
+
+    def metadata(self, document_id):
+        """Copy of the metadata stored with document_id, or None"""
+        with self._lock:
+            document = self._live(document_id, time.time())
+            return dict(document.metadata) if document is not None else None
+
+    def __contains__(self, document_id):
+        with self._lock:
+            return self._live(document_id, time.time()) is not None
+
+    def pin(self, document_id, pinned=True):
+        """Pin (or unpin) a stored document; returns False if it isn't stored"""
+        with self._lock:
+            document = self._live(document_id, time.time())
+            if document is None:
+                return False
+            if document.pinned != pinned:
+                document.pinned = pinned
+                self.pinned_bytes += document.size if pinned else -document.size
+                # An unpinned document gets the default lifetime from now
+                document.expires = time.time() + self.ttl if not pinned and self.ttl > 0 else None
+            return True
+
+    def delete(self, document_id):
+        with self._lock:
+            if document_id not in self._documents:
+                return False
+            self._drop(document_id, None)
+            return True
+
+    def collect(self):
+        """Drop expired documents now rather than at the next sweep"""
+        with self._lock:
+            before = self.counters['expirations']
+            self._next_sweep = 0.0
+            self._sweep(time.time())
+            return {'expired': self.counters['expirations'] - before, 'evicted': 0}
+
+    def compact(self):
+        return self.collect()
+
+    def stats(self):
+        """Size, entry count and eviction counters, for the stats endpoint"""
+        with self._lock:
+            self._sweep(time.time())
+            return {
+                'backend': 'memory',
+                'documents': len(self._documents),
+                'pinned_documents': sum(1 for document in self._documents.values() if document.pinned),
+                'bytes': self.bytes,
+                'pinned_bytes': self.pinned_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                **self.counters
+            }
+
+
+def _evictable(records, total, max_bytes):
+    """Ids to evict, least recently used first, to bring total down to max_bytes"""
+    victims = []
+    for document_id, size, accessed, pinned in sorted(records, key=lambda record: record[2]):
+        if total <= max_bytes:
+            break
+        if not pinned:
+            victims.append(document_id)
+            total -= size
+    return victims
+
+
+class FileDocumentStore:
+    """Documents as files in a sharded directory shared by every worker on the host"""
+
+    def __init__(self, root, max_bytes=DOCUMENT_STORE_MAX_BYTES, ttl=DOCUMENT_STORE_TTL,
+                 gzip_level=DOCUMENT_STORE_GZIP_LEVEL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.gzip_level = gzip_level
+        self._lock = threading.Lock()
+        self.counters = {
+            'stores': 0,
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'evicted_bytes': 0,
+            'expirations': 0,
+            'rejected': 0,
+            'stored_html_bytes': 0,
+            'stored_bytes': 0,
+            'deduplicated': 0,
+            'scans': 0
+        }
+        # [bytes, pinned bytes, time] as of the last scan, plus this worker's writes since
+        self._usage = None
+        os.makedirs(root, exist_ok=True)
+        # Fail now, not on the first scrape, if the directory can't be written
+        probe = tempfile.NamedTemporaryFile(dir=root, prefix='.probe-')
+        probe.close()
+        # Held while a document's info is read and rewritten, by this process's threads and other workers
+        self._info_lock = threading.RLock()
+        self._info_lock_file = open(os.path.join(root, '.lock'), 'ab')
+        self._info_lock_depth = 0
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to document info across threads and workers (reentrant)"""
+        with self._info_lock:
+            self._info_lock_depth += 1
+            try:
+                if self._info_lock_depth == 1 and fcntl is not None:
+                    fcntl.flock(self._info_lock_file, fcntl.LOCK_EX)
+                yield
+            finally:
+                self._info_lock_depth -= 1
+                if self._info_lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._info_lock_file, fcntl.LOCK_UN)
+
+    def _paths(self, document_id):
+        """(html path, info path) of document_id, or None for ids that can't be stored"""
+        if not isinstance(document_id, str) or not _ID_RE.match(document_id) or document_id.startswith('.'):
+            return None
+        digest = hashlib.sha1(document_id.encode('utf-8')).hexdigest()
+        base = os.path.join(self.root, digest[:2], digest[2:4], document_id)
+        return base + '.html', base + '.json'
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+
+    def _info(self, document_id, now):
+        """(paths, info) for a live document, removing it if it has expired; None if not stored"""
+        paths = self._paths(document_id)
+        if paths is None:
+            return None
+        try:
+            with open(paths[1], 'rb') as f:
+                info = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if info['expires'] is not None and info['expires'] <= now:
+            self._remove(paths)
+            self._count('expirations')
+            return None
+        return paths, info
+
+    def _remove(self, paths):
+        # The info file goes first: without it the document is no longer stored
+        with self._locked():
+            for path in (paths[1], paths[0]):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def _touch(self, html_path, now):
+        """Record an access in the file's atime, at most once per ACCESS_RESOLUTION"""
+        try:
+            status = os.stat(html_path)
+            if now - status.st_atime > ACCESS_RESOLUTION:
+                os.utime(html_path, (now, status.st_mtime))
+        except OSError:
+            pass
+
+    def _scan(self):
+        """(id, size, last access, pinned, expires, paths) of every stored document"""
+        self._count('scans')
+        documents = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith('.json') or name.startswith('.'):
+                    continue
+                document_id = name[:-len('.json')]
+                paths = os.path.join(directory, document_id + '.html'), os.path.join(directory, name)
+                try:
+                    with open(paths[1], 'rb') as f:
+                        info = json.loads(f.read())
+                    accessed = os.stat(paths[0]).st_atime
+                except (OSError, ValueError):
+                    continue
+                documents.append((document_id, info['size'], accessed, info['pinned'], info['expires'], paths))
+        return documents
+
+    def _estimate(self, now):
+        """[bytes, pinned bytes, time of the scan] of the store, scanning it if the last scan is out of date"""
+        with self._lock:
+            if self._usage is not None and now - self._usage[2] <= SWEEP_INTERVAL:
+                return list(self._usage)
+        self.collect()
+        with self._lock:
+            return list(self._usage)
+
+    def put(self, document_id, html, metadata=None, ttl=None, pinned=False, owner=None):
+        """Store html under document_id; same contract as DocumentStore.put"""
+        paths = self._paths(document_id)
+        if paths is None:
+            raise ValueError(f'Invalid document id: {document_id!r}')
+        body, length = _encode(html, self.gzip_level)
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        previous = self._info(document_id, now)
+        replaced = previous[1]['size'] if previous else 0
+        replaced_pinned = replaced if previous and previous[1]['pinned'] else 0
+        usage = self._estimate(now)
+        if len(body) > self.max_bytes - (usage[1] - replaced_pinned):
+            # The estimate can be out of date (documents another worker removed since): confirm first
+            self.collect()
+            with self._lock:
+                usage = list(self._usage)
+            if len(body) > self.max_bytes - (usage[1] - replaced_pinned):
+                self._count('rejected')
+                raise _too_large(len(body), self.max_bytes, usage[1] - replaced_pinned)
+        self._write(paths[0], body)
+        with self._locked():
+            # Read the references again: another worker may have stored or released it meanwhile
+            current = self._info(document_id, now)
+            current = current[1] if current else {}
+            info = {
+                'size': len(body),
+                'stored': now,
+                'expires': now + ttl if ttl > 0 and not pinned else None,
+                'pinned': bool(pinned),
+                'refs': current.get('refs', 1) + 1 if current else 1,
+                'owners': current.get('owners', []) + ([owner] if owner else []),
+                'metadata': dict(metadata or {})
+            }
+            self._write(paths[1], json.dumps(info, ensure_ascii=False).encode('utf-8'))
+        with self._lock:
+            self.counters['stores'] += 1
+            self.counters['stored_html_bytes'] += length
+            self.counters['stored_bytes'] += len(body)
+            if self._usage is not None:
+                self._usage[0] += len(body) - replaced
+                self._usage[1] += (len(body) if info['pinned'] else 0) - replaced_pinned
+            over = self._usage is None or self._usage[0] > self.max_bytes
+        if over:
+            self.collect()
+
+    def store(self, html, metadata=None, ttl=None, pinned=False, owner=None):
+        """Store html under its content id and return the id; same contract as DocumentStore.store"""
+        document_id = content_id(html)
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._locked():
+            found = self._info(document_id, now)
+            if found is not None:
+                paths, info = found
+                info['refs'] = info.get('refs', 1) + 1
+                info['owners'] = info.get('owners', []) + ([owner] if owner else [])
+                info['expires'] = _extended(info['expires'], pinned or info['pinned'], now, ttl)
+                info['pinned'] = info['pinned'] or bool(pinned)
+                self._write(paths[1], json.dumps(info, ensure_ascii=False).encode('utf-8'))
+        if found is None:
+            # put() counts any reference another worker takes while this one writes the document
+            self.put(document_id, html, metadata, ttl, pinned, owner)
+            return document_id
+        self._touch(paths[0], now)
+        self._count('deduplicated')
+        return document_id
+
+    def release(self, document_id, owner):
+        """Drop the reference owner took on a document; same contract as DocumentStore.release"""
+        with self._locked():
+            found = self._info(document_id, time.time())
+            if found is None or not owner or owner not in found[1].get('owners', []):
+                return False
+            paths, info = found
+            info['owners'].remove(owner)
+            info['refs'] = info.get('refs', 1) - 1
+            if info['refs'] <= 0:
+                self._remove(paths)
+            else:
+                self._write(paths[1], json.dumps(info, ensure_ascii=False).encode('utf-8'))
+            return True
+
+    def get(self, document_id):
+        opened = self.open(document_id, gzip_ok=True)
+        if opened is None:
+            return None
+        with opened[0] as f:
+            return _decode(f.read())
+
+    def open(self, document_id, gzip_ok=False):
+        """(open binary file, length in bytes, Content-Encoding or None) of the stored HTML, or None"""
+        now = time.time()
+        found = self._info(document_id, now)
+        try:
+            f = open(found[0][0], 'rb') if found else None
+        except OSError:
+            f = None
+        if f is None:
+            self._count('misses')
+            return None
+        self._touch(found[0][0], now)
+        self._count('hits')
+        return _reader(f, os.fstat(f.fileno()).st_size, gzip_ok)
+
+    def metadata(self, document_id):
+        found = self._info(document_id, time.time())
+        return found[1]['metadata'] if found else None
+
+    def __contains__(self, document_id):
+        return self._info(document_id, time.time()) is not None
+
+    def pin(self, document_id, pinned=True):
+        """Pin (or unpin) a stored document; returns False if it isn't stored"""
+        with self._locked():
+            found = self._info(document_id, time.time())
+            if found is None:
+                return False
+            paths, info = found
+            if info['pinned'] != pinned:
+                info['pinned'] = pinned
+                info['expires'] = time.time() + self.ttl if not pinned and self.ttl > 0 else None
+                self._write(paths[1], json.dumps(info, ensure_ascii=False).encode('utf-8'))
+            return True
+
+    def delete(self, document_id):
+        paths = self._paths(document_id)
+        if paths is None or not os.path.exists(paths[1]):
+            return False
+        self._remove(paths)
+        return True
+
+    def collect(self):
+        """
+        Remove expired documents, then, if the store is over its cap, the least recently
+        used down to EVICTION_TARGET of it
+        """
+        now = time.time()
+        documents = self._scan()
+        expired = [document for document in documents if document[4] is not None and document[4] <= now]
+        for document in expired:
+            self._remove(document[5])
+        live = [document for document in documents if document[4] is None or document[4] > now]
+        total = sum(document[1] for document in live)
+        victims = set()
+        if total > self.max_bytes:
+            victims = set(_evictable([document[:4] for document in live], total, int(self.max_bytes * EVICTION_TARGET)))
+        evicted_bytes = 0
+        for document in live:
+            if document[0] in victims:
+                self._remove(document[5])
+                evicted_bytes += document[1]
+        with self._lock:
+            self.counters['expirations'] += len(expired)
+            self.counters['evictions'] += len(victims)
+            self.counters['evicted_bytes'] += evicted_bytes
+            self._usage = [total - evicted_bytes, sum(document[1] for document in live if document[3]), now]
+        return {'expired': len(expired), 'evicted': len(victims)}
+
+    def compact(self):
+        """collect(), then clear out temporary files, orphaned documents and empty shard directories"""
+        result = self.collect()
+        now = time.time()
+        orphans = 0
+        for directory, subdirectories, files in os.walk(self.root, topdown=False):
+            names = set(files)
+            for name in files:
+                path = os.path.join(directory, name)
+                stray = name.startswith('.tmp-') or (
+                    name.endswith('.html') and name[:-len('.html')] + '.json' not in names
+                )
+                try:
+                    if stray and now - os.stat(path).st_mtime > ORPHAN_GRACE:
+                        os.unlink(path)
+                        orphans += 1
+                except OSError:
+                    pass
+            if directory != self.root:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+        return {**result, 'orphans_removed': orphans}
+
+    def stats(self):
+        documents = self._scan()
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'backend': 'file',
+            'path': self.root,
+            'documents': len(documents),
+            'pinned_documents': sum(1 for document in documents if document[3]),
+            'bytes': sum(document[1] for document in documents),
+            'pinned_bytes': sum(document[1] for document in documents if document[3]),
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl,
+            **counters
+        }
+
+
+class SQLiteDocumentStore:
+    """Documents as blobs in a SQLite file in WAL mode, shared by every worker on the host"""
+
+    def __init__(self, path, max_bytes=DOCUMENT_STORE_MAX_BYTES, ttl=DOCUMENT_STORE_TTL,
+                 gzip_level=DOCUMENT_STORE_GZIP_LEVEL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.gzip_level = gzip_level
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counters = {
+            'stores': 0,
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'evicted_bytes': 0,
+            'expirations': 0,
+            'rejected': 0,
+            'stored_html_bytes': 0,
+            'stored_bytes': 0,
+            'deduplicated': 0
+        }
+        self._connection()
+
+    def _connection(self):
+        """Per-thread connection; the first one creates the schema"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        # Only takes effect on a new database, which is when the tables are created
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, html BLOB NOT NULL)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS document_info ('
+            'id TEXT PRIMARY KEY, size INTEGER NOT NULL, metadata TEXT NOT NULL, stored REAL NOT NULL, '
+            'accessed REAL NOT NULL, expires REAL, pinned INTEGER NOT NULL, refs INTEGER NOT NULL DEFAULT 1, '
+            "owners TEXT NOT NULL DEFAULT '[]')"
+        )
+        columns = [column[1] for column in conn.execute('PRAGMA table_info(document_info)')]
+        if 'refs' not in columns:
+            # Databases created before documents were reference counted
+            conn.execute('ALTER TABLE document_info ADD COLUMN refs INTEGER NOT NULL DEFAULT 1')
+        if 'owners' not in columns:
+            # Databases created before references had owners
+            conn.execute("ALTER TABLE document_info ADD COLUMN owners TEXT NOT NULL DEFAULT '[]'")
+        conn.commit()
+        self._local.conn = conn
+        return conn
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _info(self, conn, document_id, now):
+        """(rowid, size, accessed, metadata, pinned) of a live document, or None"""
+        row = conn.execute(
+            'SELECT d.rowid, i.size, i.accessed, i.metadata, i.pinned, i.expires '
+            'FROM document_info i JOIN documents d ON d.id = i.id WHERE i.id = ?', (document_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[5] is not None and row[5] <= now:
+            self._delete(conn, [document_id])
+            conn.commit()
+            self._count('expirations')
+            return None
+        return row[:5]
+
+    def _delete(self, conn, document_ids):
+        for document_id in document_ids:
+            conn.execute('DELETE FROM document_info WHERE id = ?', (document_id,))
+            conn.execute('DELETE FROM documents WHERE id = ?', (document_id,))
+
+    def _touch(self, conn, document_id, accessed, now):
+        if now - accessed > ACCESS_RESOLUTION:
+            try:
+                conn.execute('UPDATE document_info SET accessed = ? WHERE id = ?', (now, document_id))
+                conn.commit()
+            except sqlite3.OperationalError:
+                # Busy: the access time is only an eviction hint
+                conn.rollback()
+
+    def put(self, document_id, html, metadata=None, ttl=None, pinned=False, owner=None):
+        """Store html under document_id; same contract as DocumentStore.put"""
+        body, length = _encode(html, self.gzip_level)
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            pinned_bytes = conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM document_info WHERE pinned AND id != ?', (document_id,)
+            ).fetchone()[0]
+            if len(body) > self.max_bytes - pinned_bytes:
+                self._count('rejected')
+                raise _too_large(len(body), self.max_bytes, pinned_bytes)
+            previous = conn.execute(
+                'SELECT refs, owners FROM document_info WHERE id = ? AND (expires IS NULL OR expires > ?)',
+                (document_id, now)
+            ).fetchone()
+            owners = (json.loads(previous[1]) if previous else []) + ([owner] if owner else [])
+            conn.execute('INSERT OR REPLACE INTO documents (id, html) VALUES (?, ?)', (document_id, body))
+            conn.execute(
+                'INSERT OR REPLACE INTO document_info '
+                '(id, size, metadata, stored, accessed, expires, pinned, refs, owners) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (document_id, len(body), json.dumps(dict(metadata or {}), ensure_ascii=False), now, now,
+                 now + ttl if ttl > 0 and not pinned else None, int(bool(pinned)), previous[0] + 1 if previous else 1,
+                 json.dumps(owners))
+            )
+            self._collect(conn, now)
+        with self._lock:
+            self.counters['stores'] += 1
+            self.counters['stored_html_bytes'] += length
+            self.counters['stored_bytes'] += len(body)
+
+    def store(self, html, metadata=None, ttl=None, pinned=False, owner=None):
+        """Store html under its content id and return the id; same contract as DocumentStore.store"""
+        document_id = content_id(html)
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT expires, pinned, owners FROM document_info WHERE id = ? AND (expires IS NULL OR expires > ?)',
+                (document_id, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    'UPDATE document_info SET refs = refs + 1, owners = ?, expires = ?, pinned = ?, accessed = ? '
+                    'WHERE id = ?',
+                    (json.dumps(json.loads(row[2]) + ([owner] if owner else [])),
+                     _extended(row[0], pinned or row[1], now, ttl), int(bool(pinned or row[1])), now, document_id)
+                )
+        if row is None:
+            self.put(document_id, html, metadata, ttl, pinned, owner)
+        else:
+            self._count('deduplicated')
+        return document_id
+
+    def release(self, document_id, owner):
+        """Drop the reference owner took on a document; same contract as DocumentStore.release"""
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT refs, owners FROM document_info WHERE id = ? AND (expires IS NULL OR expires > ?)',
+                (document_id, time.time())
+            ).fetchone()
+            owners = json.loads(row[1]) if row is not None else []
+            if not owner or owner not in owners:
+                return False
+            owners.remove(owner)
+            if row[0] <= 1:
+                self._delete(conn, [document_id])
+            else:
+                conn.execute(
+                    'UPDATE document_info SET refs = refs - 1, owners = ? WHERE id = ?', (json.dumps(owners), document_id)
+                )
+        return True
+
+    def get(self, document_id):
+        opened = self.open(document_id, gzip_ok=True)
+        if opened is None:
+            return None
+        with opened[0] as f:
+            return _decode(f.read())
+
+    def open(self, document_id, gzip_ok=False):
+        """(file-like blob reader, length in bytes, Content-Encoding or None) of the stored HTML, or None"""
+        now = time.time()
+        conn = self._connection()
+        info = self._info(conn, document_id, now)
+        if info is None:
+            self._count('misses')
+            return None
+        try:
+            if hasattr(conn, 'blobopen'):
+                # Rows are never updated in place, so an open blob stays valid until its document is deleted
+                body = conn.blobopen('documents', 'html', info[0], readonly=True)
+            else:
+                body = io.BytesIO(conn.execute('SELECT html FROM documents WHERE rowid = ?', (info[0],)).fetchone()[0])
+        except (sqlite3.OperationalError, TypeError):
+            # Evicted by another worker since it was looked up
+            self._count('misses')
+            return None
+        self._touch(conn, document_id, info[2], now)
+        self._count('hits')
+        return _reader(body, info[1], gzip_ok)
+
+    def metadata(self, document_id):
+        info = self._info(self._connection(), document_id, time.time())
+        return json.loads(info[3]) if info else None
+
+    def __contains__(self, document_id):
+        return self._info(self._connection(), document_id, time.time()) is not None
+
+    def pin(self, document_id, pinned=True):
+        """Pin (or unpin) a stored document; returns False if it isn't stored"""
+        conn = self._connection()
+        info = self._info(conn, document_id, time.time())
+        if info is None:
+            return False
+        if bool(info[4]) != pinned:
+            with conn:
+                conn.execute(
+                    'UPDATE document_info SET pinned = ?, expires = ? WHERE id = ?',
+                    (int(pinned), time.time() + self.ttl if not pinned and self.ttl > 0 else None, document_id)
+                )
+        return True
+
+    def delete(self, document_id):
+        conn = self._connection()
+        with conn:
+            found = conn.execute('SELECT 1 FROM document_info WHERE id = ?', (document_id,)).fetchone()
+            self._delete(conn, [document_id])
+        return found is not None
+
+    def _collect(self, conn, now):
+        """Expire and evict inside the caller's transaction; returns (expired, evicted, evicted bytes)"""
+        expired = [row[0] for row in conn.execute(
+            'SELECT id FROM document_info WHERE expires IS NOT NULL AND expires <= ?', (now,)
+        )]
+        self._delete(conn, expired)
+        records = conn.execute('SELECT id, size, accessed, pinned FROM document_info').fetchall()
+        sizes = {record[0]: record[1] for record in records}
+        victims = _evictable(records, sum(sizes.values()), self.max_bytes)
+        self._delete(conn, victims)
+        evicted_bytes = sum(sizes[victim] for victim in victims)
+        with self._lock:
+            self.counters['expirations'] += len(expired)
+            self.counters['evictions'] += len(victims)
+            self.counters['evicted_bytes'] += evicted_bytes
+        return len(expired), len(victims)
+
+    def collect(self):
+        """Remove expired documents, then the least recently used until the store fits its cap"""
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            expired, evicted = self._collect(conn, time.time())
+        return {'expired': expired, 'evicted': evicted}
+
+    def compact(self):
+        """collect(), then return free pages to the filesystem and truncate the WAL"""
+        result = self.collect()
+        conn = self._connection()
+        freed = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        try:
+            # Each pragma returns rows that must be read for it to run to completion
+            conn.execute('PRAGMA incremental_vacuum').fetchall()
+            conn.commit()
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        except sqlite3.OperationalError as e:
+            # A document still being streamed on this connection; SQLite checkpoints on its own meanwhile
+            logger.info(f"Document store compaction deferred: {e}")
+            freed = 0
+        return {**result, 'pages_freed': freed}
+
+    def stats(self):
+        conn = self._connection()
+        documents, total, pinned_documents, pinned_bytes = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(pinned), 0), '
+            'COALESCE(SUM(CASE WHEN pinned THEN size ELSE 0 END), 0) FROM document_info'
+        ).fetchone()
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'documents': documents,
+            'pinned_documents': pinned_documents,
+            'bytes': total,
+            'pinned_bytes': pinned_bytes,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl,
+            **counters
+        }
+
+
+def create_document_store(backend=DOCUMENT_STORE_BACKEND, path=DOCUMENT_STORE_PATH, **kwargs):
+    """The store DOCUMENT_STORE_BACKEND names, or the in-memory one if it can't be opened"""
+    try:
+        if backend == 'file':
+            return FileDocumentStore(path or os.path.join(tempfile.gettempdir(), 'documents'), **kwargs)
+        if backend == 'sqlite':
+            return SQLiteDocumentStore(path or os.path.join(tempfile.gettempdir(), 'documents.sqlite3'), **kwargs)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Document store backend '{backend}' unavailable, keeping documents in memory: {e}")
+        return DocumentStore(**kwargs)
+    if backend != 'memory':
+        logger.warning(f"Unknown DOCUMENT_STORE_BACKEND '{backend}', keeping documents in memory")
+    return DocumentStore(**kwargs)
@@ -0,0 +1,301 @@
+"""
+Stable Element Addressing
+=========================
+
+Scraping assigns every extracted headline, subheadline, description and
+CTA an element id, so an edit can be applied to the element it came from
+instead of searching the page for its text.
+
+An id is self-describing, so no server-side state is needed to resolve it:
+
+    headline-3f9a1c2e-0.1.4.0
+    |        |        `- DOM path: index of the element among its parent's
+    |        |           child elements, from the document root down
+    |        `- key of the element's text (NFKC, case-folded, whitespace dropped)
+    `- content type
+
+The element map returned with a scrape also carries each element's span:
+the [start, end) offsets of its inner HTML in the returned page. Spans are
+found with markers placed in the tree before the page is serialized, so
+they cost no second parse.
+
+Applying a change by id needs no tree either. The span, when given and
+still holding the element's text, is used directly; otherwise one
+HTMLParser pass finds the inner HTML of every requested path. Either way
+the text is checked against the change's original (or the id's key)
+before anything is written, and a change whose element can't be found or
+no longer holds that text is left for the text-search strategies.
+
+Paths are only meaningful in the document they were assigned on: the
+scraped page, its stored copies and its /apply-changes revisions. Other
+markup, such as the post content the WordPress integrations edit (a
+fragment of that page), is always edited by text search.
+"""
+
+import hashlib
+import html
+import re
+import unicodedata
+from html.parser import HTMLParser
+
+from bs4.element import NavigableString, Tag
+
+# Elements html.parser trees never give children; they still count in a path
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+    'meta', 'param', 'source', 'track', 'wbr'
+])
+
+_MARK_START = '\x00lp-element:{}\x00'
+_MARK_END = '\x00/lp-element\x00'
+_MARK_RE = re.compile('\x00lp-element:(\\d+)\x00|\x00/lp-element\x00')
+_ID_RE = re.compile(r'^([a-z_]+)-([0-9a-f]{8})-(\d+(?:\.\d+)*)$')
+_TAG_RE = re.compile(r'(<[^>]*>)')
+# Inner HTML the span splicer must not touch
+_UNSAFE_RE = re.compile(r'<!--|<script|<style|<textarea', re.IGNORECASE)
+
+
+def text_key(text):
+    """Short hash of text that ignores case, Unicode form and whitespace"""
+    folded = ''.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+    return hashlib.sha1(folded.encode('utf-8')).hexdigest()[:8]
+
+
+def element_path(element):
+    """Dotted child-element indices from the document root down to element"""
+    steps = []
+    while element.parent is not None:
+        index = 0
+        for sibling in element.parent.contents:
+            if sibling is element:
+                break
+            if isinstance(sibling, Tag):
+                index += 1
+        steps.append(str(index))
+        element = element.parent
+    return '.'.join(reversed(steps))
+
+
+def parse_element_id(element_id):
+    """(content_type, text key, path) of an element id, or None if it isn't one"""
+    match = _ID_RE.match(element_id) if isinstance(element_id, str) else None
+    return match.groups() if match else None
+
+
+def find_element(soup, path):
+    """The element at a dotted path in a parsed tree, or None"""
+    element = soup
+    for step in path.split('.'):
+        children = [child for child in element.contents if isinstance(child, Tag)]
+        index = int(step)
+        if index >= len(children):
+            return None
+        element = children[index]
+    return element
+
+
+def span_text(source, start, end):
+    """Visible text of a span of HTML source"""
+    return html.unescape(''.join(piece for piece in _TAG_RE.split(source[start:end]) if not piece.startswith('<')))
+
+
+class ElementMap:
+    """Collects the elements extracted from one parsed page and their ids"""
+
+    def __init__(self):
+        self.entries = {}
+        self._elements = []
+        self._marked = []
+
+    def add(self, field, position, content_type, element, text):
+        """
+        Record that scraped_data[field][position] (text) came from element
+        Elements whose text is more than the extracted text (a CTA phrase found in one
+        text node of a longer paragraph) get no entry: replacing them would drop the rest
+        """
+        if not isinstance(element, Tag) or element.name in VOID_ELEMENTS:
+            return
+        key = text_key(text)
+        if text_key(element.get_text()) != key:
+            return
+        path = element_path(element)
+        self.entries[(field, position)] = {'id': f'{content_type}-{key}-{path}', 'path': path}
+        self._elements.append((element, self.entries[(field, position)]))
+
+    def mark(self):
+        """Put markers around each element's content; call right before serializing the tree"""
+        self._marked = []
+        seen = {}
+        for element, entry in self._elements:
+            if id(element) not in seen:
+                seen[id(element)] = len(self._marked)
+                element.insert(0, NavigableString(_MARK_START.format(len(self._marked))))
+                element.append(NavigableString(_MARK_END))
+                self._marked.append([])
+            self._marked[seen[id(element)]].append(entry)
+
+    def finish(self, marked_html, fields):
+        """
+        Strip the markers from the serialized page and fill in each element's span
+        Returns (html, element map): the map has one list per field, aligned with
+        scraped_data[field], holding {id, path, span} or None
+        """
+        pieces = []
+        stack = []
+        position = 0
+        removed = 0
+        for match in _MARK_RE.finditer(marked_html):
+            pieces.append(marked_html[position:match.start()])
+            offset = match.start() - removed
+            if match.group(1) is not None:
+                stack.append((int(match.group(1)), offset))
+            elif stack:
+                marked, start = stack.pop()
+                for entry in self._marked[marked]:
+                    entry['span'] = [start, offset]
+            removed += match.end() - match.start()
+            position = match.end()
+        pieces.append(marked_html[position:])
+
+        element_map = {
+            field: [self.entries.get((field, position)) for position in range(count)]
+            for field, count in fields.items()
+        }
+        return ''.join(pieces), element_map
+
+
+class _AllFound(Exception):
+    pass
+
+
+class _PathFinder(HTMLParser):
+    """
+    One pass over HTML source that reports the inner HTML span of elements by path,
+    building paths the way BeautifulSoup's html.parser tree does
+    """
+
+    def __init__(self, source, paths):
+        super().__init__(convert_charrefs=True)
+        self.wanted = set(paths)
+        self.found = {}
+        self.line_starts = [0]
+        for match in re.finditer('\n', source):
+            self.line_starts.append(match.end())
+        # (tag name, path, child elements seen so far, inner start)
+        self.stack = [(None, '', [0], None)]
+
+    def _offset(self):
+        line, column = self.getpos()
+        return self.line_starts[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        _, parent_path, counter, _ = self.stack[-1]
+        path = f'{parent_path}.{counter[0]}' if parent_path else str(counter[0])
+        counter[0] += 1
+        if tag in VOID_ELEMENTS:
+            return
+        inner_start = None
+        if path in self.wanted:
+            inner_start = self._offset() + len(self.get_starttag_text())
+        self.stack.append((tag, path, [0], inner_start))
+
+    def handle_startendtag(self, tag, attrs):
+        _, parent_path, counter, _ = self.stack[-1]
+        counter[0] += 1
+
+    def handle_endtag(self, tag):
+        if not any(name == tag for name, _, _, _ in self.stack[1:]):
+            return
+        end = self._offset()
+        while True:
+            name, path, _, inner_start = self.stack.pop()
+            if inner_start is not None:
+                self.found[path] = (inner_start, end)
+            if name == tag:
+                break
+        if len(self.found) == len(self.wanted):
+            # Every requested element is closed: nothing left to learn from the rest of the page
+            raise _AllFound()
+
+
+def find_element_spans(source, paths):
+    """{path: (inner start, inner end)} for the given element paths, in one pass over source"""
+    if not paths:
+        return {}
+    finder = _PathFinder(source, paths)
+    try:
+        finder.feed(source)
+        finder.close()
+    except _AllFound:
+        pass
+    return finder.found
+
+
+def _splice_span(source, start, end, replacement):
+    """
+    Replacement for source[start:end] that writes replacement into the first run of text
+    and empties the others, keeping every tag; None when the span holds markup that
+    can't be edited as text
+    """
+    inner = source[start:end]
+    if _UNSAFE_RE.search(inner):
+        return None
+    pieces = _TAG_RE.split(inner)
+    written = False
+    for index, piece in enumerate(pieces):
+        if piece.startswith('<') or not piece.strip():
+            continue
+        leading = piece[:len(piece) - len(piece.lstrip())]
+        trailing = piece[len(piece.rstrip()):]
+        pieces[index] = leading + (html.escape(replacement, quote=False) if not written else '') + trailing
+        written = True
+    return ''.join(pieces) if written else None
+
+
+def locate_by_id(source, changes):
+    """
+    Find where the changes that carry an element id go in the HTML source
+    changes: [{id, original, modified, span?}, ...]; returns [(index into changes,
+    start, end, replacement HTML)] for the ones that can be applied, from the end
+    of the source back and never overlapping
+    """
+    targets = {}
+    for index, change in enumerate(changes):
+        parsed = parse_element_id(change.get('id'))
+        if parsed and isinstance(change.get('original'), str) and isinstance(change.get('modified'), str):
+            targets[index] = parsed
+
+    def holds_text(start, end, index):
+        key = text_key(span_text(source, start, end))
+        return key == text_key(changes[index]['original']) or key == targets[index][1]
+
+    spans = {}
+    missing = []
+    for index in targets:
+        span = changes[index].get('span')
+        if (isinstance(span, (list, tuple)) and len(span) == 2 and all(isinstance(value, int) for value in span)
+                and 0 <= span[0] <= span[1] <= len(source) and holds_text(span[0], span[1], index)):
+            spans[index] = tuple(span)
+        else:
+            missing.append(index)
+
+    if missing:
+        found = find_element_spans(source, {targets[index][2] for index in missing})
+        for index in missing:
+            span = found.get(targets[index][2])
+            if span and holds_text(span[0], span[1], index):
+                spans[index] = span
+
+    # Overlapping spans (an element inside another that is also changed) keep only the later one
+    splices = []
+    tail = len(source)
+    for index, (start, end) in sorted(spans.items(), key=lambda item: item[1], reverse=True):
+        if end > tail:
+            continue
+        replacement = _splice_span(source, start, end, changes[index]['modified'])
+        if replacement is None:
+            continue
+        splices.append((index, start, end, replacement))
+        tail = start
+    return splices
+
@@ -0,0 +1,247 @@
+"""
+Per-domain Extraction Profiles
+==============================
+
+The content extractors try ~45 CSS selectors on every page, but a given site
+(usually built from one theme) only ever matches a handful of them. The
+profile store remembers, per domain, which selectors produced accepted
+content. Later scrapes of that domain skip selectors that have never produced
+anything and stop a field early once its quota is full.
+
+The first few scrapes of a domain, and every Nth one after that, are full
+scans: every selector runs exactly as it always has, which is how the profile
+learns and how a selector that starts matching after a redesign is picked up
+again. Selectors that do run keep their original order, because that order
+decides which texts make the cut.
+
+Extraction may run in a parse pool worker, so the store hands out a plain,
+picklable ExtractionPlan and records what the worker sends back.
+
+Environment Variables:
+- EXTRACTION_PROFILES: set to 'false' to always run every selector
+- EXTRACTION_PROFILE_PATH: JSON file the profiles are persisted to
+- EXTRACTION_PROFILE_MIN_SCANS: full scans before a selector can be skipped (default 3)
+- EXTRACTION_PROFILE_FULL_SCAN_EVERY: run a full scan every N scrapes of a domain (default 25)
+- EXTRACTION_PROFILE_SAVE_INTERVAL: minimum seconds between writes to disk (default 10)
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_PROFILES_ENABLED = os.environ.get('EXTRACTION_PROFILES', 'true').lower() == 'true'
+EXTRACTION_PROFILE_PATH = os.environ.get(
+    'EXTRACTION_PROFILE_PATH', os.path.join(tempfile.gettempdir(), 'extraction_profiles.json')
+)
+EXTRACTION_PROFILE_MIN_SCANS = int(os.environ.get('EXTRACTION_PROFILE_MIN_SCANS', '3'))
+EXTRACTION_PROFILE_FULL_SCAN_EVERY = int(os.environ.get('EXTRACTION_PROFILE_FULL_SCAN_EVERY', '25'))
+EXTRACTION_PROFILE_SAVE_INTERVAL = float(os.environ.get('EXTRACTION_PROFILE_SAVE_INTERVAL', '10'))
+
+# Weight of the newest sample in the moving averages of extraction time
+TIMING_SMOOTHING = 0.2
+
+
+def domain_key(url):
+    """Profile key for a URL: the host name without a leading www."""
+    host = (urlparse(url).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+class ExtractionPlan:
+    """Which selectors to run for one extraction, and what they produced"""
+
+    def __init__(self, domain=None, full_scan=True, skip=None):
+        self.domain = domain
+        self.full_scan = full_scan
+        self.skip = skip or {}
+        self.hits = {}
+        self.started = None
+
+    def begin(self):
+        """Start timing the selector work (called where extraction runs)"""
+        self.started = time.perf_counter()
+
+    def selectors(self, field, selectors):
+        """Selectors to try for a field, in their original order"""
+        if self.full_scan:
+            return list(selectors)
+        skipped = self.skip.get(field, ())
+        return [selector for selector in selectors if selector not in skipped]
+
+    def record(self, field, selector, accepted):
+        """Note how many texts a selector contributed to a field"""
+        self.hits.setdefault(field, {})[selector] = accepted
+
+    def quota_reached(self, found, quota):
+        """True when a profiled run can stop trying selectors for a field"""
+        return not self.full_scan and found >= quota
+
+    def result(self):
+        """Compact, picklable outcome to send back from a worker"""
+        return {
+            'domain': self.domain,
+            'full_scan': self.full_scan,
+            'hits': self.hits,
+            'seconds': time.perf_counter() - self.started if self.started is not None else 0.0
+        }
+
+
+class ExtractionProfileStore:
+    """Thread-safe per-domain selector statistics, persisted as JSON"""
+
+    def __init__(self, path=EXTRACTION_PROFILE_PATH, enabled=EXTRACTION_PROFILES_ENABLED,
+                 min_scans=EXTRACTION_PROFILE_MIN_SCANS, full_scan_every=EXTRACTION_PROFILE_FULL_SCAN_EVERY,
+                 save_interval=EXTRACTION_PROFILE_SAVE_INTERVAL):
+        self.path = path
+        self.enabled = enabled
+        self.min_scans = max(1, min_scans)
+        self.full_scan_every = max(1, full_scan_every)
+        self.save_interval = save_interval
+        self.profiles = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        if self.enabled:
+            self.load()
+
+    def _new_profile(self):
+        return {
+            'scrapes': 0,
+            'full_scans': 0,
+            'since_full_scan': 0,
+            'fields': {},
+            'timing': {
+                'full': {'count': 0, 'avg_seconds': None},
+                'profiled': {'count': 0, 'avg_seconds': None}
+            }
+        }
+
+    def _is_dead(self, stats):
+        return stats['evaluated'] >= self.min_scans and stats['hits'] == 0
+
+    def plan_for(self, url):
+        """Build the extraction plan for the next scrape of url"""
+        domain = domain_key(url)
+        if not self.enabled or not domain:
+            return ExtractionPlan(domain)
+
+        with self._lock:
+            profile = self.profiles.get(domain)
+            if (profile is None or profile['full_scans'] < self.min_scans
+                    or profile['since_full_scan'] >= self.full_scan_every):
+                return ExtractionPlan(domain)
+
+            skip = {}
+            for field, selectors in profile['fields'].items():
+                dead = {selector for selector, stats in selectors.items() if self._is_dead(stats)}
+                if dead:
+                    skip[field] = dead
+            return ExtractionPlan(domain, full_scan=False, skip=skip)
+
+    def record(self, outcome):
+        """Fold an ExtractionPlan.result() into the domain's profile"""
+        domain = outcome.get('domain')
+        if not self.enabled or not domain:
+            return
+
+        with self._lock:
+            profile = self.profiles.setdefault(domain, self._new_profile())
+            profile['scrapes'] += 1
+            if outcome['full_scan']:
+                profile['full_scans'] += 1
+                profile['since_full_scan'] = 0
+            else:
+                profile['since_full_scan'] += 1
+
+            for field, selectors in outcome['hits'].items():
+                field_stats = profile['fields'].setdefault(field, {})
+                for selector, accepted in selectors.items():
+                    stats = field_stats.setdefault(selector, {'evaluated': 0, 'hits': 0})
+                    stats['evaluated'] += 1
+                    if accepted:
+                        stats['hits'] += 1
+
+            timing = profile['timing']['full' if outcome['full_scan'] else 'profiled']
+            timing['count'] += 1
+            if timing['avg_seconds'] is None:
+                timing['avg_seconds'] = outcome['seconds']
+            else:
+                timing['avg_seconds'] += TIMING_SMOOTHING * (outcome['seconds'] - timing['avg_seconds'])
+
+            self._dirty = True
+            due = time.monotonic() - self._last_save >= self.save_interval
+
+        if due:
+            self.save()
+
+    def _summary(self, domain, profile):
+        skipped = {
+            field: sorted(selector for selector, stats in selectors.items() if self._is_dead(stats))
+            for field, selectors in profile['fields'].items()
+        }
+        full = profile['timing']['full']['avg_seconds']
+        profiled = profile['timing']['profiled']['avg_seconds']
+        return {
+            'domain': domain,
+            'scrapes': profile['scrapes'],
+            'full_scans': profile['full_scans'],
+            'selectors_tracked': sum(len(selectors) for selectors in profile['fields'].values()),
+            'selectors_skipped': sum(len(selectors) for selectors in skipped.values()),
+            'skipped': {field: selectors for field, selectors in skipped.items() if selectors},
+            'avg_full_scan_seconds': round(full, 4) if full is not None else None,
+            'avg_profiled_seconds': round(profiled, 4) if profiled is not None else None,
+            'speedup': round(full / profiled, 2) if full and profiled else None
+        }
+
+    def stats(self, domain=None):
+        """Per-domain skip lists and extraction speedups"""
+        with self._lock:
+            if domain is not None:
+                profile = self.profiles.get(domain_key(domain if '//' in domain else '//' + domain))
+                return self._summary(domain, profile) if profile else None
+            return {
+                'enabled': self.enabled,
+                'path': self.path,
+                'domains': [self._summary(name, profile) for name, profile in sorted(self.profiles.items())]
+            }
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with self._lock:
+                self.profiles = data.get('profiles', {})
+            logger.info(f"Loaded extraction profiles for {len(self.profiles)} domains")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load extraction profiles from {self.path}: {e}")
+
+    def save(self):
+        """Write profiles to disk atomically if anything changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps({'version': 1, 'profiles': self.profiles})
+            self._dirty = False
+            self._last_save = time.monotonic()
+
+        tmp_path = None
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.extraction_profiles.')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            logger.warning(f"Could not save extraction profiles to {self.path}: {e}")
+            with self._lock:
+                self._dirty = True
@@ -0,0 +1,476 @@
+"""
+Streaming HTML helpers
+======================
+
+Event-driven extraction on top of the standard library HTML tokenizer.
+Nothing here builds a document tree: markup is fed chunk by chunk straight
+from the network and the parser keeps only the state it needs, so reading
+can stop as soon as every field has been collected.
+
+The same tokenizer drives early asset discovery: stylesheets and images,
+the assets the resource inliner downloads, are handed to a download pool
+while the page itself is still arriving, so page and asset network time
+overlap.
+"""
+
+import codecs
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Elements that never have children (mirrors the html.parser tree builder)
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen',
+    'link', 'menuitem', 'meta', 'param', 'source', 'track', 'wbr'
+])
+
+# Elements whose text BeautifulSoup's get_text() leaves out
+NON_TEXT_ELEMENTS = frozenset(['script', 'style', 'template'])
+
+# Elements where whitespace-only strings are kept verbatim
+PRESERVE_WHITESPACE_ELEMENTS = frozenset(['pre', 'textarea'])
+
+_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?\s*([A-Za-z0-9_\-:.]+)', re.IGNORECASE)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([A-Za-z0-9_\-:.]+)', re.IGNORECASE)
+
+
+def _valid_codec(name):
+    try:
+        return codecs.lookup(name).name
+    except (LookupError, TypeError):
+        return None
+
+
+def sniff_encoding(content_type, head_bytes):
+    """Pick a decoder for a streamed page: BOM, then header charset, then <meta charset>, then UTF-8"""
+    if head_bytes.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head_bytes.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+
+    if content_type:
+        match = _CHARSET_RE.search(content_type)
+        if match and _valid_codec(match.group(1)):
+            return _valid_codec(match.group(1))
+
+    match = _META_CHARSET_RE.search(head_bytes[:4096])
+    if match and _valid_codec(match.group(1).decode('ascii', 'ignore')):
+        return _valid_codec(match.group(1).decode('ascii', 'ignore'))
+
+    return 'utf-8'
+
+
+def iter_decoded_chunks(response, chunk_size=16384):
+    """Yield decoded text chunks from a streamed requests response"""
+    decoder = None
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if not chunk:
+            continue
+        if decoder is None:
+            encoding = sniff_encoding(response.headers.get('content-type', ''), chunk)
+            decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    if decoder is not None:
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+
+class _Frame:
+    """Open element on the parser stack, tracking just enough to emulate Tag.string"""
+    __slots__ = ('tag', 'child_count', 'last_child', 'text_open', 'only_child_has_string', 'capture')
+
+    def __init__(self, tag, capture=None):
+        self.tag = tag
+        self.child_count = 0
+        self.last_child = None
+        self.text_open = False
+        self.only_child_has_string = False
+        self.capture = capture
+
+    def add_child(self, kind):
+        # Adjacent character data is a single NavigableString in the tree
+        if kind == 'text' and self.text_open:
+            return
+        self.child_count += 1
+        self.last_child = kind
+        self.text_open = kind == 'text'
+
+    @property
+    def has_string(self):
+        if self.child_count != 1:
+            return False
+        if self.last_child in ('text', 'comment'):
+            return True
+        return self.only_child_has_string
+
+
+class _Capture:
+    """Text collected for one element of interest"""
+    __slots__ = ('kind', 'parts', 'closed', 'has_string')
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.parts = []
+        self.closed = False
+        self.has_string = False
+
+    @property
+    def text(self):
+        return ''.join(self.parts).strip()
+
+
+class PageSummaryExtractor(HTMLParser):
+    """
+    Collect the lightweight /scrape fields in one forward pass without a tree.
+
+    Produces the same fields the BeautifulSoup version read: the first <title>,
+    the first 3 h1, 3 h2 and 2 h3, the first 3 <p>, the meta description and
+    the first 5 button/anchor elements that have a single string child.
+    Check ``done`` after each feed() to stop reading once every quota is met.
+    """
+
+    QUOTAS = {'title': 1, 'h1': 3, 'h2': 3, 'h3': 2, 'p': 3, 'cta': 5}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.captures = {kind: [] for kind in self.QUOTAS}
+        self.started = {kind: 0 for kind in self.QUOTAS}
+        self.open_captures = []
+        self.meta_description = None
+        # CTA candidates resolve at their end tag; track the settled prefix
+        self.cta_settled = 0
+        self.cta_matched = 0
+        self.chars_fed = 0
+        self.text_suppressed = 0
+        self.whitespace_preserved = 0
+        self.pending_text = []
+
+    # Tokenizer events
+
+    def feed(self, data):
+        self.chars_fed += len(data)
+        super().feed(data)
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        if tag == 'meta' and self.meta_description is None:
+            attr_map = dict(attrs)
+            if attr_map.get('name') == 'description':
+                self.meta_description = (attr_map.get('content') or '').strip()
+
+        if self.stack:
+            self.stack[-1].add_child('element')
+
+        if tag in VOID_ELEMENTS:
+            if self.stack:
+                self.stack[-1].only_child_has_string = False
+            return
+
+        kind = 'cta' if tag in ('a', 'button') else tag
+        capture = None
+        if kind == 'cta':
+            # Only elements with a single string count, so keep capturing until enough have matched
+            wanted = self.cta_matched < self.QUOTAS['cta']
+        else:
+            wanted = kind in self.QUOTAS and self.started[kind] < self.QUOTAS[kind]
+        if wanted:
+            self.started[kind] += 1
+            capture = _Capture(kind)
+            self.captures[kind].append(capture)
+            self.open_captures.append(capture)
+
+        if tag in NON_TEXT_ELEMENTS:
+            self.text_suppressed += 1
+        if tag in PRESERVE_WHITESPACE_ELEMENTS:
+            self.whitespace_preserved += 1
+        self.stack.append(_Frame(tag, capture))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        # Like the html.parser tree builder: close up to the most recent match, ignore strays
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index].tag == tag:
+                while len(self.stack) > index:
+                    self._close_frame()
+                return
+
+    def handle_data(self, data):
+        if self.stack:
+            self.stack[-1].add_child('text')
+        self.pending_text.append(data)
+
+    def handle_comment(self, data):
+        self._flush_text()
+        if self.stack:
+            self.stack[-1].add_child('comment')
+
+    def handle_decl(self, decl):
+        self._flush_text()
+
+    def handle_pi(self, data):
+        self._flush_text()
+
+    def close(self):
+        super().close()
+        self._flush_text()
+        while self.stack:
+            self._close_frame()
+
+    def _flush_text(self):
+        # A string node ends at the next markup event; finish it the way the tree builder does
+        if not self.pending_text:
+            return
+        text = ''.join(self.pending_text)
+        self.pending_text = []
+        if self.stack:
+            self.stack[-1].text_open = False
+        if self.text_suppressed or not self.open_captures:
+            return
+        if not self.whitespace_preserved and not text.strip():
+            text = '\n' if '\n' in text else ' '
+        for capture in self.open_captures:
+            capture.parts.append(text)
+
+    def _close_frame(self):
+        frame = self.stack.pop()
+        if frame.tag in NON_TEXT_ELEMENTS:
+            self.text_suppressed -= 1
+        if frame.tag in PRESERVE_WHITESPACE_ELEMENTS:
+            self.whitespace_preserved -= 1
+        if self.stack:
+            self.stack[-1].only_child_has_string = frame.has_string
+        if frame.capture is not None:
+            frame.capture.closed = True
+            frame.capture.has_string = frame.has_string
+            self.open_captures.remove(frame.capture)
+            if frame.capture.kind == 'cta':
+                self._settle_ctas()
+
+    def _settle_ctas(self):
+        ctas = self.captures['cta']
+        while self.cta_settled < len(ctas) and ctas[self.cta_settled].closed:
+            if ctas[self.cta_settled].has_string:
+                self.cta_matched += 1
+            self.cta_settled += 1
+
+    # Results
+
+    def _kind_done(self, kind):
+        if kind == 'cta':
+            return self.cta_matched >= self.QUOTAS['cta']
+        captures = self.captures[kind]
+        return len(captures) >= self.QUOTAS[kind] and all(c.closed for c in captures)
+
+    @property
+    def done(self):
+        """True once every field is final and the rest of the document can be skipped"""
+        if self.meta_description is None:
+            return False
+        return all(self._kind_done(kind) for kind in self.QUOTAS)
+
+    def summary(self):
+        """Build the /scrape fields from what has been collected"""
+        titles = self.captures['title']
+        title_text = titles[0].text if titles else ""
+
+        headlines = [c.text for c in self.captures['h1'] if c.text]
+
+        subheadlines = []
+        for capture in self.captures['h2'] + self.captures['h3']:
+            text = capture.text
+            if text and len(text) > 5:
+                subheadlines.append(text)
+
+        descriptions = [self.meta_description] if self.meta_description else []
+        for capture in self.captures['p']:
+            text = capture.text
+            if text and len(text) > 20 and len(text) < 300:
+                descriptions.append(text)
+
+        cta_elements = []
+        for capture in [c for c in self.captures['cta'] if c.has_string][:5]:
+            text = capture.text
+            if text and len(text) > 2 and len(text) < 50:
+                cta_elements.append(text)
+
+        return {
+            'title': title_text,
+            'headline': headlines,
+            'subheadline': subheadlines[:5],
+            'description_credibility': descriptions[:8],
+            'call_to_action': cta_elements[:10]
+        }
+
+
+def extract_page_summary(response, chunk_size=16384):
+    """
+    Stream a requests response (opened with stream=True) through PageSummaryExtractor.
+    Stops downloading as soon as every field is collected and closes the connection.
+    """
+    extractor = PageSummaryExtractor()
+    complete = True
+    try:
+        for text in iter_decoded_chunks(response, chunk_size):
+            extractor.feed(text)
+            if extractor.done:
+                complete = False
+                break
+        extractor.close()
+    finally:
+        response.close()
+
+    summary = extractor.summary()
+    # When we stop early the remaining bytes are never read; report the
+    # advertised size if the server sent one, otherwise what was parsed.
+    html_length = extractor.chars_fed
+    if not complete:
+        try:
+            html_length = max(html_length, int(response.headers.get('content-length', 0)))
+        except ValueError:
+            pass
+    summary['html_length'] = html_length
+    if not complete:
+        logger.info(f"Stopped reading {response.url} after {extractor.chars_fed} characters")
+    return summary
+
+
+# Lazy-load attributes checked in order by the resource inliner
+LAZY_IMAGE_ATTRS = ('data-src', 'data-lazy-src', 'data-original', 'data-lazy')
+
+# Per-kind timeouts, matching what the inliner uses for the same downloads
+ASSET_TIMEOUTS = {'stylesheet': 15, 'image': 10}
+
+
+class AssetDiscoveryParser(HTMLParser):
+    """Report asset URLs as soon as their tags are tokenized"""
+
+    def __init__(self, base_url, on_asset, kinds=('stylesheet', 'image')):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.on_asset = on_asset
+        self.kinds = frozenset(kinds)
+
+    def _report(self, kind, value):
+        if not value:
+            return
+        asset_url = urljoin(self.base_url, value.strip())
+        if asset_url.startswith('data:'):
+            return
+        self.on_asset(asset_url, kind)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'link':
+            attr_map = dict(attrs)
+            rel = (attr_map.get('rel') or '').lower().split()
+            if 'stylesheet' in rel and 'stylesheet' in self.kinds:
+                self._report('stylesheet', attr_map.get('href'))
+        elif tag == 'img' and 'image' in self.kinds:
+            attr_map = dict(attrs)
+            self._report('image', attr_map.get('src'))
+            for attr in LAZY_IMAGE_ATTRS:
+                if attr_map.get(attr):
+                    self._report('image', attr_map[attr])
+                    break
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+
+class PrefetchingSession:
+    """
+    Session wrapper whose get() returns responses that were started in the
+    background, falling back to a normal request for URLs never prefetched.
+    Exceptions raised by a prefetch surface from get(), just as a direct call would,
+    and get() waits no longer than its timeout for a prefetch still in progress.
+    """
+
+    def __init__(self, session, max_workers=8):
+        # Keep max_workers within the session's connection pool size (10 by default)
+        self.session = session
+        self.headers = session.headers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asset-prefetch')
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.stats = {'prefetched': 0, 'hits': 0, 'misses': 0}
+
+    def prefetch(self, url, kind='image'):
+        with self._lock:
+            if url in self._futures:
+                return
+            timeout = ASSET_TIMEOUTS.get(kind, 15)
+            self._futures[url] = self._executor.submit(self.session.get, url, timeout=timeout)
+            self.stats['prefetched'] += 1
+        logger.info(f"Prefetching {kind}: {url}")
+
+    def get(self, url, timeout=None, **kwargs):
+        with self._lock:
+            future = self._futures.get(url)
+            self.stats['hits' if future is not None else 'misses'] += 1
+        if future is not None and not kwargs:
+            wait = sum(timeout) if isinstance(timeout, tuple) else timeout
+            try:
+                return future.result(timeout=wait)
+            except FutureTimeoutError:
+                raise requests.exceptions.Timeout(f'Prefetch of {url} did not finish within {wait}s')
+        return self.session.get(url, timeout=timeout, **kwargs)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def decode_body(response, body):
+    """Text of a page body read by fetch_with_asset_prefetch, decoded as the tokenizer decoded it"""
+    return body.decode(sniff_encoding(response.headers.get('content-type', ''), body), errors='replace')
+
+
+def fetch_with_asset_prefetch(session, url, asset_session, timeout=30,
+                              kinds=('stylesheet', 'image'), chunk_size=16384):
+    """
+    Download a page while tokenizing it, prefetching assets through asset_session as they appear.
+
+    Returns (response, body, prefetcher). The response has been read to the
+    end, so its body is only in body (bytes; decode_body() gives the text);
+    the caller must close the prefetcher once it has consumed the assets.
+    """
+    prefetcher = PrefetchingSession(asset_session)
+    try:
+        response = session.get(url, timeout=timeout, stream=True)
+        response.raise_for_status()
+
+        parser = AssetDiscoveryParser(url, prefetcher.prefetch, kinds)
+        decoder = None
+        chunks = []
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if not chunk:
+                continue
+            chunks.append(chunk)
+            if decoder is None:
+                encoding = sniff_encoding(response.headers.get('content-type', ''), chunk)
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+            parser.feed(decoder.decode(chunk))
+        if decoder is not None:
+            parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+
+        logger.info(f"Page streamed with {prefetcher.stats['prefetched']} assets prefetched: {url}")
+        return response, b''.join(chunks), prefetcher
+    except Exception:
+        prefetcher.close()
+        raise
@@ -1,4 +1,6 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
 from flask_cors import CORS
 import requests
 from bs4 import BeautifulSoup
@@ -7,152 +9,224 @@ from urllib.parse import urljoin, urlparse
 import logging
 import os
 import json
+import atexit
 import base64
+import sys
+import time
 from datetime import datetime, timezone
+
+# Make sibling modules importable however this file is loaded
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from parse_pool import ParsePool
+from document_pipeline import DocumentPipeline
+from extraction_profiles import ExtractionPlan, ExtractionProfileStore
+from html_stream import decode_body, fetch_with_asset_prefetch
+from content_dedupe import group_duplicates
+from change_engine import ChangeEngine, WarmEngines, utf16_length
+from document_store import DocumentTooLarge, create_document_store, is_content_id, new_release_token, owner_key
+from element_ids import ElementMap
+from ai_batching import AI_BATCH_PROMPTS, batch_max_tokens, build_batch_prompt, chunk_items, parse_batch_reply
+from suggestion_cache import SuggestionCache
+from suggestion_pool import SuggestionPool
+from ai_streaming import SSE_HEADERS, LineAssembler, iter_chat_deltas, sse_event, wants_event_stream
+from ai_throttle import AI_REQUEST_TIMEOUT, AdaptiveConcurrencyController, estimate_tokens
+from single_flight import SingleFlight, request_key
+from llm_router import ChatReply, LLMProvider, LLMRouter
+from ai_metrics import AIMetrics, ContextThreadPoolExecutor, set_call_context
 ##hello from saim
 
-def download_and_inline_resources(html_content, base_url):
+def new_asset_session():
+    """Session used to download stylesheets, fonts and images for inlining"""
+    session = requests.Session()
+    session.headers.update({
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    })
+    return session
+
+def download_and_inline_resources(html_content, base_url, session=None):
     """
     Download all external resources and inline them to create a completely self-contained HTML file
+    Pass a PrefetchingSession as session to reuse downloads started while the page was streaming
     """
     try:
         soup = BeautifulSoup(html_content, 'html.parser')
-        session = requests.Session()
-        session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        
-        # Download and inline CSS files
-        for link in soup.find_all('link', rel='stylesheet'):
-            if link.get('href'):
-                try:
-                    css_url = urljoin(base_url, link['href'])
-                    logging.info(f"Downloading CSS: {css_url}")
-                    css_response = session.get(css_url, timeout=15)
-                    if css_response.status_code == 200:
-                        # Process CSS to inline fonts and images
-                        css_content = process_css_content(css_response.text, css_url, session)
-                        
-                        # Replace link tag with style tag
-                        style_tag = soup.new_tag('style')
-                        style_tag.string = css_content
-                        style_tag.attrs['data-original-href'] = css_url
-                        link.replace_with(style_tag)
-                        logging.info(f"Successfully inlined CSS: {css_url}")
+        inline_resources(soup, base_url, session)
+        return str(soup)
+    except Exception as e:
+        logging.error(f"Error processing resources: {str(e)}")
+        return html_content
+
+def inline_resources(soup, base_url, session=None):
+    """
+    Inline stylesheets, fonts and images into an already parsed document (modified in place)
+    """
+    if session is None:
+        session = new_asset_session()
+    
+    # Download and inline CSS files
+    for link in soup.find_all('link', rel='stylesheet'):
+        if link.get('href'):
+            try:
+                css_url = urljoin(base_url, link['href'])
+                logging.info(f"Downloading CSS: {css_url}")
+                css_response = session.get(css_url, timeout=15)
+                if css_response.status_code == 200:
+                    # Process CSS to inline fonts and images
+                    css_content = process_css_content(css_response.text, css_url, session)
+                    
+                    # Replace link tag with style tag
+                    style_tag = soup.new_tag('style')
+                    style_tag.string = css_content
+                    style_tag.attrs['data-original-href'] = css_url
+                    link.replace_with(style_tag)
+                    logging.info(f"Successfully inlined CSS: {css_url}")
+                else:
+                    logging.warning(f"Failed to download CSS {css_url}: HTTP {css_response.status_code}")
+                    # Don't remove the link, let it load externally with our permissive CSP
+            except Exception as e:
+                logging.warning(f"Failed to download CSS {link.get('href')}: {str(e)}")
+                # Don't remove the link, let it load externally
+    
+    # Process existing style tags
+    for style in soup.find_all('style'):
+        if style.string:
+            original_css = style.string
+            processed_css = process_css_content(original_css, base_url, session)
+            style.string = processed_css
+    
+    # Remove external script tags that might cause CORS issues
+    for script in soup.find_all('script', src=True):
+        src = script.get('src')
+        if src and (src.startswith('http') or src.startswith('//')):
+            # Remove external scripts that make AJAX calls
+            script.decompose()
+            logging.info(f"Removed external script: {src}")
+    
+    # Remove inline scripts that make external AJAX calls
+    for script in soup.find_all('script'):
+        if script.string and 'admin-ajax.php' in script.string:
+            script.decompose()
+            logging.info("Removed script with admin-ajax.php call")
+    
+    # Process images - download and convert to data URLs for better compatibility
+    for img in soup.find_all('img', src=True):
+        if img.get('src'):
+            try:
+                img_url = urljoin(base_url, img['src'])
+                if img_url.startswith('data:'):
+                    continue  # Skip if already a data URL
+                
+                logging.info(f"Downloading image: {img_url}")
+                img_response = session.get(img_url, timeout=10)
+                if img_response.status_code == 200 and len(img_response.content) < 2000000:  # Limit to 2MB
+                    # Determine MIME type
+                    content_type = img_response.headers.get('content-type', '')
+                    if not content_type:
+                        if img_url.lower().endswith('.png'):
+                            content_type = 'image/png'
+                        elif img_url.lower().endswith(('.jpg', '.jpeg')):
+                            content_type = 'image/jpeg'
+                        elif img_url.lower().endswith('.gif'):
+                            content_type = 'image/gif'
+                        elif img_url.lower().endswith('.svg'):
+                            content_type = 'image/svg+xml'
+                        elif img_url.lower().endswith('.webp'):
+                            content_type = 'image/webp'
+                        else:
+                            content_type = 'application/octet-stream'
+                    
+                    # Convert to base64 data URL
+                    img_data = base64.b64encode(img_response.content).decode('utf-8')
+                    img['src'] = f"data:{content_type};base64,{img_data}"
+                    img['data-original-src'] = img_url
+                    logging.info(f"Successfully converted image to data URL: {img_url}")
+                else:
+                    if img_response.status_code != 200:
+                        logging.warning(f"Failed to download image {img_url}: HTTP {img_response.status_code}")
                     else:
-                        logging.warning(f"Failed to download CSS {css_url}: HTTP {css_response.status_code}")
-                        # Don't remove the link, let it load externally with our permissive CSP
-                except Exception as e:
-                    logging.warning(f"Failed to download CSS {link.get('href')}: {str(e)}")
-                    # Don't remove the link, let it load externally
-        
-        # Process existing style tags
-        for style in soup.find_all('style'):
-            if style.string:
-                original_css = style.string
-                processed_css = process_css_content(original_css, base_url, session)
-                style.string = processed_css
-        
-        # Remove external script tags that might cause CORS issues
-        for script in soup.find_all('script', src=True):
-            src = script.get('src')
-            if src and (src.startswith('http') or src.startswith('//')):
-                # Remove external scripts that make AJAX calls
-                script.decompose()
-                logging.info(f"Removed external script: {src}")
-        
-        # Remove inline scripts that make external AJAX calls
-        for script in soup.find_all('script'):
-            if script.string and 'admin-ajax.php' in script.string:
-                script.decompose()
-                logging.info("Removed script with admin-ajax.php call")
-        
-        # Process images - download and convert to data URLs for better compatibility
-        for img in soup.find_all('img', src=True):
-            if img.get('src'):
+                        logging.warning(f"Image too large, skipping: {img_url} ({len(img_response.content)} bytes)")
+            except Exception as e:
+                logging.warning(f"Failed to process image {img.get('src')}: {str(e)}")
+    
+    # Handle lazy-loaded images (data-src, data-lazy-src, etc.)
+    for img in soup.find_all('img'):
+        for attr in ['data-src', 'data-lazy-src', 'data-original', 'data-lazy']:
+            if img.get(attr):
                 try:
-                    img_url = urljoin(base_url, img['src'])
+                    img_url = urljoin(base_url, img[attr])
                     if img_url.startswith('data:'):
-                        continue  # Skip if already a data URL
+                        continue
                     
-                    logging.info(f"Downloading image: {img_url}")
+                    logging.info(f"Processing lazy image: {img_url}")
                     img_response = session.get(img_url, timeout=10)
-                    if img_response.status_code == 200 and len(img_response.content) < 2000000:  # Limit to 2MB
-                        # Determine MIME type
-                        content_type = img_response.headers.get('content-type', '')
-                        if not content_type:
-                            if img_url.lower().endswith('.png'):
-                                content_type = 'image/png'
-                            elif img_url.lower().endswith(('.jpg', '.jpeg')):
-                                content_type = 'image/jpeg'
-                            elif img_url.lower().endswith('.gif'):
-                                content_type = 'image/gif'
-                            elif img_url.lower().endswith('.svg'):
-                                content_type = 'image/svg+xml'
-                            elif img_url.lower().endswith('.webp'):
-                                content_type = 'image/webp'
-                            else:
-                                content_type = 'application/octet-stream'
-                        
-                        # Convert to base64 data URL
+                    if img_response.status_code == 200 and len(img_response.content) < 2000000:
+                        content_type = img_response.headers.get('content-type', 'image/jpeg')
                         img_data = base64.b64encode(img_response.content).decode('utf-8')
+                        
+                        # Set both src and the lazy attributes
                         img['src'] = f"data:{content_type};base64,{img_data}"
-                        img['data-original-src'] = img_url
-                        logging.info(f"Successfully converted image to data URL: {img_url}")
-                    else:
-                        if img_response.status_code != 200:
-                            logging.warning(f"Failed to download image {img_url}: HTTP {img_response.status_code}")
-                        else:
-                            logging.warning(f"Image too large, skipping: {img_url} ({len(img_response.content)} bytes)")
-                except Exception as e:
-                    logging.warning(f"Failed to process image {img.get('src')}: {str(e)}")
-        
-        # Handle lazy-loaded images (data-src, data-lazy-src, etc.)
-        for img in soup.find_all('img'):
-            for attr in ['data-src', 'data-lazy-src', 'data-original', 'data-lazy']:
-                if img.get(attr):
-                    try:
-                        img_url = urljoin(base_url, img[attr])
-                        if img_url.startswith('data:'):
-                            continue
+                        img[attr] = f"data:{content_type};base64,{img_data}"
                         
-                        logging.info(f"Processing lazy image: {img_url}")
-                        img_response = session.get(img_url, timeout=10)
-                        if img_response.status_code == 200 and len(img_response.content) < 2000000:
-                            content_type = img_response.headers.get('content-type', 'image/jpeg')
-                            img_data = base64.b64encode(img_response.content).decode('utf-8')
-                            
-                            # Set both src and the lazy attributes
-                            img['src'] = f"data:{content_type};base64,{img_data}"
-                            img[attr] = f"data:{content_type};base64,{img_data}"
-                            
-                            logging.info(f"Successfully converted lazy image: {img_url}")
-                            break  # Only process the first valid lazy attribute
-                    except Exception as e:
-                        logging.warning(f"Failed to process lazy image {img.get(attr)}: {str(e)}")
-        
-        # Remove problematic meta tags
+                        logging.info(f"Successfully converted lazy image: {img_url}")
+                        break  # Only process the first valid lazy attribute
+                except Exception as e:
+                    logging.warning(f"Failed to process lazy image {img.get(attr)}: {str(e)}")
+    
+    # Remove problematic meta tags
+    for meta in soup.find_all('meta'):
+        if meta.get('http-equiv') == 'Content-Security-Policy':
+            meta.decompose()
+    
+    # Add meta tag with more permissive CSP for stylesheets
+    if soup.head:
+        # Remove existing CSP meta tags that might conflict
         for meta in soup.find_all('meta'):
             if meta.get('http-equiv') == 'Content-Security-Policy':
                 meta.decompose()
         
-        # Add meta tag with more permissive CSP for stylesheets
-        if soup.head:
-            # Remove existing CSP meta tags that might conflict
-            for meta in soup.find_all('meta'):
-                if meta.get('http-equiv') == 'Content-Security-Policy':
-                    meta.decompose()
-            
-            csp_meta = soup.new_tag('meta')
-            csp_meta.attrs['http-equiv'] = 'Content-Security-Policy'
-            # Much more permissive CSP - allow most things except dangerous scripts
-            csp_meta.attrs['content'] = "default-src * data: blob: 'unsafe-inline' 'unsafe-eval'; script-src * 'unsafe-inline' 'unsafe-eval'; style-src * 'unsafe-inline'; img-src * data: blob:;"
-            soup.head.insert(0, csp_meta)
-        
-        return str(soup)
-    except Exception as e:
-        logging.error(f"Error processing resources: {str(e)}")
-        return html_content
+        csp_meta = soup.new_tag('meta')
+        csp_meta.attrs['http-equiv'] = 'Content-Security-Policy'
+        # Much more permissive CSP - allow most things except dangerous scripts
+        csp_meta.attrs['content'] = "default-src * data: blob: 'unsafe-inline' 'unsafe-eval'; script-src * 'unsafe-inline' 'unsafe-eval'; style-src * 'unsafe-inline'; img-src * data: blob:;"
+        soup.head.insert(0, csp_meta)
+    
+    return soup
+
+def apply_meta_fixups(soup):
+    """
+    Make sure the document declares a charset and a mobile viewport (modified in place)
+    """
+    # Add viewport meta tag if not present
+    if soup.head and not soup.find('meta', attrs={'name': 'viewport'}):
+        viewport_meta = soup.new_tag('meta')
+        viewport_meta.attrs['name'] = 'viewport'
+        viewport_meta.attrs['content'] = 'width=device-width, initial-scale=1.0'
+        soup.head.insert(0, viewport_meta)
+    
+    # Add charset meta tag if not present
+    if soup.head and not soup.find('meta', attrs={'charset': True}):
+        charset_meta = soup.new_tag('meta')
+        charset_meta.attrs['charset'] = 'UTF-8'
+        soup.head.insert(0, charset_meta)
+    
+    return soup
+
+def prune_external_embeds(soup, page_url):
+    """
+    Remove embeds and off-site forms that cannot work from a self-contained copy (modified in place)
+    """
+    # Remove any remaining external references that might cause issues
+    for tag in soup.find_all(['iframe', 'embed', 'object']):
+        tag.decompose()
+    
+    # Remove external forms that might not work
+    for form in soup.find_all('form'):
+        action = form.get('action', '')
+        if action and action.startswith('http') and not action.startswith(page_url):
+            form.decompose()
+    
+    return soup
 
 def process_css_content(css_content, css_base_url, session):
     """
@@ -260,6 +334,13 @@ def add_cors_headers(response):
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
     return response
 
+# Attribute AI calls to the endpoint and user of the request that makes them
+@app.before_request
+def set_ai_metrics_context():
+    body = request.get_json(silent=True) if request.is_json else None
+    user = request.headers.get('X-User-Id') or (body.get('user_id') if isinstance(body, dict) else None)
+    set_call_context(request.url_rule.rule if request.url_rule else request.path, user)
+
 
 
 # Configure logging
@@ -275,6 +356,12 @@ FIREBASE_AUTH_DOMAIN = f"{FIREBASE_PROJECT_ID}.firebaseapp.com"
 CEREBRAS_API_KEY = os.environ.get('CEREBRAS_API_KEY', 'csk-rkhkxny26c6rvj32cfd4wtwf8n3w8drncpx9j88dkk66fre6')
 CEREBRAS_API_URL = 'https://api.cerebras.ai/v1/chat/completions'
 
+# Upper bound on concurrent requests to the AI provider; the throttle adapts below it
+AI_MAX_IN_FLIGHT = int(os.environ.get('AI_MAX_IN_FLIGHT', '8'))
+
+# Tokenize pages while they download and start fetching their assets early
+STREAMING_FETCH = os.environ.get('STREAMING_FETCH', 'true').lower() == 'true'
+
 # Firebase Authentication Class
 class FirebaseAuth:
     def __init__(self):
@@ -562,43 +649,111 @@ class FirebaseAuth:
 
 # Cerebras AI Integration Class
 class CerebrasAI:
+    # Condensed per-type requirements for batched prompts
+    BATCH_GUIDELINES = {
+        'headline': 'engaging and click-worthy, SEO keywords, clear value proposition, emotional appeal or urgency, power words, varied styles',
+        'subheadline': 'supports the headline, adds value proposition details and credibility, benefit-focused, concise but informative',
+        'description': 'builds trust and credibility, unique value, social proof, addresses pain points, specific benefits, professional yet engaging',
+        'cta': 'action-oriented, urgent, clear benefit, power words, 2-5 words, first person where it fits',
+        'default': 'engaging, SEO-optimized, clear value proposition, action-oriented, professional yet accessible'
+    }
+    
+    MODEL = "llama3.1-8b"  # Cerebras model
+    TEMPERATURE = 0.8
+    
     def __init__(self):
         self.api_key = CEREBRAS_API_KEY
         self.api_url = CEREBRAS_API_URL
     
-    def generate_content_suggestions(self, original_content, content_type, context=""):
-        """Generate 10 optimized suggestions for any content type using Cerebras AI"""
+    def _chat_payload(self, prompt, max_tokens=1000, stream=False):
+        return {
+            "model": self.MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are an expert SEO copywriter and digital marketing specialist. Your job is to create compelling, SEO-optimized content that increases click-through rates and conversions. IMPORTANT: Always respond in the same language as the original content. If the original content is in French, respond in French. If it's in English, respond in English. Maintain the same linguistic style and cultural context as the original."
+                },
+                {
+                    "role": "user", 
+                    "content": prompt
+                }
+            ],
+            "max_tokens": max_tokens,
+            "temperature": self.TEMPERATURE,
+            "stream": stream
+        }
+    
+    def _post_chat(self, prompt, max_tokens=1000, content_type=None, interactive=False, timeout=AI_REQUEST_TIMEOUT):
+        """
+        Send one chat completion request through the process-wide throttle (retries 429/5xx)
+        Identical requests already in flight are not sent again; callers share the reply,
+        a ChatReply (parsed once, no live connection), and each waits at most its own timeout
+        The router picks the provider; interactive requests may be hedged on a second one
+        """
+        payload = self._chat_payload(prompt, max_tokens)
+        tokens = estimate_tokens(prompt, max_tokens)
+        
+        def send():
+            with ai_metrics.track(content_type, prompt) as call:
+                response = ai_throttle.request(
+                    lambda: llm_router.post(payload, timeout, hedge=interactive, estimated_tokens=tokens),
+                    tokens
+                )
+                call.observe(response)
+            return ChatReply(response)
+        
+        return single_flight.do(request_key(payload), send, timeout=sum(timeout),
+                                on_shared=lambda: ai_metrics.record_coalesced(content_type))
+    
+    def _cache_key(self, content, content_type, model=None):
+        # model: the one that wrote the suggestions, when the router fell back from MODEL to another
+        return suggestion_cache.key(content, content_type, self._detect_language(content), model or self.MODEL,
+                                    self.TEMPERATURE)
+    
+    @staticmethod
+    def _model_of(response):
+        """Model of the provider the router got the response from"""
+        provider = getattr(response, 'llm_provider', None)
+        return provider.model if provider is not None else None
+    
+    def cached_suggestions(self, original_content, content_type):
+        """What the suggestion cache holds for the content (what /scrape showed), without counting a lookup"""
+        return suggestion_cache.get(self._cache_key(original_content, content_type), record=False)
+    
+    def generate_content_suggestions(self, original_content, content_type, context="", use_cache=True, store=True,
+                                     interactive=False):
+        """
+        Generate 10 optimized suggestions for any content type using Cerebras AI
+        store=False leaves the cache as it is (for "more" requests, which must not replace
+        what /scrape showed); interactive=True, for an editor waiting on the answer, lets
+        the router hedge the request
+        """
+        if use_cache:
+            cached = suggestion_cache.get(self._cache_key(original_content, content_type))
+            if cached is not None:
+                ai_metrics.record_cache_hit(content_type)
+                return {'success': True, 'suggestions': cached}
+        else:
+            suggestion_cache.note_bypass()
+        
+        return self.generate_fresh_suggestions(original_content, content_type, context, store=store,
+                                               interactive=interactive)
+    
+    def generate_fresh_suggestions(self, original_content, content_type, context="", store=True, interactive=False):
+        """Ask the AI without consulting the cache; a successful result is cached unless store is False"""
         try:
             prompt = self._create_content_optimization_prompt(original_content, content_type, context)
             
-            headers = {
-                'Authorization': f'Bearer {self.api_key}',
-                'Content-Type': 'application/json'
-            }
-            
-            payload = {
-                "model": "llama3.1-8b",  # Cerebras model
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are an expert SEO copywriter and digital marketing specialist. Your job is to create compelling, SEO-optimized content that increases click-through rates and conversions. IMPORTANT: Always respond in the same language as the original content. If the original content is in French, respond in French. If it's in English, respond in English. Maintain the same linguistic style and cultural context as the original."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                "max_tokens": 1000,
-                "temperature": 0.8,
-                "stream": False
-            }
-            
-            response = requests.post(self.api_url, json=payload, headers=headers)
+            started = time.perf_counter()
+            response = self._post_chat(prompt, content_type=content_type, interactive=interactive)
             data = response.json()
             
             if response.status_code == 200:
                 ai_response = data['choices'][0]['message']['content']
                 suggestions = self._parse_suggestions(ai_response)
+                if store:
+                    key = self._cache_key(original_content, content_type, self._model_of(response))
+                    suggestion_cache.put(key, suggestions, time.perf_counter() - started)
                 return {'success': True, 'suggestions': suggestions}
             else:
                 logger.error(f"Cerebras AI error: {response.status_code} - {response.text}")
@@ -608,33 +763,151 @@ class CerebrasAI:
             logger.error(f"Cerebras AI integration error: {str(e)}")
             return {'error': 'Failed to generate AI suggestions'}
 
+    def stream_content_suggestions(self, original_content, content_type, context="", use_cache=True, store=True,
+                                   interactive=False):
+        """
+        Generate suggestions from the provider's token stream
+        Yields ('suggestion', text) as soon as each numbered line is complete, then
+        one ('done', result) where result is shaped like generate_content_suggestions
+        """
+        if use_cache:
+            cached = suggestion_cache.get(self._cache_key(original_content, content_type))
+            if cached is not None:
+                ai_metrics.record_cache_hit(content_type)
+                for suggestion in cached:
+                    yield 'suggestion', suggestion
+                yield 'done', {'success': True, 'suggestions': cached}
+                return
+        else:
+            suggestion_cache.note_bypass()
+        
+        try:
+            prompt = self._create_content_optimization_prompt(original_content, content_type, context)
+            
+            started = time.perf_counter()
+            tokens = estimate_tokens(prompt, 1000)
+            with ai_metrics.track(content_type, prompt) as call, ai_throttle.slot(tokens) as outcome:
+                response = llm_router.post(self._chat_payload(prompt, stream=True), AI_REQUEST_TIMEOUT,
+                                           stream=True, hedge=interactive, estimated_tokens=tokens)
+                outcome.observe(response)
+                call.observe(response)
+                try:
+                    if response.status_code != 200:
+                        logger.error(f"Cerebras AI error: {response.status_code} - {response.text}")
+                        yield 'done', {'error': f'AI service error: {response.status_code}'}
+                        return
+                    
+                    fragments = []
+                    usage = {}
+                    assembler = LineAssembler()
+                    emitted = 0
+                    for fragment in iter_chat_deltas(response, usage):
+                        fragments.append(fragment)
+                        for line in assembler.feed(fragment):
+                            suggestion = self._parse_suggestion_line(line)
+                            if suggestion and emitted < 10:
+                                emitted += 1
+                                yield 'suggestion', suggestion
+                    suggestion = self._parse_suggestion_line(assembler.flush())
+                    if suggestion and emitted < 10:
+                        yield 'suggestion', suggestion
+                    call.completion_text = ''.join(fragments)
+                    call.set_usage(usage)
+                finally:
+                    response.close()
+            
+            # Same parse as the non-streaming path, so the final payload matches it exactly
+            suggestions = self._parse_suggestions(''.join(fragments))
+            if store:
+                key = self._cache_key(original_content, content_type, self._model_of(response))
+                suggestion_cache.put(key, suggestions, time.perf_counter() - started)
+            yield 'done', {'success': True, 'suggestions': suggestions}
+            
+        except Exception as e:
+            logger.error(f"Cerebras AI streaming error: {str(e)}")
+            yield 'done', {'error': 'Failed to generate AI suggestions'}
+
+    def generate_batch_suggestions(self, items, context="", fallback=True, use_cache=True):
+        """
+        Generate suggestions for several elements with one request per batch
+        items: list of (content, content_type) tuples
+        Returns one result per item, shaped like generate_content_suggestions.
+        Items a batch reply does not cover are retried one by one, or left as
+        None when fallback is False so the caller can schedule them itself.
+        """
+        results = [None] * len(items)
+        pending = []
+        for index, (content, content_type) in enumerate(items):
+            cached = suggestion_cache.get(self._cache_key(content, content_type)) if use_cache else None
+            if cached is not None:
+                ai_metrics.record_cache_hit(content_type)
+                results[index] = {'success': True, 'suggestions': cached}
+            else:
+                pending.append(index)
+        if not use_cache:
+            suggestion_cache.note_bypass()
+        
+        for chunk in chunk_items(pending):
+            batch = [
+                {'content': items[index][0], 'content_type': items[index][1], 'language': self._detect_language(items[index][0])}
+                for index in chunk
+            ]
+            suggestions = None
+            model = None
+            try:
+                prompt = build_batch_prompt(batch, context, self.BATCH_GUIDELINES)
+                started = time.perf_counter()
+                response = self._post_chat(prompt, max_tokens=batch_max_tokens(len(batch)), content_type='batch')
+                elapsed = time.perf_counter() - started
+                model = self._model_of(response)
+                if response.status_code == 200:
+                    suggestions = parse_batch_reply(response.json()['choices'][0]['message']['content'], len(batch))
+                    if suggestions is None:
+                        logger.warning(f"Malformed batch reply for {len(batch)} elements, falling back to per-element prompts")
+                else:
+                    logger.error(f"Cerebras AI batch error: {response.status_code} - {response.text}")
+            except Exception as e:
+                logger.error(f"Cerebras AI batch integration error: {str(e)}")
+            
+            for index, item_suggestions in zip(chunk, suggestions or [None] * len(batch)):
+                if item_suggestions:
+                    results[index] = {'success': True, 'suggestions': item_suggestions}
+                    suggestion_cache.put(self._cache_key(*items[index], model), item_suggestions,
+                                         elapsed / len(batch))
+        
+        if fallback:
+            for index, (content, content_type) in enumerate(items):
+                if results[index] is None:
+                    results[index] = self.generate_fresh_suggestions(content, content_type, context)
+        return results
+    
     def generate_headline_suggestions(self, original_headline, context=""):
         """Generate 10 SEO-optimized headline suggestions using Cerebras AI (backward compatibility)"""
         return self.generate_content_suggestions(original_headline, "headline", context)
     
+    def _detect_language(self, text):
+        """Detect language based on content"""
+        # Simple language detection based on common French words/patterns
+        french_indicators = [
+            'le ', 'la ', 'les ', 'un ', 'une ', 'des ', 'du ', 'de la ', 'de ',
+            'avec', 'pour', 'sur', 'dans', 'et ', 'ou ', 'mais', 'donc',
+            'à ', 'au ', 'aux ', 'en ', 'par ', 'chez',
+            'économies', 'électricité', 'solaire', 'énergie',
+            "d'", "l'", "c'", "n'", "s'", "t'", "m'"
+        ]
+        
+        text_lower = text.lower()
+        french_count = sum(1 for indicator in french_indicators if indicator in text_lower)
+        
+        if french_count >= 2:  # If we find 2+ French indicators, likely French
+            return "French"
+        else:
+            return "English"
+    
     def _create_content_optimization_prompt(self, content, content_type, context):
         """Create an optimized prompt based on content type"""
         
-        # Detect language based on content
-        def detect_language(text):
-            # Simple language detection based on common French words/patterns
-            french_indicators = [
-                'le ', 'la ', 'les ', 'un ', 'une ', 'des ', 'du ', 'de la ', 'de ',
-                'avec', 'pour', 'sur', 'dans', 'et ', 'ou ', 'mais', 'donc',
-                'à ', 'au ', 'aux ', 'en ', 'par ', 'chez',
-                'économies', 'électricité', 'solaire', 'énergie',
-                "d'", "l'", "c'", "n'", "s'", "t'", "m'"
-            ]
-            
-            text_lower = text.lower()
-            french_count = sum(1 for indicator in french_indicators if indicator in text_lower)
-            
-            if french_count >= 2:  # If we find 2+ French indicators, likely French
-                return "French"
-            else:
-                return "English"
-        
-        detected_language = detect_language(content)
+        detected_language = self._detect_language(content)
         
         # Language-specific instructions
         if detected_language == "French":
@@ -760,6 +1033,17 @@ Format your response as a numbered list (1-10) with just the content suggestions
         """Create an optimized prompt for headline suggestions (backward compatibility)"""
         return self._create_content_optimization_prompt(headline, "headline", context)
     
+    def _parse_suggestion_line(self, line):
+        """Suggestion text from one line of the AI response, or None"""
+        line = line.strip()
+        # Look for numbered lines (1., 2., etc.)
+        if re.match(r'^\d+\.', line):
+            # Remove the number and clean the suggestion
+            suggestion = re.sub(r'^\d+\.\s*', '', line).strip()
+            if suggestion:
+                return suggestion
+        return None
+    
     def _parse_suggestions(self, ai_response):
         """Parse AI response to extract clean suggestions list"""
         try:
@@ -767,13 +1051,9 @@ Format your response as a numbered list (1-10) with just the content suggestions
             suggestions = []
             
             for line in lines:
-                line = line.strip()
-                # Look for numbered lines (1., 2., etc.)
-                if re.match(r'^\d+\.', line):
-                    # Remove the number and clean the suggestion
-                    suggestion = re.sub(r'^\d+\.\s*', '', line).strip()
-                    if suggestion:
-                        suggestions.append(suggestion)
+                suggestion = self._parse_suggestion_line(line)
+                if suggestion:
+                    suggestions.append(suggestion)
             
             # If we don't have exactly 10, try a different parsing approach
             if len(suggestions) != 10:
@@ -789,6 +1069,14 @@ Format your response as a numbered list (1-10) with just the content suggestions
             return []
 
 class WebScraper:
+    # Scraped field -> content type used for its AI suggestions
+    AI_CONTENT_FIELDS = [
+        ('headline', 'headline'),
+        ('subheadline', 'subheadline'),
+        ('description_credibility', 'description'),
+        ('call_to_action', 'cta')
+    ]
+    
     def __init__(self):
         self.session = requests.Session()
         self.session.headers.update({
@@ -936,25 +1224,11 @@ class WebScraper:
             response = self.session.get(url, timeout=10)
             response.raise_for_status()
             
-            # Parse HTML
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Remove unwanted elements BEFORE extracting content
-            soup = self._remove_unwanted_elements(soup)
-            
-            # For now, use the original HTML without proxy rewriting
-            # The new self-contained endpoint handles CORS issues differently
-            
-            # Extract data
-            scraped_data = {
-                'html': str(soup),
-                'headline': self._extract_headline(soup),
-                'subheadline': self._extract_subheadline(soup),
-                'call_to_action': self._extract_call_to_action(soup),
-                'description_credibility': self._extract_description_credibility(soup)
-            }
-            
-            return scraped_data
+            # Parse, clean and extract off the request thread when the pool is enabled,
+            # skipping selectors this domain has never matched
+            result = parse_pool.run(_parse_and_extract, response.content, extraction_profiles.plan_for(url))
+            extraction_profiles.record(result.pop('extraction_profile'))
+            return result
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Request error for {url}: {str(e)}")
@@ -963,6 +1237,40 @@ class WebScraper:
             logger.error(f"Scraping error for {url}: {str(e)}")
             return {'error': f'Failed to scrape website: {str(e)}'}
     
+    def extract_from_content(self, content, plan=None):
+        """
+        Decode, parse, clean and extract from raw page bytes
+        The plan's outcome is returned under 'extraction_profile' for the caller to record
+        """
+        plan = plan or ExtractionPlan()
+        
+        # Parse HTML
+        soup = BeautifulSoup(content, 'html.parser')
+        
+        # Remove unwanted elements BEFORE extracting content
+        soup = self._remove_unwanted_elements(soup)
+        
+        # For now, use the original HTML without proxy rewriting
+        # The new self-contained endpoint handles CORS issues differently
+        
+        # Extract data, noting which element each item came from
+        plan.begin()
+        element_map = ElementMap()
+        result = {
+            'headline': self._extract_headline(soup, plan, element_map),
+            'subheadline': self._extract_subheadline(soup, plan, element_map),
+            'call_to_action': self._extract_call_to_action(soup, plan, element_map),
+            'description_credibility': self._extract_description_credibility(soup, plan, element_map),
+            'extraction_profile': plan.result()
+        }
+        
+        # Serialize once with the elements marked so the map can give their offsets in the returned html
+        element_map.mark()
+        result['html'], result['element_map'] = element_map.finish(
+            str(soup), {field: len(result[field]) for field, _ in self.AI_CONTENT_FIELDS}
+        )
+        return result
+    
     def scrape_complete_website(self, url):
         """
         Scrape complete HTML and CSS including external stylesheets
@@ -976,15 +1284,26 @@ class WebScraper:
             
             base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
             
-            # Make request
-            response = self.session.get(url, timeout=15)
-            response.raise_for_status()
-            
-            # Parse HTML
-            soup = BeautifulSoup(response.content, 'html.parser')
+            # Make request, fetching stylesheets while the page is still arriving
+            prefetcher = None
+            if STREAMING_FETCH:
+                response, page_bytes, prefetcher = fetch_with_asset_prefetch(
+                    self.session, url, self.session, timeout=15, kinds=('stylesheet',)
+                )
+            else:
+                response = self.session.get(url, timeout=15)
+                response.raise_for_status()
+                page_bytes = response.content
             
-            # Download and embed external CSS files
-            css_content = self._download_external_css(soup, base_url, url)
+            try:
+                # Parse HTML
+                soup = BeautifulSoup(page_bytes, 'html.parser')
+                
+                # Download and embed external CSS files
+                css_content = self._download_external_css(soup, base_url, url, session=prefetcher)
+            finally:
+                if prefetcher:
+                    prefetcher.close()
             
             # Process and embed inline styles
             self._process_inline_styles(soup)
@@ -1009,8 +1328,9 @@ class WebScraper:
             logger.error(f"Complete scraping error for {url}: {str(e)}")
             return {'error': f'Failed to scrape complete website: {str(e)}'}
     
-    def _download_external_css(self, soup, base_url, page_url):
+    def _download_external_css(self, soup, base_url, page_url, session=None):
         """Download all external CSS files and return their content"""
+        session = session or self.session
         css_contents = []
         
         # Find all link tags with CSS stylesheets
@@ -1034,7 +1354,7 @@ class WebScraper:
                     css_url = urljoin(page_url, href)
                 
                 # Download CSS file
-                css_response = self.session.get(css_url, timeout=10)
+                css_response = session.get(css_url, timeout=10)
                 css_response.raise_for_status()
                 
                 # Process CSS content to handle relative URLs within CSS
@@ -1262,6 +1582,7 @@ class WebScraper:
             
             # Add metadata
             enhanced_data['ai_enhanced'] = True
+            enhanced_data['ai_dedupe'] = {'items': len(ai_results), 'enriched': len(ai_results) - len(copies)}
             enhanced_data['processing_timestamp'] = datetime.now(timezone.utc).isoformat()
             
             return enhanced_data
@@ -1270,8 +1591,9 @@ class WebScraper:
             logger.error(f"AI-enhanced scraping error for {url}: {str(e)}")
             return {'error': f'Failed to scrape website with AI enhancement: {str(e)}'}
     
-    def _extract_headline(self, soup):
+    def _extract_headline(self, soup, plan=None, element_map=None):
         """Extract main headline from the page"""
+        plan = plan or ExtractionPlan()
         headlines = []
         
         # Try different selectors for headlines
@@ -1287,17 +1609,24 @@ class WebScraper:
             'header h2'
         ]
         
-        for selector in selectors:
+        for selector in plan.selectors('headline', selectors):
+            found = len(headlines)
             elements = soup.select(selector)
             for element in elements:
                 text = element.get_text(strip=True)
                 if self._is_valid_content(text, min_length=10, max_length=200):
+                    if element_map is not None:
+                        element_map.add('headline', len(headlines), 'headline', element, text)
                     headlines.append(text)
+            plan.record('headline', selector, len(headlines) - found)
+            if plan.quota_reached(len(headlines), 3):
+                break
         
         return headlines[:3] if headlines else []
     
-    def _extract_subheadline(self, soup):
+    def _extract_subheadline(self, soup, plan=None, element_map=None):
         """Extract subheadlines from the page"""
+        plan = plan or ExtractionPlan()
         subheadlines = []
         
         # Try different selectors for subheadlines
@@ -1312,17 +1641,24 @@ class WebScraper:
             '.hero p:first-of-type'
         ]
         
-        for selector in selectors:
+        for selector in plan.selectors('subheadline', selectors):
+            found = len(subheadlines)
             elements = soup.select(selector)
             for element in elements:
                 text = element.get_text(strip=True)
                 if self._is_valid_content(text, min_length=5, max_length=300):
+                    if element_map is not None:
+                        element_map.add('subheadline', len(subheadlines), 'subheadline', element, text)
                     subheadlines.append(text)
+            plan.record('subheadline', selector, len(subheadlines) - found)
+            if plan.quota_reached(len(subheadlines), 5):
+                break
         
         return subheadlines[:5] if subheadlines else []
     
-    def _extract_description_credibility(self, soup):
+    def _extract_description_credibility(self, soup, plan=None, element_map=None):
         """Extract description/credibility content combined"""
+        plan = plan or ExtractionPlan()
         descriptions = []
         
         # Try different selectors for descriptions and credibility
@@ -1353,7 +1689,8 @@ class WebScraper:
             '[class*="success"]'
         ]
         
-        for selector in selectors:
+        for selector in plan.selectors('description_credibility', selectors):
+            found = len(descriptions)
             if selector.startswith('meta'):
                 elements = soup.select(selector)
                 for element in elements:
@@ -1368,12 +1705,19 @@ class WebScraper:
                         # Clean the text
                         clean_text = re.sub(r'\s+', ' ', text).strip()
                         if clean_text not in descriptions:
+                            if element_map is not None:
+                                element_map.add('description_credibility', len(descriptions), 'description',
+                                             element, clean_text)
                             descriptions.append(clean_text)
+            plan.record('description_credibility', selector, len(descriptions) - found)
+            if plan.quota_reached(len(descriptions), 8):
+                break
         
         return descriptions[:8] if descriptions else []
     
-    def _extract_call_to_action(self, soup):
+    def _extract_call_to_action(self, soup, plan=None, element_map=None):
         """Extract textual call-to-action phrases and compelling text"""
+        plan = plan or ExtractionPlan()
         ctas = []
         
         # Common CTA phrases to look for
@@ -1386,8 +1730,8 @@ class WebScraper:
         # Look for text containing CTA phrases
         all_text_elements = soup.find_all(string=True)
         
-        for text in all_text_elements:
-            text = text.strip()
+        for node in all_text_elements:
+            text = node.strip()
             if len(text) > 5 and len(text) < 200:  # Filter reasonable length text
                 text_lower = text.lower()
                 
@@ -1397,6 +1741,8 @@ class WebScraper:
                         # Clean the text and add to CTAs
                         clean_text = re.sub(r'\s+', ' ', text).strip()
                         if clean_text not in ctas and len(clean_text) > 3:
+                            if element_map is not None:
+                                element_map.add('call_to_action', len(ctas), 'cta', node.parent, clean_text)
                             ctas.append(clean_text)
                         break
         
@@ -1411,14 +1757,20 @@ class WebScraper:
             'a[class*="button"]'
         ]
         
-        for selector in cta_selectors:
+        for selector in plan.selectors('call_to_action', cta_selectors):
+            if plan.quota_reached(len(ctas), 10):
+                break
+            found = len(ctas)
             elements = soup.select(selector)
             for element in elements:
                 text = element.get_text(strip=True)
                 if self._is_valid_cta(text):
                     clean_text = re.sub(r'\s+', ' ', text).strip()
                     if clean_text not in ctas:
+                        if element_map is not None:
+                            element_map.add('call_to_action', len(ctas), 'cta', element, clean_text)
                         ctas.append(clean_text)
+            plan.record('call_to_action', selector, len(ctas) - found)
         
         return ctas[:10] if ctas else []
     
@@ -1478,97 +1830,113 @@ class WebScraper:
         
         return True
 
-    def scrape_website_with_ai(self, url, cerebras_ai):
+    def scrape_website_with_ai(self, url, cerebras_ai, use_cache=True):
         """
         Scrape a website and enhance all content with AI suggestions
         """
+        return self.scrape_websites_with_ai([url], cerebras_ai, use_cache)[0]
+    
+    def scrape_websites_with_ai(self, urls, cerebras_ai, use_cache=True):
+        """
+        Scrape several websites and enhance all their content with AI suggestions
+        Pages are scraped in parallel and each page's AI calls (batched prompts, or one
+        per item) are queued on the shared AI executor as soon as the page is ready
+        """
+        with ContextThreadPoolExecutor(max_workers=max(1, len(urls)), thread_name_prefix='scrape') as scrape_executor:
+            pending = [scrape_executor.submit(self._scrape_and_queue_ai, url, cerebras_ai, use_cache) for url in urls]
+            return [self._collect_ai_results(url, future, cerebras_ai) for url, future in zip(urls, pending)]
+    
+    def _scrape_and_queue_ai(self, url, cerebras_ai, use_cache=True):
+        """Scrape one page and submit its AI calls: one per batch of items, or one per item"""
+        scraped_data = self.scrape_website(url)
+        if 'error' in scraped_data:
+            return scraped_data, [], {}
+        
+        context = f"Website: {url}"
+        entries = [
+            (field, position, item, content_type)
+            for field, content_type in self.AI_CONTENT_FIELDS
+            for position, item in enumerate(scraped_data.get(field) or [])
+        ]
+        
+        # Only the first of each group of (near-)duplicate items is enriched; copies reuse its result
+        leaders = group_duplicates([(item, content_type) for _, _, item, content_type in entries])
+        copies = {
+            entries[index][:2]: entries[leader][:2]
+            for index, leader in enumerate(leaders) if leader != index
+        }
+        entries = [entry for index, entry in enumerate(entries) if leaders[index] == index]
+        
+        jobs = []
+        if AI_BATCH_PROMPTS:
+            for chunk in chunk_items(entries):
+                pairs = [(item, content_type) for _, _, item, content_type in chunk]
+                future = ai_executor.submit(cerebras_ai.generate_batch_suggestions, pairs, context, False, use_cache)
+                jobs.append((chunk, future, True))
+        else:
+            for entry in entries:
+                _, _, item, content_type = entry
+                future = ai_executor.submit(cerebras_ai.generate_content_suggestions, item, content_type,
+                                            context=context, use_cache=use_cache)
+                jobs.append(([entry], future, False))
+        return scraped_data, jobs, copies
+    
+    def _collect_ai_results(self, url, scrape_future, cerebras_ai):
+        """Wait for one page's AI calls and assemble the enhanced response"""
         try:
-            # First, do the regular scraping
-            scraped_data = self.scrape_website(url)
+            scraped_data, jobs, copies = scrape_future.result()
             if 'error' in scraped_data:
                 return scraped_data
             
-            # Enhance all content with AI suggestions
-            enhanced_data = scraped_data.copy()
-            
-            # Process headlines
-            if scraped_data.get('headline'):
-                enhanced_headlines = []
-                for headline in scraped_data['headline']:
-                    ai_result = cerebras_ai.generate_content_suggestions(
-                        headline, 
-                        "headline",
-                        context=f"Website: {url}"
-                    )
-                    
-                    headline_data = {
-                        'original': headline,
-                        'ai_suggestions': ai_result.get('suggestions', []) if 'success' in ai_result else [],
-                        'ai_error': ai_result.get('error') if 'error' in ai_result else None
-                    }
-                    enhanced_headlines.append(headline_data)
+            ai_results = {}
+            retries = []
+            for chunk, future, batched in jobs:
+                try:
+                    results = future.result() if batched else [future.result()]
+                except Exception as e:
+                    logger.error(f"AI suggestion task failed for {url}: {str(e)}")
+                    results = [None] * len(chunk) if batched else [{'error': 'Failed to generate AI suggestions'}]
                 
-                enhanced_data['headline'] = enhanced_headlines
+                for (field, position, item, content_type), result in zip(chunk, results):
+                    if result is None:
+                        # Not covered by the batch reply: ask for this item on its own
+                        retries.append(((field, position), ai_executor.submit(
+                            cerebras_ai.generate_fresh_suggestions, item, content_type, context=f"Website: {url}"
+                        )))
+                    else:
+                        ai_results[(field, position)] = result
             
-            # Process subheadlines
-            if scraped_data.get('subheadline'):
-                enhanced_subheadlines = []
-                for subheadline in scraped_data['subheadline']:
-                    ai_result = cerebras_ai.generate_content_suggestions(
-                        subheadline,
-                        "subheadline",
-                        context=f"Website: {url}"
-                    )
-                    
-                    subheadline_data = {
-                        'original': subheadline,
-                        'ai_suggestions': ai_result.get('suggestions', []) if 'success' in ai_result else [],
-                        'ai_error': ai_result.get('error') if 'error' in ai_result else None
-                    }
-                    enhanced_subheadlines.append(subheadline_data)
-                
-                enhanced_data['subheadline'] = enhanced_subheadlines
+            for key, future in retries:
+                try:
+                    ai_results[key] = future.result()
+                except Exception as e:
+                    logger.error(f"AI suggestion task failed for {url}: {str(e)}")
+                    ai_results[key] = {'error': 'Failed to generate AI suggestions'}
             
-            # Process descriptions/credibility content
-            if scraped_data.get('description_credibility'):
-                enhanced_descriptions = []
-                for description in scraped_data['description_credibility']:
-                    ai_result = cerebras_ai.generate_content_suggestions(
-                        description,
-                        "description",
-                        context=f"Website: {url}"
-                    )
-                    
-                    description_data = {
-                        'original': description,
-                        'ai_suggestions': ai_result.get('suggestions', []) if 'success' in ai_result else [],
-                        'ai_error': ai_result.get('error') if 'error' in ai_result else None
-                    }
-                    enhanced_descriptions.append(description_data)
-                
-                enhanced_data['description_credibility'] = enhanced_descriptions
+            for key, leader in copies.items():
+                ai_results[key] = ai_results[leader]
             
-            # Process call-to-action content
-            if scraped_data.get('call_to_action'):
-                enhanced_ctas = []
-                for cta in scraped_data['call_to_action']:
-                    ai_result = cerebras_ai.generate_content_suggestions(
-                        cta,
-                        "cta",
-                        context=f"Website: {url}"
-                    )
-                    
-                    cta_data = {
-                        'original': cta,
+            # Enhance all content with AI suggestions
+            enhanced_data = scraped_data.copy()
+            element_map = scraped_data.get('element_map') or {}
+            for field, _ in self.AI_CONTENT_FIELDS:
+                if not scraped_data.get(field):
+                    continue
+                enhanced_items = []
+                for position, original in enumerate(scraped_data[field]):
+                    ai_result = ai_results[(field, position)]
+                    entry = element_map.get(field, [None] * (position + 1))[position]
+                    enhanced_items.append({
+                        'id': entry['id'] if entry else None,
+                        'original': original,
                         'ai_suggestions': ai_result.get('suggestions', []) if 'success' in ai_result else [],
                         'ai_error': ai_result.get('error') if 'error' in ai_result else None
-                    }
-                    enhanced_ctas.append(cta_data)
-                
-                enhanced_data['call_to_action'] = enhanced_ctas
+                    })
+                enhanced_data[field] = enhanced_items
             
             # Add metadata
             enhanced_data['ai_enhanced'] = True
+            enhanced_data['ai_dedupe'] = {'items': len(ai_results), 'enriched': len(ai_results) - len(copies)}
             enhanced_data['processing_timestamp'] = datetime.now(timezone.utc).isoformat()
             
             return enhanced_data
@@ -1577,10 +1945,27 @@ class WebScraper:
             logger.error(f"AI-enhanced scraping error for {url}: {str(e)}")
             return {'error': f'Failed to scrape website with AI enhancement: {str(e)}'}
 
-# Initialize scraper, Firebase auth, and AI
+def _parse_and_extract(content, plan=None):
+    """Parse pool task: runs in a worker process (or in-process as a fallback)"""
+    return scraper.extract_from_content(content, plan)
+
+# Initialize scraper, parse pool, extraction profiles, Firebase auth, and AI
 scraper = WebScraper()
+parse_pool = ParsePool()
+ai_executor = ContextThreadPoolExecutor(max_workers=max(1, AI_MAX_IN_FLIGHT), thread_name_prefix='ai')
+extraction_profiles = ExtractionProfileStore()
+suggestion_cache = SuggestionCache(namespace='index')
+ai_throttle = AdaptiveConcurrencyController()
+single_flight = SingleFlight()
+llm_router = LLMRouter.from_env(LLMProvider('cerebras', CEREBRAS_API_URL, CerebrasAI.MODEL, CEREBRAS_API_KEY),
+                               throttle=ai_throttle)
+ai_metrics = AIMetrics()
+atexit.register(extraction_profiles.save)
 firebase_auth = FirebaseAuth()
 cerebras_ai = CerebrasAI()
+suggestion_pool = SuggestionPool(cerebras_ai)
+warm_engines = WarmEngines()
+document_store = create_document_store()
 
 @app.route('/health', methods=['GET'])
 def simple_health():
@@ -1601,6 +1986,11 @@ def health_check():
             'forgot_password': '/auth/forgot-password',
             'scrape': '/scrape',
             'scrape_complete': '/scrape-complete',
+            'extraction_profiles': '/extraction-profiles',
+            'suggestion_cache': '/suggestion-cache',
+            'ai_throttle': '/ai/throttle',
+            'ai_metrics': '/ai/metrics',
+            'document_store': '/document-store',
             'wordpress_ship': '/wordpress/ship' if WORDPRESS_AVAILABLE else None,
             'wordpress_test': '/wordpress/test-connection' if WORDPRESS_AVAILABLE else None,
             'wordpress_config': '/wordpress/config' if WORDPRESS_AVAILABLE else None
@@ -1614,7 +2004,10 @@ def health_check():
             'suggestions_per_item': 10,
             'content_types_supported': ['headline', 'subheadline', 'description', 'cta']
         },
-        'wordpress_integration': get_wordpress_status()
+        'wordpress_integration': get_wordpress_status(),
+        'parse_pool': parse_pool.status(),
+        'ai_throttle': ai_throttle.status(),
+        'ai_coalescing': single_flight.status()
     })
 
 @app.route('/auth/register', methods=['POST'])
@@ -1927,11 +2320,11 @@ def scrape_endpoint():
                 'message': 'Maximum 5 URLs allowed per AI-enhanced batch due to processing time'
             }), 400
         
-        results = []
-        for url in urls:
-            logger.info(f"Processing URL with AI enhancement: {url}")
-            result = scraper.scrape_website_with_ai(url, cerebras_ai)
-            results.append(result)
+        # "cache": false asks for fresh suggestions instead of cached ones
+        use_cache = data.get('cache', True) is not False
+        
+        logger.info(f"Processing {len(urls)} URLs with AI enhancement: {urls}")
+        results = scraper.scrape_websites_with_ai(urls, cerebras_ai, use_cache)
         
         return jsonify({
             'status': 'success',
@@ -1956,6 +2349,64 @@ def scrape_endpoint():
         error_response.headers.add('Access-Control-Allow-Methods', '*')
         return error_response, 500
 
+@app.route('/extraction-profiles', methods=['GET'])
+def get_extraction_profiles():
+    """
+    Per-domain selector profiles: which selectors are skipped and the extraction speedup
+    Optional query parameter: domain
+    """
+    domain = request.args.get('domain')
+    if domain:
+        profile = extraction_profiles.stats(domain)
+        if profile is None:
+            return jsonify({
+                'status': 'error',
+                'message': f'No extraction profile for {domain}'
+            }), 404
+        return jsonify({'status': 'success', 'data': profile})
+    
+    return jsonify({'status': 'success', 'data': extraction_profiles.stats()})
+
+@app.route('/suggestion-cache', methods=['GET'])
+def get_suggestion_cache_stats():
+    """
+    AI suggestion cache hit rate and the provider time it has saved,
+    plus the prefetched "more suggestions" pools
+    """
+    return jsonify({'status': 'success', 'data': {**suggestion_cache.stats(), 'pool': suggestion_pool.stats()}})
+
+@app.route('/ai/throttle', methods=['GET'])
+def get_ai_throttle_status():
+    """
+    Adaptive AI concurrency: current limit, token usage and recent throttle events,
+    plus how many identical requests were coalesced and per-provider routing health
+    """
+    return jsonify({
+        'status': 'success',
+        'data': {**ai_throttle.status(), 'coalescing': single_flight.status(), 'routing': llm_router.status()}
+    })
+
+@app.route('/document-store', methods=['GET'])
+def get_document_store_stats():
+    """
+    Size, count and evictions of the stored HTML documents served by /serve-html,
+    plus the parsed documents kept warm for further /apply-changes rounds
+    """
+    return jsonify({'status': 'success', 'data': {**document_store.stats(), 'warm_engines': warm_engines.stats()}})
+
+@app.route('/document-store/compact', methods=['POST'])
+def compact_document_store():
+    """Remove expired and over-cap documents now and reclaim the space they used"""
+    return jsonify({'status': 'success', 'data': {**document_store.compact(), **document_store.stats()}})
+
+@app.route('/ai/metrics', methods=['GET'])
+def get_ai_metrics():
+    """
+    Tokens, latency, errors and cache hits of AI calls, rolled up per endpoint,
+    content type and user
+    """
+    return jsonify({'status': 'success', 'data': ai_metrics.snapshot()})
+
 @app.route('/scrape-self-contained', methods=['POST'])
 def scrape_self_contained():
     """
@@ -1989,59 +2440,58 @@ def scrape_self_contained():
         
         logger.info(f"Fetching self-contained version of: {url}")
         
-        # Get the main page
-        response = session.get(url, timeout=30)
-        response.raise_for_status()
-        
-        # Process and inline all resources
-        self_contained_html = download_and_inline_resources(response.text, url)
-        
-        # Add additional security and performance improvements
-        soup = BeautifulSoup(self_contained_html, 'html.parser')
-        
-        # Add viewport meta tag if not present
-        if soup.head and not soup.find('meta', attrs={'name': 'viewport'}):
-            viewport_meta = soup.new_tag('meta')
-            viewport_meta.attrs['name'] = 'viewport'
-            viewport_meta.attrs['content'] = 'width=device-width, initial-scale=1.0'
-            soup.head.insert(0, viewport_meta)
-        
-        # Add charset meta tag if not present
-        if soup.head and not soup.find('meta', attrs={'charset': True}):
-            charset_meta = soup.new_tag('meta')
-            charset_meta.attrs['charset'] = 'UTF-8'
-            soup.head.insert(0, charset_meta)
-        
-        # Remove any remaining external references that might cause issues
-        for tag in soup.find_all(['iframe', 'embed', 'object']):
-            tag.decompose()
-        
-        # Remove external forms that might not work
-        for form in soup.find_all('form'):
-            action = form.get('action', '')
-            if action and action.startswith('http') and not action.startswith(url):
-                form.decompose()
-        
-        final_html = str(soup)
+        # Get the main page, starting asset downloads as their tags stream in
+        asset_session = None
+        if STREAMING_FETCH:
+            response, page_bytes, asset_session = fetch_with_asset_prefetch(session, url, new_asset_session(),
+                                                                            timeout=30)
+            decode = lambda: decode_body(response, page_bytes)
+        else:
+            response = session.get(url, timeout=30)
+            response.raise_for_status()
+            decode = lambda: response.text
         
-        # Store the HTML for direct serving
-        import uuid
-        html_id = str(uuid.uuid4())
-        if not hasattr(serve_html, 'html_cache'):
-            serve_html.html_cache = {}
-        serve_html.html_cache[html_id] = final_html
+        # Parse once, run every stage on the same tree, serialize once
+        with DocumentPipeline() as pipeline:
+            html_text = pipeline.run('decode', decode)
+            soup = pipeline.run('parse', BeautifulSoup, html_text, 'html.parser')
+            
+            # Process and inline all resources
+            try:
+                pipeline.run('inline_resources', inline_resources, soup, url, asset_session)
+            except Exception as e:
+                # Same as before: keep the page un-inlined rather than half-inlined
+                logger.error(f"Error processing resources: {str(e)}")
+                soup = pipeline.run('reparse', BeautifulSoup, html_text, 'html.parser')
+            finally:
+                if asset_session:
+                    asset_session.close()
+            
+            # Add additional security and performance improvements
+            pipeline.run('meta_fixups', apply_meta_fixups, soup)
+            pipeline.run('prune_external', prune_external_embeds, soup, url)
+            final_html = pipeline.run('serialize', str, soup)
+        
+        # Store the HTML for direct serving; a re-scrape of an unchanged page gets the same id
+        try:
+            html_id = document_store.store(final_html)
+        except DocumentTooLarge as e:
+            # The page is still returned inline, it just can't be served by id
+            logger.warning(f"Self-contained page not stored: {str(e)}")
+            html_id = None
         
         return jsonify({
             'status': 'success',
             'html': final_html,
             'url': url,
-            'serve_url': f'http://127.0.0.1:5000/serve-html/{html_id}',
+            'serve_url': f'http://127.0.0.1:5000/serve-html/{html_id}' if html_id else None,
             'html_id': html_id,
             'processing_info': {
                 'type': 'self_contained',
                 'size': len(final_html),
                 'description': 'All external resources have been downloaded and inlined. This HTML is completely self-contained and will not make any external requests.',
-                'cors_safe': True
+                'cors_safe': True,
+                'pipeline': pipeline.report()
             }
         })
     
@@ -2063,264 +2513,52 @@ def scrape_self_contained():
 def apply_changes():
     """
     Apply text changes to HTML content server-side to avoid CORS issues
+    
+    With html_id instead of html the changes are applied to that stored document and
+    the result is stored as a new revision; only its id and a summary are returned
+    
+    With response_format 'patch' the page is not sent back: patches lists the edits as
+    {start, end, html} replacements of [start, end) of the input HTML (in order, never
+    overlapping), so the response grows with the edits rather than the page. Offsets
+    and base_length are in UTF-16 code units, as JavaScript indexes strings, and the
+    response says so in offsets. If the edits can't be expressed that way html is returned.
     """
     try:
         data = request.get_json()
         
-        if not data or 'html' not in data or 'changes' not in data:
+        if not data or ('html' not in data and 'html_id' not in data) or 'changes' not in data:
             return jsonify({
                 'status': 'error',
-                'message': 'HTML content and changes are required'
+                'message': 'HTML content (or html_id) and changes are required'
             }), 400
         
-        html_content = data['html']
-        changes = data['changes']  # Array of {original: string, modified: string}
+        changes = data['changes']  # Array of {original, modified, id?, span?}, or {id: {original, modified}}
         
         logger.info(f"Applying {len(changes)} text changes server-side")
         
-        # Apply each change to the HTML content
-        modified_html = html_content
-        for change in changes:
-            if 'original' in change and 'modified' in change:
-                original_text = change['original']
-                modified_text = change['modified']
-                
-                logger.info(f"Attempting to replace: '{original_text}' -> '{modified_text}'")
-                logger.info(f"Original text length: {len(original_text)}")
-                
-                # Try 0: Handle emoji-prefixed text specifically
-                import re
-                import unicodedata
-                
-                # Check if the text starts with emojis
-                emoji_pattern = re.compile(
-                    "["
-                    "\U0001F600-\U0001F64F"  # emoticons
-                    "\U0001F300-\U0001F5FF"  # symbols & pictographs
-                    "\U0001F680-\U0001F6FF"  # transport & map symbols
-                    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                    "\U00002702-\U000027B0"  # dingbats
-                    "\U000024C2-\U0001F251"
-                    "✅✓☑️"  # checkmarks
-                    "]+", flags=re.UNICODE
-                )
-                
-                emojis_in_original = emoji_pattern.findall(original_text)
-                if emojis_in_original:
-                    logger.info(f"Found emojis in text: {emojis_in_original}")
-                    
-                    # Try multiple emoji-aware approaches
-                    text_without_emojis = emoji_pattern.sub('', original_text).strip()
-                    
-                    # Method 0a: Look for text without emojis and replace with emoji included in new text
-                    if text_without_emojis and text_without_emojis in modified_html:
-                        emoji_prefix = ''.join(emojis_in_original)
-                        full_replacement = emoji_prefix + modified_text
-                        modified_html = modified_html.replace(text_without_emojis, full_replacement, 1)
-                        logger.info(f"✅ Applied emoji-aware replacement: '{original_text[:50]}...' -> '{full_replacement[:50]}...'")
-                        continue
-                    
-                    # Method 0b: Try with normalized Unicode
-                    normalized_original = unicodedata.normalize('NFC', original_text)
-                    normalized_content = unicodedata.normalize('NFC', modified_html)
-                    
-                    if normalized_original in normalized_content:
-                        modified_html = normalized_content.replace(normalized_original, modified_text, 1)
-                        logger.info(f"✅ Applied Unicode normalized emoji replacement: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                        continue
-                    
-                    # Method 0c: Try with HTML entity decoding
-                    import html
-                    html_decoded_original = html.unescape(original_text)
-                    html_decoded_content = html.unescape(modified_html)
-                    
-                    if html_decoded_original in html_decoded_content:
-                        # Replace in decoded content and encode back
-                        decoded_modified = html_decoded_content.replace(html_decoded_original, modified_text, 1)
-                        modified_html = decoded_modified
-                        logger.info(f"✅ Applied HTML decoded emoji replacement: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                        continue
-                
-                # Try 1: Direct text replacement (fastest)
-                if original_text in modified_html:
-                    modified_html = modified_html.replace(original_text, modified_text, 1)
-                    logger.info(f"✅ Applied direct change: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                    continue
-                
-                # Try 2: BeautifulSoup - Handle HTML tags and nested content
-                try:
-                    soup = BeautifulSoup(modified_html, 'html.parser')
-                    replaced = False
-                    
-                    # Method 2a: Find all text nodes and check for matches
-                    for element in soup.find_all(string=True):
-                        element_text = str(element).strip()
-                        if original_text in element_text:
-                            new_text = element_text.replace(original_text, modified_text, 1)
-                            element.replace_with(new_text)
-                            replaced = True
-                            logger.info(f"✅ Applied text node change: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                            break
-                    
-                    if replaced:
-                        modified_html = str(soup)
-                        continue
-                    
-                    # Method 2b: Advanced nested HTML handling
-                    for element in soup.find_all():
-                        if element.get_text() and original_text in element.get_text():
-                            element_text = element.get_text()
-                            
-                            # If exact match of text content, replace the entire element content
-                            if element_text.strip() == original_text.strip():
-                                element.string = modified_text
-                                replaced = True
-                                logger.info(f"✅ Applied element replacement: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                                break
-                            
-                            # For partial matches with HTML tags, try comprehensive replacement
-                            elif original_text in element_text:
-                                # Method 1: Direct HTML string replacement
-                                element_html = str(element)
-                                if original_text in element_html:
-                                    new_element_html = element_html.replace(original_text, modified_text, 1)
-                                    try:
-                                        new_element = BeautifulSoup(new_element_html, 'html.parser')
-                                        element.replace_with(new_element)
-                                        replaced = True
-                                        logger.info(f"✅ Applied HTML string replacement: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                                        break
-                                    except:
-                                        pass
-                                
-                                # Method 2: Normalize text and match with whitespace flexibility
-                                import unicodedata
-                                import re
-                                
-                                # Normalize both texts to handle French accents and special chars
-                                normalized_original = unicodedata.normalize('NFKD', original_text)
-                                normalized_element_text = unicodedata.normalize('NFKD', element_text)
-                                
-                                # Try normalized text replacement
-                                if normalized_original in normalized_element_text:
-                                    element.clear()
-                                    element.string = modified_text
-                                    replaced = True
-                                    logger.info(f"✅ Applied normalized replacement: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                                    break
-                                
-                                # Method 3: Word-by-word matching with HTML tolerance
-                                original_words = re.findall(r'\S+', original_text)
-                                if len(original_words) > 2:  # Only for multi-word text
-                                    # Check if most words are present
-                                    words_found = sum(1 for word in original_words if word in element_text)
-                                    if words_found >= len(original_words) * 0.8:  # 80% of words match
-                                        element.clear()
-                                        element.string = modified_text
-                                        replaced = True
-                                        logger.info(f"✅ Applied word-based replacement: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                                        break
-                                
-                                # Method 4: Handle text split across multiple child elements
-                                child_texts = []
-                                for child in element.descendants:
-                                    if isinstance(child, str) and child.strip():
-                                        child_texts.append(child.strip())
-                                
-                                combined_child_text = ' '.join(child_texts)
-                                if original_text in combined_child_text:
-                                    element.clear()
-                                    element.string = modified_text
-                                    replaced = True
-                                    logger.info(f"✅ Applied child text reconstruction: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                                    break
-                                
-                                # Method 5: Flexible matching ignoring extra whitespace and punctuation
-                                clean_original = re.sub(r'\s+', ' ', original_text.strip())
-                                clean_element = re.sub(r'\s+', ' ', element_text.strip())
-                                
-                                if clean_original in clean_element:
-                                    element.clear()
-                                    element.string = modified_text
-                                    replaced = True
-                                    logger.info(f"✅ Applied clean text replacement: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                                    break
-                    
-                    if replaced:
-                        modified_html = str(soup)
-                        continue
-                
-                except Exception as e:
-                    logger.warning(f"BeautifulSoup processing failed: {e}")
-                
-                # Try 3: Flexible regex approach for HTML content with tags
-                try:
-                    import re
-                    
-                    # Method 3a: Handle text that might be split across HTML tags
-                    words = original_text.split()
-                    if len(words) > 1:
-                        # Build pattern that allows HTML tags between words
-                        pattern_parts = []
-                        for word in words:
-                            pattern_parts.append(re.escape(word))
-                        
-                        # Pattern allows tags, whitespace, and other content between words
-                        flexible_pattern = r'(?:<[^>]*>|\s)*'.join(pattern_parts)
-                        
-                        if re.search(flexible_pattern, modified_html, re.IGNORECASE | re.DOTALL):
-                            modified_html = re.sub(flexible_pattern, modified_text, modified_html, count=1, flags=re.IGNORECASE | re.DOTALL)
-                            logger.info(f"✅ Applied flexible regex: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                            continue
-                    
-                    # Method 3b: Try exact match with case insensitive
-                    escaped_original = re.escape(original_text)
-                    if re.search(escaped_original, modified_html, re.IGNORECASE):
-                        modified_html = re.sub(escaped_original, modified_text, modified_html, count=1, flags=re.IGNORECASE)
-                        logger.info(f"✅ Applied exact regex: '{original_text[:50]}...' -> '{modified_text[:50]}...'")
-                        continue
-                
-                except Exception as regex_error:
-                    logger.warning(f"Regex replacement failed: {regex_error}")
-                
-                # If all methods fail, provide enhanced debugging
-                logger.warning(f"❌ Could not find text to replace: '{original_text[:50]}...'")
-                
-                # Enhanced debugging for failed replacements
-                try:
-                    soup_debug = BeautifulSoup(modified_html, 'html.parser')
-                    
-                    # Check if any part of the text exists
-                    words = original_text.split()
-                    found_words = []
-                    for word in words:
-                        if word in modified_html:
-                            found_words.append(word)
-                    
-                    if found_words:
-                        logger.info(f"Found partial words: {found_words}")
-                    
-                    # Look for similar text patterns
-                    first_few_words = ' '.join(words[:3]) if len(words) >= 3 else original_text
-                    if first_few_words in modified_html:
-                        logger.info(f"Found beginning of text: '{first_few_words}'")
-                    
-                    # Find elements containing any of the words
-                    for element in soup_debug.find_all():
-                        element_text = element.get_text() if element else ""
-                        if any(word in element_text for word in words[:3]):
-                            logger.info(f"Similar element found: '{element_text[:100]}...'")
-                            logger.info(f"Element HTML: {str(element)[:200]}...")
-                            break
-                            
-                except Exception as debug_error:
-                    logger.warning(f"Debug search failed: {debug_error}")
+        patch_format = data.get('response_format') == 'patch'
         
-        return jsonify({
+        if 'html_id' in data:
+            return apply_changes_to_stored(data['html_id'], changes, patch_format)
+        
+        # Parse once, apply every change to the text index, splice the edits into the page once
+        engine = ChangeEngine(data['html'])
+        report = engine.apply_all(changes)
+        result = {
             'status': 'success',
-            'html': modified_html,
-            'changes_applied': len(changes)
-        })
+            'changes_applied': sum(1 for entry in report if entry['applied']),
+            'changes': report
+        }
+        
+        patches = engine.patches() if patch_format else None
+        if patches is not None:
+            result['patches'] = patches
+            result['base_length'] = utf16_length(data['html'])
+            result['offsets'] = 'utf-16'
+        else:
+            result['html'] = engine.html()
+        
+        return jsonify(result)
 
     except Exception as e:
         logger.error(f"Apply changes error: {str(e)}")
@@ -2329,28 +2567,89 @@ def apply_changes():
             'message': 'Internal server error'
         }), 500
 
+def apply_changes_to_stored(html_id, changes, patch_format=False):
+    """
+    Apply changes to a stored document and store the result under a new id
+    With patch_format the response also carries the edits as patches of the parent revision
+    """
+    # The previous revision's engine, if it is still warm, saves reading, inflating and parsing
+    # the document again; the store is only asked whether it still holds it
+    engine = warm_engines.take(html_id)
+    if engine is None or html_id not in document_store:
+        stored_html = document_store.get(html_id)
+        if stored_html is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'HTML not found'
+            }), 404
+        engine = ChangeEngine(stored_html)
+    
+    report = engine.apply_all(changes)
+    html_content = engine.html()
+    patches = engine.patches() if patch_format else None
+    
+    try:
+        revision_id = document_store.store(html_content)
+    except DocumentTooLarge as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 413
+    warm_engines.put(revision_id, engine, len(html_content))
+    
+    result = {
+        'status': 'success',
+        'html_id': revision_id,
+        'parent_id': html_id,
+        'serve_url': f'http://127.0.0.1:5000/serve-html/{revision_id}',
+        'size': len(html_content),
+        'changes_applied': sum(1 for entry in report if entry['applied']),
+        'changes': report
+    }
+    if patches is not None:
+        result['patches'] = patches
+        result['offsets'] = 'utf-16'
+    
+    return jsonify(result)
+
 @app.route('/serve-html/<path:html_id>', methods=['GET'])
 def serve_html(html_id):
     """
     Serve processed HTML directly with proper headers to avoid CORS issues
     """
     try:
-        # In a real implementation, you'd store the HTML in a database or cache
-        # For now, we'll use a simple in-memory storage
-        if not hasattr(serve_html, 'html_cache'):
-            serve_html.html_cache = {}
-        
-        if html_id not in serve_html.html_cache:
+        # Streamed from the store as stored (gzip) when the client takes it: a
+        # persistent backend never loads the whole page and nothing is re-encoded
+        opened = document_store.open(html_id, gzip_ok=request.accept_encodings['gzip'] > 0)
+        if opened is None:
             return "HTML not found", 404
         
-        html_content = serve_html.html_cache[html_id]
-        
-        response = Response(html_content, mimetype='text/html')
+        body, size, encoding = opened
+        response = Response(wrap_file(request.environ, body), mimetype='text/html', direct_passthrough=True)
+        response.content_length = size
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        if is_content_id(html_id):
+            # The id is the content's hash, so what it serves never changes: a strong
+            # ETag per encoding, and clients may keep the page for good
+            response.set_etag(f'{html_id}-{encoding}' if encoding else html_id)
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
         response.headers['X-Frame-Options'] = 'ALLOWALL'
         
+        # 304 when If-None-Match matches, 206 for a Range (the stored file is seeked, not
+        # read up to the start); 304s and HEAD responses never read the body
+        try:
+            response.make_conditional(request, accept_ranges=True, complete_length=size)
+        except RequestedRangeNotSatisfiable as e:
+            response.close()
+            return e.get_response()
+        
         return response
     
     except Exception as e:
@@ -2361,6 +2660,12 @@ def serve_html(html_id):
 def store_html():
     """
     Store HTML content and return an ID for serving
+    
+    The id is the content's SHA-256: storing the same HTML again returns the same id
+    and adds a reference instead of a copy. Anyone can compute an id, so the reference
+    comes with a release_token: DELETE /store-html/<id> with that token (X-Release-Token
+    header or release_token in the body) drops it, and nothing else can.
+    Optional: ttl (seconds to keep it, 0 = until evicted) and pin (never evict or expire)
     """
     try:
         data = request.get_json()
@@ -2373,19 +2678,22 @@ def store_html():
         
         html_content = data['html']
         
-        # Generate a unique ID
-        import uuid
-        html_id = str(uuid.uuid4())
-        
-        # Store in cache
-        if not hasattr(serve_html, 'html_cache'):
-            serve_html.html_cache = {}
-        
-        serve_html.html_cache[html_id] = html_content
+        # Store in the bounded document store, under the content's hash
+        try:
+            ttl = data.get('ttl') if isinstance(data.get('ttl'), (int, float)) else None
+            release_token = new_release_token()
+            html_id = document_store.store(html_content, ttl=ttl, pinned=bool(data.get('pin')),
+                                           owner=owner_key(release_token))
+        except DocumentTooLarge as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 413
         
         return jsonify({
             'status': 'success',
             'html_id': html_id,
+            'release_token': release_token,
             'serve_url': f'http://127.0.0.1:5000/serve-html/{html_id}'
         })
     
@@ -2396,6 +2704,28 @@ def store_html():
             'message': 'Internal server error'
         }), 500
 
+@app.route('/store-html/<path:html_id>', methods=['DELETE'])
+def release_html(html_id):
+    """
+    Drop the reference a /store-html call took, given its release_token; the document
+    is removed when no references are left
+    """
+    release_token = request.headers.get('X-Release-Token') or (request.get_json(silent=True) or {}).get('release_token')
+    if not isinstance(release_token, str) or not release_token:
+        return jsonify({
+            'status': 'error',
+            'message': 'release_token is required'
+        }), 401
+    
+    # A wrong token is answered like a missing document, so ids can't be probed with it
+    if not document_store.release(html_id, owner_key(release_token)):
+        return jsonify({
+            'status': 'error',
+            'message': 'HTML not found'
+        }), 404
+    
+    return jsonify({'status': 'success', 'html_id': html_id})
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
@@ -2908,6 +3238,23 @@ def debug_wordpress_changes():
             'details': str(e)
         }), 500
 
+def _suggestion_events(stream, success_payload):
+    """
+    SSE body for streamed suggestions: a 'suggestion' event per suggestion, then a
+    'done' event carrying the same JSON the non-streaming endpoint returns (or 'error')
+    """
+    count = 0
+    for kind, value in stream:
+        if kind == 'suggestion':
+            yield sse_event('suggestion', {'index': count, 'suggestion': value})
+            count += 1
+        elif 'error' in value:
+            yield sse_event('error', {'status': 'error', 'message': value['error']})
+        elif not value.get('suggestions'):
+            yield sse_event('error', {'status': 'error', 'message': 'No suggestions generated'})
+        else:
+            yield sse_event('done', success_payload(value['suggestions']))
+
 @app.route('/generate-more-suggestions', methods=['POST'])
 def generate_more_suggestions():
     """Generate more AI-powered suggestions for specific content"""
@@ -2931,16 +3278,36 @@ def generate_more_suggestions():
         content = data['content']
         content_type = data['content_type']
         original_url = data.get('original_url', '')
-        
-        # Initialize Cerebras AI
-        cerebras_ai = CerebrasAI()
-        
-        # Generate suggestions using the existing method
-        result = cerebras_ai.generate_content_suggestions(
-            original_content=content,
-            content_type=content_type,
-            context=f"Original URL: {original_url}" if original_url else ""
-        )
+        context = f"Original URL: {original_url}" if original_url else ""
+        # "More" means new suggestions: the cached ones are what /scrape already showed,
+        # so they are read only on "cache": true, and nothing here replaces them
+        use_cache = data.get('cache') is True
+        
+        # "stream": true (or Accept: text/event-stream) sends each suggestion as it is generated
+        if wants_event_stream(request, data):
+            events = _suggestion_events(
+                cerebras_ai.stream_content_suggestions(content, content_type, context=context, use_cache=use_cache,
+                                                        store=False, interactive=True),
+                lambda suggestions: {'status': 'success', 'suggestions': suggestions}
+            )
+            return Response(stream_with_context(events), mimetype='text/event-stream', headers=SSE_HEADERS)
+        
+        # Pools are per content, type and context. A client-chosen session id names one editor;
+        # without one, requests for the same stored page (or, lacking that, the same content)
+        # share a session, so each is served suggestions none of the others got
+        session_id = data.get('session_id') or request.headers.get('X-Session-Id') or data.get('html_id')
+        if suggestion_pool.enabled and not use_cache:
+            # Served from the prefetched pool, skipping suggestions this session already has
+            result = suggestion_pool.take(content, content_type, context=context, session_id=session_id)
+        else:
+            result = cerebras_ai.generate_content_suggestions(
+                original_content=content,
+                content_type=content_type,
+                context=context,
+                use_cache=use_cache,
+                store=False,
+                interactive=True
+            )
         
         if 'error' in result:
             return jsonify({
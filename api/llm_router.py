@@ -0,0 +1,308 @@
+"""
+Multi-provider LLM Routing
+==========================
+
+Chat completion requests go to an ordered list of OpenAI-compatible
+providers instead of one hard-coded endpoint:
+
+- Providers are ranked by recently observed latency (EWMA of time to the
+  response headers), penalized by their recent error rate. Providers that
+  have not been measured yet keep their configured order behind the measured
+  healthy ones, so a backup only takes traffic once it has proven faster.
+- A timeout, connection error, 429, 5xx or a provider-side 401/403/404 moves
+  the request on to the next provider. After FAILURE_THRESHOLD consecutive
+  failures a provider is tried only after all the others for
+  LLM_PROVIDER_COOLDOWN seconds.
+- Interactive requests can be hedged: if the fastest provider has not
+  answered within the hedge delay, the same request goes to the second
+  fastest and whichever succeeds first is used. Given the app's
+  concurrency controller, the hedge takes a slot and is charged to the
+  token budget like any request; when no slot is free right away it is
+  not sent.
+
+With LLM_PROVIDERS unset the router holds only the app's default provider and
+behaves like a direct call to it. Each response carries the provider that
+produced it as response.llm_provider, so callers can tell whose output
+(and which model's) they got. ChatReply turns a response into a parsed,
+connection-free value that can be shared between threads.
+
+Environment Variables:
+- LLM_PROVIDERS: JSON list of providers, e.g.
+  [{"name": "cerebras", "url": "https://api.cerebras.ai/v1/chat/completions",
+    "model": "llama3.1-8b", "api_key_env": "CEREBRAS_API_KEY"}, ...]
+  ("api_key" may be given instead of "api_key_env")
+- LLM_HEDGE: set to 'true' to hedge interactive requests on the two fastest providers
+- LLM_HEDGE_DELAY: seconds before the hedge request is sent (default 0 = 1.5x the
+  fastest provider's recent latency)
+- LLM_PROVIDER_COOLDOWN: seconds a failing provider is tried last (default 30)
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+LLM_PROVIDERS = os.environ.get('LLM_PROVIDERS', '')
+LLM_HEDGE = os.environ.get('LLM_HEDGE', 'false').lower() == 'true'
+LLM_HEDGE_DELAY = float(os.environ.get('LLM_HEDGE_DELAY', '0'))
+LLM_PROVIDER_COOLDOWN = float(os.environ.get('LLM_PROVIDER_COOLDOWN', '30'))
+
+FAILURE_THRESHOLD = 3
+# Weight of the newest observation in the latency and error-rate averages
+EWMA_ALPHA = 0.3
+# Hedge delay when the fastest provider has no latency history yet
+DEFAULT_HEDGE_DELAY = 1.0
+# Statuses that say "this provider can't serve it right now", not "the request is bad"
+FAILOVER_STATUSES = {401, 403, 404, 408, 429}
+
+
+class LLMProvider:
+    """One OpenAI-compatible chat completions endpoint and its recent health"""
+
+    def __init__(self, name, url, model, api_key=''):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.skip_until = 0.0
+        self.counters = {'requests': 0, 'failures': 0, 'hedges_sent': 0, 'hedges_won': 0, 'hedges_throttled': 0}
+
+    def headers(self):
+        return {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+
+    def score(self):
+        """Lower is better; None when the provider has not been measured"""
+        if self.latency is None:
+            return None
+        return self.latency * (1 + 4 * self.error_rate)
+
+
+def _is_failure(response):
+    return response.status_code in FAILOVER_STATUSES or response.status_code >= 500
+
+
+class ChatReply:
+    """
+    A non-streamed chat completion response read to the end and parsed once. Unlike the
+    requests.Response it is built from it holds no connection, so one reply can be
+    handed to several threads; treat json() as read-only.
+    """
+
+    __slots__ = ('status_code', 'text', 'llm_provider', '_data')
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.text = response.text
+        self.llm_provider = getattr(response, 'llm_provider', None)
+        try:
+            self._data = response.json()
+        except ValueError:
+            self._data = None
+        response.close()
+
+    def json(self):
+        if self._data is None:
+            raise ValueError(f'Response is not JSON: {self.text[:100]!r}')
+        return self._data
+
+
+class LLMRouter:
+    """Route chat completion requests across providers by latency and health"""
+
+    def __init__(self, providers, hedge=LLM_HEDGE, hedge_delay=LLM_HEDGE_DELAY, cooldown=LLM_PROVIDER_COOLDOWN,
+                 throttle=None):
+        if not providers:
+            raise ValueError('LLMRouter needs at least one provider')
+        self.providers = providers
+        # AdaptiveConcurrencyController the hedge requests go through (callers throttle their own)
+        self.throttle = throttle
+        self.hedge = hedge and len(providers) > 1
+        self.hedge_delay = hedge_delay
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='llm-hedge') if self.hedge else None
+
+    @classmethod
+    def from_env(cls, default_provider, config=LLM_PROVIDERS, **kwargs):
+        """Providers from LLM_PROVIDERS, or just default_provider when it is unset or invalid"""
+        providers = []
+        if config:
+            try:
+                for entry in json.loads(config):
+                    api_key = entry.get('api_key') or os.environ.get(entry.get('api_key_env', ''), '')
+                    providers.append(LLMProvider(entry.get('name') or entry['url'], entry['url'],
+                                                 entry.get('model', default_provider.model), api_key))
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                logger.error(f"Invalid LLM_PROVIDERS, using the default provider only: {e}")
+                providers = []
+        return cls(providers or [default_provider], **kwargs)
+
+    def ranked(self):
+        """Providers in the order they should be tried"""
+        now = time.monotonic()
+        with self._lock:
+            order = {id(provider): index for index, provider in enumerate(self.providers)}
+
+            def rank(provider):
+                score = provider.score()
+                return (provider.skip_until > now, score is None, score or 0.0, order[id(provider)])
+
+            return sorted(self.providers, key=rank)
+
+    def _observe(self, provider, elapsed, failed):
+        with self._lock:
+            provider.counters['requests'] += 1
+            provider.error_rate = (1 - EWMA_ALPHA) * provider.error_rate + EWMA_ALPHA * failed
+            if failed:
+                provider.counters['failures'] += 1
+                provider.consecutive_failures += 1
+                if provider.consecutive_failures >= FAILURE_THRESHOLD:
+                    provider.skip_until = time.monotonic() + self.cooldown
+                    logger.warning(f"LLM provider {provider.name} moved to the back for {self.cooldown:g}s after "
+                                   f"{provider.consecutive_failures} failures")
+            else:
+                provider.consecutive_failures = 0
+                provider.skip_until = 0.0
+                provider.latency = elapsed if provider.latency is None else (
+                    (1 - EWMA_ALPHA) * provider.latency + EWMA_ALPHA * elapsed)
+
+    def _send(self, provider, payload, timeout, stream):
+        """One attempt against one provider; returns the response or raises"""
+        started = time.perf_counter()
+        try:
+            response = requests.post(provider.url, json={**payload, 'model': provider.model},
+                                     headers=provider.headers(), stream=stream, timeout=timeout)
+        except requests.exceptions.RequestException:
+            self._observe(provider, time.perf_counter() - started, True)
+            raise
+        self._observe(provider, time.perf_counter() - started, _is_failure(response))
+        response.llm_provider = provider
+        return response
+
+    def post(self, payload, timeout, stream=False, hedge=False, estimated_tokens=0):
+        """
+        Send a chat completion payload, failing over down the ranked providers
+        The model in payload is replaced by each provider's own model. Returns the
+        first successful response, else the last failed one; raises the last
+        exception when no provider answered at all. estimated_tokens is what a
+        hedge request is charged to the throttle's budget.
+        """
+        providers = self.ranked()
+        last_response, last_error = None, None
+        if hedge and self.hedge and len(providers) > 1:
+            response, last_response, last_error, providers = self._hedged(providers, payload, timeout, stream,
+                                                                          estimated_tokens)
+            if response is not None:
+                return response
+
+        for provider in providers:
+            try:
+                response = self._send(provider, payload, timeout, stream)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"LLM provider {provider.name} failed: {e}")
+                last_error = e
+                continue
+            if not _is_failure(response):
+                return response
+            logger.warning(f"LLM provider {provider.name} returned HTTP {response.status_code}")
+            if last_response is not None:
+                last_response.close()
+            last_response = response
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+    def _send_hedge(self, provider, payload, timeout, stream, estimated_tokens):
+        """The hedge request, in the throttle slot taken for it before it was submitted"""
+        if self.throttle is None:
+            return self._send(provider, payload, timeout, stream)
+        with self.throttle.held(estimated_tokens) as outcome:
+            response = self._send(provider, payload, timeout, stream)
+            outcome.observe(response)
+        return response
+
+    def _hedged(self, providers, payload, timeout, stream, estimated_tokens):
+        """
+        Race the two fastest providers, the second starting after the hedge delay
+        Returns (successful response or None, last failed response, last exception,
+        providers not tried yet)
+        """
+        first, second = providers[0], providers[1]
+        delay = self.hedge_delay or (1.5 * first.latency if first.latency is not None else DEFAULT_HEDGE_DELAY)
+
+        futures = {self._executor.submit(self._send, first, payload, timeout, stream): first}
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            # A second request counts against the concurrency limit and token budget like any
+            # other; it is skipped rather than queued when the throttle has no room for it now
+            if self.throttle is None or self.throttle.acquire(estimated_tokens, block=False):
+                with self._lock:
+                    second.counters['hedges_sent'] += 1
+                futures[self._executor.submit(self._send_hedge, second, payload, timeout, stream,
+                                              estimated_tokens)] = second
+            else:
+                with self._lock:
+                    second.counters['hedges_throttled'] += 1
+
+        winner, failed_response, error = None, None, None
+        pending = set(futures)
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f"LLM provider {futures[future].name} failed: {e}")
+                    error = e
+                    continue
+                if winner is None and not _is_failure(response):
+                    winner = response
+                    if futures[future] is second:
+                        with self._lock:
+                            second.counters['hedges_won'] += 1
+                elif winner is None:
+                    if failed_response is not None:
+                        failed_response.close()
+                    failed_response = response
+                else:
+                    response.close()
+
+        # The slower request can't be cancelled; close its response whenever it arrives
+        for future in pending:
+            future.add_done_callback(lambda f: f.exception() is None and f.result().close())
+        if winner is not None:
+            if failed_response is not None:
+                failed_response.close()
+            return winner, None, None, []
+        return None, failed_response, error, [provider for provider in providers if provider not in futures.values()]
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'hedging': self.hedge,
+                'providers': [
+                    {
+                        'name': provider.name,
+                        'url': provider.url,
+                        'model': provider.model,
+                        'latency_ms': round(provider.latency * 1000, 1) if provider.latency is not None else None,
+                        'error_rate': round(provider.error_rate, 3),
+                        'cooldown_seconds': round(max(0.0, provider.skip_until - now), 1),
+                        **provider.counters
+                    }
+                    for provider in self.providers
+                ]
+            }
@@ -1,4 +1,6 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
 from flask_cors import CORS
 import json
 import requests
@@ -6,8 +8,26 @@ from bs4 import BeautifulSoup
 import logging
 import os
 import re
+import sys
+import time
 from datetime import datetime, timezone
 
+# Make sibling modules importable when loaded as a serverless function
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from html_stream import extract_page_summary
+from ai_batching import AI_BATCH_PROMPTS, batch_max_tokens, build_batch_prompt, chunk_items, parse_batch_reply
+from content_dedupe import group_duplicates
+from change_engine import ChangeEngine, WarmEngines, utf16_length
+from document_store import DocumentTooLarge, create_document_store, is_content_id, new_release_token, owner_key
+from suggestion_cache import SuggestionCache
+from suggestion_pool import SuggestionPool
+from ai_streaming import SSE_HEADERS, LineAssembler, iter_chat_deltas, sse_event, wants_event_stream
+from ai_throttle import AI_REQUEST_TIMEOUT, AdaptiveConcurrencyController, estimate_tokens
+from single_flight import SingleFlight, request_key
+from llm_router import ChatReply, LLMProvider, LLMRouter
+from ai_metrics import AIMetrics, set_call_context
+
 app = Flask(__name__)
 CORS(app, origins=['*'], allow_headers=['*'], methods=['*'])
 
@@ -15,6 +35,13 @@ CORS(app, origins=['*'], allow_headers=['*'], methods=['*'])
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Attribute AI calls to the endpoint and user of the request that makes them
+@app.before_request
+def set_ai_metrics_context():
+    body = request.get_json(silent=True) if request.is_json else None
+    user = request.headers.get('X-User-Id') or (body.get('user_id') if isinstance(body, dict) else None)
+    set_call_context(request.url_rule.rule if request.url_rule else request.path, user)
+
 # Cerebras AI configuration
 CEREBRAS_API_KEY = os.environ.get('CEREBRAS_API_KEY', 'csk-rkhkxny26c6rvj32cfd4wtwf8n3w8drncpx9j88dkk66fre6')
 CEREBRAS_API_URL = 'https://api.cerebras.ai/v1/chat/completions'
@@ -251,43 +278,114 @@ class FirebaseAuth:
 
 # Cerebras AI Integration Class
 class CerebrasAI:
+    # Condensed per-type requirements for batched prompts
+    BATCH_GUIDELINES = {
+        'headline': 'compelling and click-worthy, relevant keywords, 50-60 characters, urgency or curiosity, same tone as the original',
+        'subheadline': 'supports the main headline, adds value and clarity, 80-120 characters, benefits or features, consistent tone',
+        'description': 'clear value proposition, social proof, 120-160 characters, action-oriented, builds credibility and trust',
+        'cta': 'urgent and action-driven, clear and specific, power words, 2-6 words, benefit-focused',
+        'default': 'improves engagement and conversion'
+    }
+    
+    MODEL = "llama3.1-8b"
+    TEMPERATURE = 0.8
+    
+    # Placeholders _parse_suggestions returns when nothing usable came back
+    PLACEHOLDER_SUGGESTIONS = (["No suggestions generated"], ["Error parsing suggestions"])
+    
     def __init__(self):
         self.api_key = CEREBRAS_API_KEY
         self.api_url = CEREBRAS_API_URL
     
-    def generate_content_suggestions(self, original_content, content_type, context=""):
-        """Generate 10 optimized suggestions for any content type using Cerebras AI"""
+    def _chat_payload(self, prompt, max_tokens=1000, stream=False):
+        return {
+            "model": self.MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are an expert SEO copywriter and digital marketing specialist. Your job is to create compelling, SEO-optimized content that increases click-through rates and conversions. IMPORTANT: Always respond in the same language as the original content."
+                },
+                {
+                    "role": "user", 
+                    "content": prompt
+                }
+            ],
+            "max_tokens": max_tokens,
+            "temperature": self.TEMPERATURE,
+            "stream": stream
+        }
+    
+    def _post_chat(self, prompt, max_tokens=1000, content_type=None, interactive=False, timeout=AI_REQUEST_TIMEOUT):
+        """
+        Send one chat completion request through the throttle (retries 429/5xx)
+        Identical requests already in flight are not sent again; callers share the reply,
+        a ChatReply (parsed once, no live connection), and each waits at most its own timeout
+        The router picks the provider; interactive requests may be hedged on a second one
+        """
+        payload = self._chat_payload(prompt, max_tokens)
+        tokens = estimate_tokens(prompt, max_tokens)
+        
+        def send():
+            with ai_metrics.track(content_type, prompt) as call:
+                response = ai_throttle.request(
+                    lambda: llm_router.post(payload, timeout, hedge=interactive, estimated_tokens=tokens),
+                    tokens
+                )
+                call.observe(response)
+            return ChatReply(response)
+        
+        return single_flight.do(request_key(payload), send, timeout=sum(timeout),
+                                on_shared=lambda: ai_metrics.record_coalesced(content_type))
+    
+    def _cache_key(self, content, content_type, model=None):
+        # model: the one that wrote the suggestions, when the router fell back from MODEL to another
+        return suggestion_cache.key(content, content_type, self._detect_language(content), model or self.MODEL,
+                                    self.TEMPERATURE)
+    
+    @staticmethod
+    def _model_of(response):
+        """Model of the provider the router got the response from"""
+        provider = getattr(response, 'llm_provider', None)
+        return provider.model if provider is not None else None
+    
+    def cached_suggestions(self, original_content, content_type):
+        """What the suggestion cache holds for the content (what /scrape showed), without counting a lookup"""
+        return suggestion_cache.get(self._cache_key(original_content, content_type), record=False)
+    
+    def generate_content_suggestions(self, original_content, content_type, context="", use_cache=True, store=True,
+                                     interactive=False):
+        """
+        Generate 10 optimized suggestions for any content type using Cerebras AI
+        store=False leaves the cache as it is (for "more" requests, which must not replace
+        what /scrape showed); interactive=True, for an editor waiting on the answer, lets
+        the router hedge the request
+        """
+        if use_cache:
+            cached = suggestion_cache.get(self._cache_key(original_content, content_type))
+            if cached is not None:
+                ai_metrics.record_cache_hit(content_type)
+                return {'success': True, 'suggestions': cached}
+        else:
+            suggestion_cache.note_bypass()
+        
+        return self.generate_fresh_suggestions(original_content, content_type, context, store=store,
+                                               interactive=interactive)
+    
+    def generate_fresh_suggestions(self, original_content, content_type, context="", store=True, interactive=False):
+        """Ask the AI without consulting the cache; a successful result is cached unless store is False"""
         try:
             prompt = self._create_content_optimization_prompt(original_content, content_type, context)
             
-            headers = {
-                'Authorization': f'Bearer {self.api_key}',
-                'Content-Type': 'application/json'
-            }
-            
-            payload = {
-                "model": "llama3.1-8b",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are an expert SEO copywriter and digital marketing specialist. Your job is to create compelling, SEO-optimized content that increases click-through rates and conversions. IMPORTANT: Always respond in the same language as the original content."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                "max_tokens": 1000,
-                "temperature": 0.8,
-                "stream": False
-            }
-            
-            response = requests.post(self.api_url, json=payload, headers=headers)
+            started = time.perf_counter()
+            response = self._post_chat(prompt, content_type=content_type, interactive=interactive)
             data = response.json()
             
             if response.status_code == 200:
                 ai_response = data['choices'][0]['message']['content']
                 suggestions = self._parse_suggestions(ai_response)
+                if store and suggestions not in self.PLACEHOLDER_SUGGESTIONS:
+                    key = self._cache_key(original_content, content_type, self._model_of(response))
+                    suggestion_cache.put(key, suggestions, time.perf_counter() - started)
                 return {'success': True, 'suggestions': suggestions}
             else:
                 logger.error(f"Cerebras AI error: {response.status_code} - {response.text}")
@@ -297,21 +395,136 @@ class CerebrasAI:
             logger.error(f"Cerebras AI integration error: {str(e)}")
             return {'error': 'Failed to generate AI suggestions'}
     
-    def _create_content_optimization_prompt(self, content, content_type, context):
-        """Create an optimized prompt based on content type"""
+    def stream_content_suggestions(self, original_content, content_type, context="", use_cache=True, store=True,
+                                   interactive=False):
+        """
+        Generate suggestions from the provider's token stream
+        Yields ('suggestion', text) as soon as each numbered line is complete, then
+        one ('done', result) where result is shaped like generate_content_suggestions
+        """
+        if use_cache:
+            cached = suggestion_cache.get(self._cache_key(original_content, content_type))
+            if cached is not None:
+                ai_metrics.record_cache_hit(content_type)
+                for suggestion in cached:
+                    yield 'suggestion', suggestion
+                yield 'done', {'success': True, 'suggestions': cached}
+                return
+        else:
+            suggestion_cache.note_bypass()
         
-        def detect_language(text):
-            # Simple language detection
-            french_words = ['le', 'la', 'les', 'de', 'des', 'du', 'et', 'pour', 'avec', 'sur', 'dans']
-            english_words = ['the', 'and', 'for', 'with', 'on', 'in', 'to', 'of', 'a', 'an']
+        try:
+            prompt = self._create_content_optimization_prompt(original_content, content_type, context)
             
-            text_lower = text.lower()
-            french_count = sum(1 for word in french_words if word in text_lower)
-            english_count = sum(1 for word in english_words if word in text_lower)
+            started = time.perf_counter()
+            tokens = estimate_tokens(prompt, 1000)
+            with ai_metrics.track(content_type, prompt) as call, ai_throttle.slot(tokens) as outcome:
+                response = llm_router.post(self._chat_payload(prompt, stream=True), AI_REQUEST_TIMEOUT,
+                                           stream=True, hedge=interactive, estimated_tokens=tokens)
+                outcome.observe(response)
+                call.observe(response)
+                try:
+                    if response.status_code != 200:
+                        logger.error(f"Cerebras AI error: {response.status_code} - {response.text}")
+                        yield 'done', {'error': f'AI service error: {response.status_code}'}
+                        return
+                
+                    fragments = []
+                    usage = {}
+                    assembler = LineAssembler()
+                    emitted = 0
+                    for fragment in iter_chat_deltas(response, usage):
+                        fragments.append(fragment)
+                        for line in assembler.feed(fragment):
+                            suggestion = self._parse_suggestion_line(line)
+                            if suggestion and emitted < 10:
+                                emitted += 1
+                                yield 'suggestion', suggestion
+                    suggestion = self._parse_suggestion_line(assembler.flush())
+                    if suggestion and emitted < 10:
+                        yield 'suggestion', suggestion
+                    call.completion_text = ''.join(fragments)
+                    call.set_usage(usage)
+                finally:
+                    response.close()
             
-            return "French" if french_count > english_count else "English"
+            # Same parse as the non-streaming path, so the final payload matches it exactly
+            suggestions = self._parse_suggestions(''.join(fragments))
+            if store and suggestions not in self.PLACEHOLDER_SUGGESTIONS:
+                key = self._cache_key(original_content, content_type, self._model_of(response))
+                suggestion_cache.put(key, suggestions, time.perf_counter() - started)
+            yield 'done', {'success': True, 'suggestions': suggestions}
+            
+        except Exception as e:
+            logger.error(f"Cerebras AI streaming error: {str(e)}")
+            yield 'done', {'error': 'Failed to generate AI suggestions'}
+    
+    def generate_batch_suggestions(self, items, context="", use_cache=True):
+        """
+        Generate suggestions for several elements with one request per batch
+        items: list of (content, content_type) tuples
+        Returns one result per item; items a batch reply does not cover are retried one by one
+        """
+        results = [None] * len(items)
+        pending = []
+        for index, (content, content_type) in enumerate(items):
+            cached = suggestion_cache.get(self._cache_key(content, content_type)) if use_cache else None
+            if cached is not None:
+                ai_metrics.record_cache_hit(content_type)
+                results[index] = {'success': True, 'suggestions': cached}
+            else:
+                pending.append(index)
+        if not use_cache:
+            suggestion_cache.note_bypass()
+        
+        for chunk in chunk_items(pending):
+            batch = [
+                {'content': items[index][0], 'content_type': items[index][1], 'language': self._detect_language(items[index][0])}
+                for index in chunk
+            ]
+            suggestions = None
+            model = None
+            try:
+                prompt = build_batch_prompt(batch, context, self.BATCH_GUIDELINES)
+                started = time.perf_counter()
+                response = self._post_chat(prompt, max_tokens=batch_max_tokens(len(batch)), content_type='batch')
+                elapsed = time.perf_counter() - started
+                model = self._model_of(response)
+                if response.status_code == 200:
+                    suggestions = parse_batch_reply(response.json()['choices'][0]['message']['content'], len(batch))
+                    if suggestions is None:
+                        logger.warning(f"Malformed batch reply for {len(batch)} elements, falling back to per-element prompts")
+                else:
+                    logger.error(f"Cerebras AI batch error: {response.status_code} - {response.text}")
+            except Exception as e:
+                logger.error(f"Cerebras AI batch integration error: {str(e)}")
+            
+            for index, item_suggestions in zip(chunk, suggestions or [None] * len(batch)):
+                if item_suggestions:
+                    results[index] = {'success': True, 'suggestions': item_suggestions}
+                    suggestion_cache.put(self._cache_key(*items[index], model), item_suggestions,
+                                         elapsed / len(batch))
+        
+        for index, (content, content_type) in enumerate(items):
+            if results[index] is None:
+                results[index] = self.generate_fresh_suggestions(content, content_type, context)
+        return results
+    
+    def _detect_language(self, text):
+        # Simple language detection
+        french_words = ['le', 'la', 'les', 'de', 'des', 'du', 'et', 'pour', 'avec', 'sur', 'dans']
+        english_words = ['the', 'and', 'for', 'with', 'on', 'in', 'to', 'of', 'a', 'an']
         
-        detected_language = detect_language(content)
+        text_lower = text.lower()
+        french_count = sum(1 for word in french_words if word in text_lower)
+        english_count = sum(1 for word in english_words if word in text_lower)
+        
+        return "French" if french_count > english_count else "English"
+    
+    def _create_content_optimization_prompt(self, content, content_type, context):
+        """Create an optimized prompt based on content type"""
+        
+        detected_language = self._detect_language(content)
         
         if detected_language == "French":
             language_instruction = "IMPORTANT: Répondez UNIQUEMENT en français. Utilisez un style français naturel."
@@ -384,6 +597,20 @@ Original content: "{content}"
 Generate 10 optimized variations of this {content_type} that improve engagement and conversion.
 Format as a numbered list (1-10)."""
     
+    def _parse_suggestion_line(self, line):
+        """Suggestion text from one line of the AI response, or None"""
+        line = line.strip()
+        if not line:
+            return None
+        
+        # Remove numbered list formatting
+        if re.match(r'^\d+\.?\s*', line):
+            suggestion = re.sub(r'^\d+\.?\s*', '', line).strip()
+            if suggestion and len(suggestion) > 5:
+                # Remove quotes if present
+                return suggestion.strip('"').strip("'")
+        return None
+    
     def _parse_suggestions(self, ai_response):
         """Parse AI response to extract clean suggestions list"""
         try:
@@ -391,17 +618,9 @@ Format as a numbered list (1-10)."""
             suggestions = []
             
             for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                # Remove numbered list formatting
-                if re.match(r'^\d+\.?\s*', line):
-                    suggestion = re.sub(r'^\d+\.?\s*', '', line).strip()
-                    if suggestion and len(suggestion) > 5:
-                        # Remove quotes if present
-                        suggestion = suggestion.strip('"').strip("'")
-                        suggestions.append(suggestion)
+                suggestion = self._parse_suggestion_line(line)
+                if suggestion:
+                    suggestions.append(suggestion)
                 
                 if len(suggestions) >= 10:
                     break
@@ -412,13 +631,19 @@ Format as a numbered list (1-10)."""
             logger.error(f"Error parsing AI suggestions: {str(e)}")
             return ["Error parsing suggestions"]
 
-# Initialize AI and Firebase
+# Initialize AI, its suggestion cache and Firebase
+suggestion_cache = SuggestionCache(namespace='minimal')
+ai_throttle = AdaptiveConcurrencyController()
+single_flight = SingleFlight()
+llm_router = LLMRouter.from_env(LLMProvider('cerebras', CEREBRAS_API_URL, CerebrasAI.MODEL, CEREBRAS_API_KEY),
+                               throttle=ai_throttle)
+ai_metrics = AIMetrics()
 cerebras_ai = CerebrasAI()
+suggestion_pool = SuggestionPool(cerebras_ai)
+warm_engines = WarmEngines()
+document_store = create_document_store()
 firebase_auth = FirebaseAuth()
 
-# Global storage for HTML content (in production, use Redis or database)
-html_storage = {}
-
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({
@@ -436,6 +661,10 @@ def home():
             'store-html': '/store-html',
             'serve-html': '/serve-html/<html_id>',
             'generate-more-suggestions': '/generate-more-suggestions',
+            'suggestion-cache': '/suggestion-cache',
+            'ai-throttle': '/ai/throttle',
+            'ai-metrics': '/ai/metrics',
+            'document-store': '/document-store',
             'register': '/auth/register',
             'login': '/auth/login',
             'change_password': '/auth/change-password',
@@ -463,6 +692,46 @@ def health():
         'message': 'API is running with CORS support'
     })
 
+@app.route('/suggestion-cache', methods=['GET'])
+def suggestion_cache_stats():
+    """AI suggestion cache hit rate, the provider time it has saved and the prefetched suggestion pools"""
+    return jsonify({
+        'status': 'success',
+        'data': {**suggestion_cache.stats(), 'pool': suggestion_pool.stats()}
+    })
+
+@app.route('/document-store', methods=['GET'])
+def document_store_stats():
+    """Size, count and evictions of stored HTML documents and the parsed ones kept warm for edits"""
+    return jsonify({
+        'status': 'success',
+        'data': {**document_store.stats(), 'warm_engines': warm_engines.stats()}
+    })
+
+@app.route('/document-store/compact', methods=['POST'])
+def compact_document_store():
+    """Remove expired and over-cap documents now and reclaim the space they used"""
+    return jsonify({
+        'status': 'success',
+        'data': {**document_store.compact(), **document_store.stats()}
+    })
+
+@app.route('/ai/throttle', methods=['GET'])
+def ai_throttle_status():
+    """Adaptive AI concurrency, throttle events, coalesced duplicate requests and provider routing"""
+    return jsonify({
+        'status': 'success',
+        'data': {**ai_throttle.status(), 'coalescing': single_flight.status(), 'routing': llm_router.status()}
+    })
+
+@app.route('/ai/metrics', methods=['GET'])
+def ai_metrics_report():
+    """Tokens, latency, errors and cache hits of AI calls per endpoint, content type and user"""
+    return jsonify({
+        'status': 'success',
+        'data': ai_metrics.snapshot()
+    })
+
 @app.route('/test', methods=['POST'])
 def test():
     try:
@@ -515,65 +784,23 @@ def scrape():
         
         for url in urls:
             try:
-                # Make request
+                # Stream the page through the tree-free extractor
                 headers = {
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                 }
-                response = requests.get(url, headers=headers, timeout=10)
+                response = requests.get(url, headers=headers, timeout=10, stream=True)
                 response.raise_for_status()
                 
-                # Parse HTML
-                soup = BeautifulSoup(response.content, 'html.parser')
-                
-                # Extract data using your original logic
-                title = soup.find('title')
-                title_text = title.text.strip() if title else ""
-                
-                # Extract headlines (h1 tags)
-                h1_tags = soup.find_all('h1')
-                headlines = [h1.get_text().strip() for h1 in h1_tags[:3] if h1.get_text().strip()]
-                
-                # Extract subheadlines (h2, h3 tags)
-                h2_tags = soup.find_all('h2')
-                h3_tags = soup.find_all('h3')
-                subheadlines = []
-                for h in h2_tags[:3]:
-                    text = h.get_text().strip()
-                    if text and len(text) > 5:
-                        subheadlines.append(text)
-                for h in h3_tags[:2]:
-                    text = h.get_text().strip()
-                    if text and len(text) > 5:
-                        subheadlines.append(text)
-                
-                # Extract meta description
-                meta_desc = soup.find('meta', attrs={'name': 'description'})
-                description = meta_desc.get('content', '').strip() if meta_desc else ''
-                
-                # Extract some paragraph text
-                paragraphs = soup.find_all('p')
-                descriptions = [description] if description else []
-                for p in paragraphs[:3]:
-                    text = p.get_text().strip()
-                    if text and len(text) > 20 and len(text) < 300:
-                        descriptions.append(text)
-                
-                # Extract call-to-action elements
-                cta_elements = []
-                buttons = soup.find_all(['button', 'a'], string=True)
-                for btn in buttons[:5]:
-                    text = btn.get_text().strip()
-                    if text and len(text) > 2 and len(text) < 50:
-                        cta_elements.append(text)
+                summary = extract_page_summary(response)
                 
                 result = {
                     'url': url,
-                    'title': title_text,
-                    'headline': headlines,
-                    'subheadline': subheadlines[:5],
-                    'description_credibility': descriptions[:8],
-                    'call_to_action': cta_elements[:10],
-                    'html_length': len(str(soup))
+                    'title': summary['title'],
+                    'headline': summary['headline'],
+                    'subheadline': summary['subheadline'],
+                    'description_credibility': summary['description_credibility'],
+                    'call_to_action': summary['call_to_action'],
+                    'html_length': summary['html_length']
                 }
                 
                 results.append(result)
@@ -701,6 +928,9 @@ def scrape_ai():
                 'message': 'Maximum 3 URLs allowed for AI-enhanced scraping'
             }), 400
         
+        # "cache": false asks for fresh suggestions instead of cached ones
+        use_cache = data.get('cache', True) is not False
+        
         results = []
         
         for url in urls:
@@ -709,46 +939,15 @@ def scrape_ai():
                 headers = {
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                 }
-                response = requests.get(url, headers=headers, timeout=10)
+                response = requests.get(url, headers=headers, timeout=10, stream=True)
                 response.raise_for_status()
                 
-                soup = BeautifulSoup(response.content, 'html.parser')
-                
-                # Extract data
-                title = soup.find('title')
-                title_text = title.text.strip() if title else ""
-                
-                h1_tags = soup.find_all('h1')
-                headlines = [h1.get_text().strip() for h1 in h1_tags[:3] if h1.get_text().strip()]
-                
-                h2_tags = soup.find_all('h2')
-                h3_tags = soup.find_all('h3')
-                subheadlines = []
-                for h in h2_tags[:3]:
-                    text = h.get_text().strip()
-                    if text and len(text) > 5:
-                        subheadlines.append(text)
-                for h in h3_tags[:2]:
-                    text = h.get_text().strip()
-                    if text and len(text) > 5:
-                        subheadlines.append(text)
-                
-                meta_desc = soup.find('meta', attrs={'name': 'description'})
-                description = meta_desc.get('content', '').strip() if meta_desc else ''
-                
-                paragraphs = soup.find_all('p')
-                descriptions = [description] if description else []
-                for p in paragraphs[:3]:
-                    text = p.get_text().strip()
-                    if text and len(text) > 20 and len(text) < 300:
-                        descriptions.append(text)
-                
-                cta_elements = []
-                buttons = soup.find_all(['button', 'a'], string=True)
-                for btn in buttons[:5]:
-                    text = btn.get_text().strip()
-                    if text and len(text) > 2 and len(text) < 50:
-                        cta_elements.append(text)
+                summary = extract_page_summary(response)
+                title_text = summary['title']
+                headlines = summary['headline']
+                subheadlines = summary['subheadline']
+                descriptions = summary['description_credibility']
+                cta_elements = summary['call_to_action']
                 
                 # Now enhance with AI
                 enhanced_data = {
@@ -758,81 +957,46 @@ def scrape_ai():
                     'processing_timestamp': datetime.now(timezone.utc).isoformat()
                 }
                 
-                # Process headlines with AI
-                if headlines:
-                    enhanced_headlines = []
-                    for headline in headlines[:2]:  # Limit to 2 headlines for performance
-                        ai_result = cerebras_ai.generate_content_suggestions(
-                            headline, 
-                            "headline",
-                            context=f"Website: {url}"
-                        )
-                        
-                        headline_data = {
-                            'original': headline,
-                            'ai_suggestions': ai_result.get('suggestions', []) if 'success' in ai_result else [],
-                            'ai_error': ai_result.get('error') if 'error' in ai_result else None
-                        }
-                        enhanced_headlines.append(headline_data)
-                    
-                    enhanced_data['headline'] = enhanced_headlines
-                
-                # Process subheadlines with AI
-                if subheadlines:
-                    enhanced_subheadlines = []
-                    for subheadline in subheadlines[:2]:  # Limit to 2 for performance
-                        ai_result = cerebras_ai.generate_content_suggestions(
-                            subheadline,
-                            "subheadline",
-                            context=f"Website: {url}"
-                        )
-                        
-                        subheadline_data = {
-                            'original': subheadline,
-                            'ai_suggestions': ai_result.get('suggestions', []) if 'success' in ai_result else [],
-                            'ai_error': ai_result.get('error') if 'error' in ai_result else None
-                        }
-                        enhanced_subheadlines.append(subheadline_data)
-                    
-                    enhanced_data['subheadline'] = enhanced_subheadlines
+                # Enhance with AI: every element of the page in one batched request
+                # (limited to 2 of each type for performance)
+                elements = [
+                    ('headline', 'headline', headlines[:2]),
+                    ('subheadline', 'subheadline', subheadlines[:2]),
+                    ('description_credibility', 'description', descriptions[:2]),
+                    ('call_to_action', 'cta', cta_elements[:2])
+                ]
+                items = [(item, content_type) for _, content_type, field_items in elements for item in field_items]
                 
-                # Process descriptions with AI
-                if descriptions:
-                    enhanced_descriptions = []
-                    for description in descriptions[:2]:  # Limit to 2 for performance
-                        ai_result = cerebras_ai.generate_content_suggestions(
-                            description,
-                            "description",
-                            context=f"Website: {url}"
-                        )
-                        
-                        description_data = {
-                            'original': description,
-                            'ai_suggestions': ai_result.get('suggestions', []) if 'success' in ai_result else [],
-                            'ai_error': ai_result.get('error') if 'error' in ai_result else None
-                        }
-                        enhanced_descriptions.append(description_data)
-                    
-                    enhanced_data['description_credibility'] = enhanced_descriptions
+                # Enrich only the first of each group of (near-)duplicates and reuse its result for the copies
+                leaders = group_duplicates(items)
+                unique_items = [pair for index, pair in enumerate(items) if leaders[index] == index]
+                if AI_BATCH_PROMPTS:
+                    unique_results = cerebras_ai.generate_batch_suggestions(unique_items, context=f"Website: {url}",
+                                                                            use_cache=use_cache)
+                else:
+                    unique_results = [
+                        cerebras_ai.generate_content_suggestions(item, content_type, context=f"Website: {url}",
+                                                                 use_cache=use_cache)
+                        for item, content_type in unique_items
+                    ]
+                unique_results = iter(unique_results)
+                page_results = []
+                for index, leader in enumerate(leaders):
+                    page_results.append(next(unique_results) if leader == index else page_results[leader])
+                ai_results = iter(page_results)
                 
-                # Process CTAs with AI
-                if cta_elements:
-                    enhanced_ctas = []
-                    for cta in cta_elements[:2]:  # Limit to 2 for performance
-                        ai_result = cerebras_ai.generate_content_suggestions(
-                            cta,
-                            "cta",
-                            context=f"Website: {url}"
-                        )
-                        
-                        cta_data = {
-                            'original': cta,
+                for field, _, field_items in elements:
+                    if not field_items:
+                        continue
+                    enhanced_items = []
+                    for item in field_items:
+                        ai_result = next(ai_results)
+                        enhanced_items.append({
+                            'original': item,
                             'ai_suggestions': ai_result.get('suggestions', []) if 'success' in ai_result else [],
                             'ai_error': ai_result.get('error') if 'error' in ai_result else None
-                        }
-                        enhanced_ctas.append(cta_data)
-                    
-                    enhanced_data['call_to_action'] = enhanced_ctas
+                        })
+                    enhanced_data[field] = enhanced_items
                 
                 results.append(enhanced_data)
                 
@@ -937,7 +1101,15 @@ def scrape_self_contained():
 
 @app.route('/apply-changes', methods=['POST'])
 def apply_changes():
-    """Apply text changes to HTML content"""
+    """
+    Apply text changes to HTML content
+    With html_id instead of html the changes are applied to that stored document and
+    the result is stored as a new revision; only its id and a summary are returned
+    With response_format 'patch' the edits come back as patches, [{start, end, html}]
+    replacements of the input HTML (offsets in UTF-16 code units as JavaScript indexes
+    strings, in order, never overlapping), instead of the whole modified page, which is
+    only sent if they can't be produced
+    """
     try:
         data = request.get_json()
         
@@ -950,26 +1122,36 @@ def apply_changes():
         html_content = data.get('html')
         changes = data.get('changes', {})
         
+        patch_format = data.get('response_format') == 'patch'
+        
+        if data.get('html_id'):
+            return apply_changes_to_stored(data['html_id'], changes, patch_format)
+        
         if not html_content:
             return jsonify({
                 'status': 'error',
                 'message': 'HTML content is required'
             }), 400
         
-        modified_html = html_content
+        # Changes keyed by a scrape element id go straight to that element; the rest are found by text
+        engine = ChangeEngine(html_content)
+        report = engine.apply_all(changes)
+        result = {
+            'changes_applied': sum(1 for entry in report if entry['applied']),
+            'changes': report
+        }
         
-        for element_id, change_data in changes.items():
-            if 'original' in change_data and 'modified' in change_data:
-                original_text = change_data['original']
-                modified_text = change_data['modified']
-                modified_html = modified_html.replace(original_text, modified_text)
+        patches = engine.patches() if patch_format else None
+        if patches is not None:
+            result['patches'] = patches
+            result['base_length'] = utf16_length(html_content)
+            result['offsets'] = 'utf-16'
+        else:
+            result['modified_html'] = engine.html()
         
         return jsonify({
             'status': 'success',
-            'data': {
-                'modified_html': modified_html,
-                'changes_applied': len(changes)
-            }
+            'data': result
         })
         
     except Exception as e:
@@ -978,9 +1160,65 @@ def apply_changes():
             'message': f'Failed to apply changes: {str(e)}'
         }), 500
 
+def apply_changes_to_stored(html_id, changes, patch_format=False):
+    """
+    Apply changes to a stored document and store the result under a new id
+    With patch_format the response also carries the edits as patches of the parent revision
+    """
+    # The previous revision's engine, if it is still warm, saves reading, inflating and parsing
+    # the document again; its metadata is all that is read from the store then
+    metadata = document_store.metadata(html_id)
+    engine = warm_engines.take(html_id)
+    if engine is None or metadata is None:
+        stored_html = document_store.get(html_id) if metadata is not None else None
+        if stored_html is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'HTML not found'
+            }), 404
+        engine = ChangeEngine(stored_html)
+    
+    report = engine.apply_all(changes)
+    html_content = engine.html()
+    patches = engine.patches() if patch_format else None
+    
+    try:
+        revision_id = document_store.store(html_content, {
+            **(metadata or {}),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'parent_id': html_id
+        })
+    except DocumentTooLarge as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 413
+    warm_engines.put(revision_id, engine, len(html_content))
+    
+    result = {
+        'html_id': revision_id,
+        'parent_id': html_id,
+        'serve_url': f'/serve-html/{revision_id}',
+        'size': len(html_content),
+        'changes_applied': sum(1 for entry in report if entry['applied']),
+        'changes': report
+    }
+    if patches is not None:
+        result['patches'] = patches
+        result['offsets'] = 'utf-16'
+    
+    return jsonify({
+        'status': 'success',
+        'data': result
+    })
+
 @app.route('/store-html', methods=['POST'])
 def store_html():
-    """Store HTML content and return an ID"""
+    """
+    Store HTML content and return an ID; optional ttl (seconds, 0 = until evicted) and pin
+    The ID is the content's SHA-256, so storing the same HTML again returns the same ID
+    The release_token returned is what DELETE /store-html/<id> needs to drop this reference
+    """
     try:
         data = request.get_json()
         
@@ -992,21 +1230,25 @@ def store_html():
         
         html_content = data['html']
         
-        import hashlib
-        import time
-        html_id = hashlib.md5(f"{html_content[:100]}{time.time()}".encode()).hexdigest()
-        
-        html_storage[html_id] = {
-            'html': html_content,
-            'created_at': datetime.now(timezone.utc).isoformat(),
-            'url': data.get('url', ''),
-            'title': data.get('title', '')
-        }
+        try:
+            release_token = new_release_token()
+            html_id = document_store.store(html_content, {
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'url': data.get('url', ''),
+                'title': data.get('title', '')
+            }, ttl=data.get('ttl') if isinstance(data.get('ttl'), (int, float)) else None,
+                pinned=bool(data.get('pin')), owner=owner_key(release_token))
+        except DocumentTooLarge as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 413
         
         return jsonify({
             'status': 'success',
             'data': {
                 'html_id': html_id,
+                'release_token': release_token,
                 'serve_url': f'/serve-html/{html_id}'
             }
         })
@@ -1017,25 +1259,69 @@ def store_html():
             'message': f'Failed to store HTML: {str(e)}'
         }), 500
 
+@app.route('/store-html/<path:html_id>', methods=['DELETE'])
+def release_html(html_id):
+    """
+    Drop the reference a /store-html call took, given its release_token (X-Release-Token
+    header or body); the document is removed when no references are left
+    """
+    release_token = request.headers.get('X-Release-Token') or (request.get_json(silent=True) or {}).get('release_token')
+    if not isinstance(release_token, str) or not release_token:
+        return jsonify({
+            'status': 'error',
+            'message': 'release_token is required'
+        }), 401
+    
+    # A wrong token is answered like a missing document, so ids can't be probed with it
+    if not document_store.release(html_id, owner_key(release_token)):
+        return jsonify({
+            'status': 'error',
+            'message': 'HTML not found'
+        }), 404
+    
+    return jsonify({
+        'status': 'success',
+        'data': {'html_id': html_id}
+    })
+
 @app.route('/serve-html/<path:html_id>', methods=['GET'])
 def serve_html(html_id):
     """Serve stored HTML with proper headers"""
     try:
-        if html_id not in html_storage:
+        # Streamed from the store as stored (gzip) when the client takes it: a
+        # persistent backend never loads the whole page and nothing is re-encoded
+        opened = document_store.open(html_id, gzip_ok=request.accept_encodings['gzip'] > 0)
+        if opened is None:
             return jsonify({
                 'status': 'error',
                 'message': 'HTML not found'
             }), 404
         
-        stored_data = html_storage[html_id]
-        html_content = stored_data['html']
-        
-        from flask import Response
-        response = Response(html_content, mimetype='text/html')
+        body, size, encoding = opened
+        response = Response(wrap_file(request.environ, body), mimetype='text/html', direct_passthrough=True)
+        response.content_length = size
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        if is_content_id(html_id):
+            # The id is the content's hash, so what it serves never changes: a strong
+            # ETag per encoding, and clients may keep the page for good
+            response.set_etag(f'{html_id}-{encoding}' if encoding else html_id)
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
         
+        # 304 when If-None-Match matches, 206 for a Range (the stored file is seeked, not
+        # read up to the start); 304s and HEAD responses never read the body
+        try:
+            response.make_conditional(request, accept_ranges=True, complete_length=size)
+        except RequestedRangeNotSatisfiable as e:
+            response.close()
+            return e.get_response()
+        
         return response
         
     except Exception as e:
@@ -1067,7 +1353,46 @@ def generate_more_suggestions():
                 'message': 'Content is required'
             }), 400
         
-        ai_result = cerebras_ai.generate_content_suggestions(content, content_type, context)
+        # "More" means new suggestions: the cached ones are what /scrape already showed,
+        # so they are read only on "cache": true, and nothing here replaces them
+        use_cache = data.get('cache') is True
+        
+        # "stream": true (or Accept: text/event-stream) sends each suggestion as it is generated
+        if wants_event_stream(request, data):
+            def events():
+                sent = 0
+                for kind, value in cerebras_ai.stream_content_suggestions(content, content_type, context, use_cache,
+                                                                              store=False, interactive=True):
+                    if kind == 'suggestion':
+                        if sent < count:
+                            yield sse_event('suggestion', {'index': sent, 'suggestion': value})
+                            sent += 1
+                    elif 'error' in value:
+                        yield sse_event('error', {'status': 'error', 'message': value['error']})
+                    else:
+                        suggestions = value.get('suggestions', [])[:count]
+                        yield sse_event('done', {
+                            'status': 'success',
+                            'data': {
+                                'original_content': content,
+                                'content_type': content_type,
+                                'suggestions': suggestions,
+                                'count': len(suggestions)
+                            }
+                        })
+            
+            return Response(stream_with_context(events()), mimetype='text/event-stream', headers=SSE_HEADERS)
+        
+        # Pools are per content, type and context. A client-chosen session id names one editor;
+        # without one, requests for the same stored page (or, lacking that, the same content)
+        # share a session, so each is served suggestions none of the others got
+        session_id = data.get('session_id') or request.headers.get('X-Session-Id') or data.get('html_id')
+        if suggestion_pool.enabled and not use_cache:
+            # Served from the prefetched pool, skipping suggestions this session already has
+            ai_result = suggestion_pool.take(content, content_type, context, session_id=session_id, count=count)
+        else:
+            ai_result = cerebras_ai.generate_content_suggestions(content, content_type, context, use_cache=use_cache,
+                                                                 store=False, interactive=True)
         
         if 'error' in ai_result:
             return jsonify({
@@ -0,0 +1,237 @@
+"""
+Process Pool for CPU-bound Parsing
+==================================
+
+BeautifulSoup parsing and extraction are pure Python, so under concurrent
+load Flask threads serialize on the GIL. ParsePool ships the fetched bytes to
+warm worker processes and gets back only the compact result.
+
+Each worker runs one task at a time. A task's timeout starts when a worker
+picks it up, so time spent queued behind other requests never counts against
+it. A task that outlives the timeout fails with ParseTimeoutError and only
+its worker is terminated and replaced; tasks on other workers carry on.
+
+If the pool is disabled, cannot be started on this platform (serverless
+runtimes often lack the shared memory multiprocessing needs), or a worker
+crashes or cannot be sent the task, work runs in-process instead.
+
+Environment Variables:
+- PARSE_POOL_SIZE: number of worker processes (default 0 = parse in-process)
+- PARSE_POOL_MAX_TASKS: recycle a worker after this many tasks (default 200)
+- PARSE_POOL_TASK_TIMEOUT: seconds a worker may spend on a single task (default 30)
+"""
+
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+PARSE_POOL_SIZE = int(os.environ.get('PARSE_POOL_SIZE', '0'))
+PARSE_POOL_MAX_TASKS = int(os.environ.get('PARSE_POOL_MAX_TASKS', '200'))
+PARSE_POOL_TASK_TIMEOUT = float(os.environ.get('PARSE_POOL_TASK_TIMEOUT', '30'))
+
+# Seconds a terminated worker gets to exit before it is killed
+STOP_GRACE = 1.0
+
+
+class ParseTimeoutError(Exception):
+    """Raised when a pooled task does not finish within the task timeout"""
+
+
+def _serve(conn):
+    # Worker loop: one (func, args) at a time until told to stop
+    import bs4  # noqa: F401  # import the parser before real work arrives
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        func, args = task
+        try:
+            reply = ('ok', func(*args))
+        except Exception as e:
+            reply = ('raised', e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # Unpicklable result or exception; send() pickles before writing anything
+            conn.send(('failed', f'{type(e).__name__}: {e}'))
+
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'tasks')
+
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.tasks = 0
+
+    def stop(self, terminate=False):
+        try:
+            if not terminate:
+                self.conn.send(None)
+        except OSError:
+            terminate = True
+        finally:
+            self.conn.close()
+        if terminate:
+            self.process.terminate()
+        self.process.join(STOP_GRACE)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+class ParsePool:
+    """Run picklable functions in recycled worker processes, falling back to in-process calls"""
+
+    def __init__(self, size=PARSE_POOL_SIZE, max_tasks_per_child=PARSE_POOL_MAX_TASKS,
+                 task_timeout=PARSE_POOL_TASK_TIMEOUT):
+        self.size = max(0, size)
+        self.max_tasks_per_child = max_tasks_per_child if max_tasks_per_child > 0 else None
+        self.task_timeout = task_timeout
+        self._context = None
+        # Idle slots: a running _Worker, or None for a slot whose worker has not been started
+        self._idle = queue.Queue()
+        self._disabled_reason = None if self.size else 'disabled by configuration'
+        self._lock = threading.Lock()
+        self.stats = {
+            'pooled_tasks': 0,
+            'in_process_tasks': 0,
+            'fallbacks': 0,
+            'timeouts': 0,
+            'restarts': 0
+        }
+
+    @property
+    def enabled(self):
+        return self._disabled_reason is None
+
+    def _mp_context(self):
+        # forkserver keeps worker startup cheap without forking a threaded server
+        methods = multiprocessing.get_all_start_methods()
+        return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+    def _start(self):
+        with self._lock:
+            if self._context is None and self.enabled:
+                self._context = self._mp_context()
+                for _ in range(self.size):
+                    self._idle.put(None)
+                logger.info(f"Started parse pool with {self.size} workers")
+            return self.enabled
+
+    def _checkout(self):
+        worker = self._idle.get()
+        if worker is not None and (not worker.process.is_alive() or (
+                self.max_tasks_per_child is not None and worker.tasks >= self.max_tasks_per_child)):
+            worker.stop()
+            worker = None
+        if worker is None:
+            try:
+                worker = _Worker(self._context)
+            except (OSError, ImportError, NotImplementedError, ValueError) as e:
+                self._idle.put(None)
+                with self._lock:
+                    self._disabled_reason = f'unavailable: {e}'
+                logger.warning(f"Parse pool unavailable, parsing in-process: {e}")
+                return None
+        return worker
+
+    def _release(self, worker):
+        if self.enabled:
+            self._idle.put(worker)
+        else:
+            worker.stop()
+
+    def _replace(self, worker, terminate=True):
+        # Stop a worker that can no longer be trusted; its slot starts a fresh one when next used
+        worker.stop(terminate=terminate)
+        with self._lock:
+            self.stats['restarts'] += 1
+        self._idle.put(None)
+
+    def _run_in_process(self, func, args, fallback):
+        with self._lock:
+            self.stats['in_process_tasks'] += 1
+            if fallback:
+                self.stats['fallbacks'] += 1
+        return func(*args)
+
+    def run(self, func, *args):
+        """Run func(*args) in a worker process and return its result"""
+        if not self._start():
+            return self._run_in_process(func, args, fallback=False)
+        worker = self._checkout()
+        if worker is None:
+            return self._run_in_process(func, args, fallback=True)
+
+        try:
+            worker.conn.send((func, args))
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            # An unpicklable task: nothing reached the worker, so it stays in the pool
+            self._release(worker)
+            logger.warning(f"Parse pool cannot send task ({type(e).__name__}: {e}), parsing in-process")
+            return self._run_in_process(func, args, fallback=True)
+        except OSError as e:
+            self._replace(worker)
+            logger.warning(f"Parse pool worker unreachable ({e}), parsing in-process")
+            return self._run_in_process(func, args, fallback=True)
+        worker.tasks += 1
+
+        try:
+            if not worker.conn.poll(self.task_timeout):
+                self._replace(worker)
+                with self._lock:
+                    self.stats['timeouts'] += 1
+                raise ParseTimeoutError(f'Parsing took longer than {self.task_timeout:g}s')
+            status, value = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            # The worker died mid-task: replace it and do this one here
+            self._replace(worker)
+            logger.warning(f"Parse pool worker crashed ({type(e).__name__}), parsing in-process")
+            return self._run_in_process(func, args, fallback=True)
+
+        self._release(worker)
+        if status == 'failed':
+            logger.warning(f"Parse pool task result could not be returned ({value}), parsing in-process")
+            return self._run_in_process(func, args, fallback=True)
+        with self._lock:
+            self.stats['pooled_tasks'] += 1
+        if status == 'raised':
+            raise value
+        return value
+
+    def status(self):
+        """Pool configuration and counters for health reporting"""
+        with self._lock:
+            stats = dict(self.stats)
+        return {
+            'enabled': self.enabled,
+            'reason': self._disabled_reason,
+            'size': self.size,
+            'max_tasks_per_child': self.max_tasks_per_child,
+            'task_timeout': self.task_timeout,
+            **stats
+        }
+
+    def shutdown(self):
+        """Stop the workers; tasks still running finish first and later calls run in-process"""
+        with self._lock:
+            self._disabled_reason = 'shut down'
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if worker is not None:
+                worker.stop()
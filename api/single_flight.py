@@ -0,0 +1,118 @@
+"""
+Single-flight Request Coalescing
+================================
+
+When several callers need the same AI completion at the same moment (editors
+opening the same page, a CTA repeated on one page), only the first caller
+sends it. Everyone else with the same key waits for that call and shares its
+result or exception.
+
+The first caller (the leader) runs the work inline on its own thread, bounded
+by the request's own timeouts; no extra thread is started. Each waiting caller
+has its own wait timeout and can give up without affecting the leader or the
+other waiters. An on_shared callback lets callers account for each call saved.
+
+Environment Variables:
+- AI_COALESCE: set to 'false' to send every request separately
+- AI_COALESCE_TIMEOUT: seconds a caller that names no timeout waits for the shared result (default 90)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+AI_COALESCE_ENABLED = os.environ.get('AI_COALESCE', 'true').lower() == 'true'
+AI_COALESCE_TIMEOUT = float(os.environ.get('AI_COALESCE_TIMEOUT', '90'))
+
+
+class SingleFlightTimeout(Exception):
+    """Raised to a waiting caller whose own timeout expired before the shared call finished"""
+
+
+def request_key(payload):
+    """Hash of a request payload; identical prompts and settings share a key"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls that share a key"""
+
+    def __init__(self, enabled=AI_COALESCE_ENABLED, timeout=AI_COALESCE_TIMEOUT):
+        self.enabled = enabled
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            'leaders': 0,
+            'coalesced': 0,
+            'waiter_timeouts': 0,
+            'shared_errors': 0
+        }
+
+    def do(self, key, func, timeout=None, on_shared=None):
+        """
+        Return func(), sharing one execution among concurrent callers with the same key
+        on_shared() is called for each caller that joins a call already in flight
+        """
+        if not self.enabled:
+            return func()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.counters['leaders'] += 1
+            else:
+                call.waiters += 1
+                self.counters['coalesced'] += 1
+
+        if not leader and on_shared is not None:
+            on_shared()
+
+        if leader:
+            try:
+                call.result = func()
+                return call.result
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                    if call.error is not None and call.waiters:
+                        self.counters['shared_errors'] += 1
+                call.done.set()
+
+        wait = self.timeout if timeout is None else timeout
+        if not call.done.wait(wait):
+            with self._lock:
+                call.waiters -= 1
+                self.counters['waiter_timeouts'] += 1
+            raise SingleFlightTimeout(f'Shared AI request did not finish within {wait:g}s')
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def status(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'in_flight_keys': len(self._calls),
+                'waiting_callers': sum(call.waiters for call in self._calls.values()),
+                **self.counters
+            }
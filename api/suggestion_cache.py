@@ -0,0 +1,209 @@
+"""
+AI Suggestion Cache
+===================
+
+The same headline (a shared header, a page scraped again) used to go back to
+the AI provider on every request. SuggestionCache keeps generated suggestion
+lists keyed by a hash of the normalized content, content type, detected
+language, model and temperature.
+
+Two tiers:
+- an in-process LRU for the hottest entries
+- a SQLite file in WAL mode, shared by every worker process on the host
+
+Entries expire after a TTL in both tiers. If the SQLite file cannot be opened
+(read-only filesystem, locked volume) the cache keeps working memory-only.
+
+Environment Variables:
+- SUGGESTION_CACHE: set to 'false' to disable caching
+- SUGGESTION_CACHE_PATH: SQLite file for the shared tier
+- SUGGESTION_CACHE_TTL: seconds an entry stays valid (default 7 days)
+- SUGGESTION_CACHE_MEMORY_ITEMS: entries kept in the in-process LRU (default 1024)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SUGGESTION_CACHE_ENABLED = os.environ.get('SUGGESTION_CACHE', 'true').lower() == 'true'
+SUGGESTION_CACHE_PATH = os.environ.get(
+    'SUGGESTION_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'suggestion_cache.sqlite3')
+)
+SUGGESTION_CACHE_TTL = float(os.environ.get('SUGGESTION_CACHE_TTL', str(7 * 24 * 3600)))
+SUGGESTION_CACHE_MEMORY_ITEMS = int(os.environ.get('SUGGESTION_CACHE_MEMORY_ITEMS', '1024'))
+
+# Delete expired rows from the shared tier every this many writes
+PRUNE_EVERY = 500
+
+
+def normalize_content(text):
+    """Unicode-normalize and collapse whitespace so trivially different copies share a key"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text or '')).strip()
+
+
+class SuggestionCache:
+    """Two-tier (memory LRU + SQLite) TTL cache of AI suggestion lists"""
+
+    def __init__(self, namespace='default', path=SUGGESTION_CACHE_PATH, ttl=SUGGESTION_CACHE_TTL,
+                 memory_items=SUGGESTION_CACHE_MEMORY_ITEMS, enabled=SUGGESTION_CACHE_ENABLED):
+        self.namespace = namespace
+        self.path = path
+        self.ttl = ttl
+        self.memory_items = max(0, memory_items)
+        self.enabled = enabled
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._disk_error = None
+        self._writes = 0
+        self.stats_counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'bypassed': 0,
+            'saved_seconds': 0.0
+        }
+        if self.enabled:
+            self._connection()
+
+    def key(self, content, content_type, language, model, temperature):
+        """Stable cache key for one suggestion request"""
+        parts = [self.namespace, normalize_content(content), content_type, language, model, float(temperature)]
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def _connection(self):
+        """Per-thread SQLite connection, or None when the disk tier is unavailable"""
+        if self._disk_error is not None:
+            return None
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        try:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS suggestions ('
+                'key TEXT PRIMARY KEY, suggestions TEXT NOT NULL, '
+                'latency REAL NOT NULL, expires REAL NOT NULL)'
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            self._disk_error = str(e)
+            logger.warning(f"Suggestion cache disk tier unavailable, using memory only: {e}")
+            return None
+        self._local.conn = conn
+        return conn
+
+    def _remember(self, key, suggestions, latency, expires):
+        if not self.memory_items:
+            return
+        with self._lock:
+            self._memory[key] = (suggestions, latency, expires)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _count(self, counter, saved=0.0):
+        with self._lock:
+            self.stats_counters[counter] += 1
+            self.stats_counters['saved_seconds'] += saved
+
+    def get(self, key, record=True):
+        """Cached suggestions for key, or None; record=False leaves the hit/miss counters alone"""
+        if not self.enabled:
+            return None
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._memory.move_to_end(key)
+                else:
+                    del self._memory[key]
+                    entry = None
+        if entry is not None:
+            if record:
+                self._count('memory_hits', entry[1])
+            return list(entry[0])
+
+        conn = self._connection()
+        if conn is not None:
+            try:
+                row = conn.execute(
+                    'SELECT suggestions, latency, expires FROM suggestions WHERE key = ? AND expires > ?',
+                    (key, now)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Suggestion cache read failed: {e}")
+                row = None
+            if row is not None:
+                suggestions = json.loads(row[0])
+                self._remember(key, suggestions, row[1], row[2])
+                if record:
+                    self._count('disk_hits', row[1])
+                return list(suggestions)
+
+        if record:
+            self._count('misses')
+        return None
+
+    def put(self, key, suggestions, latency=0.0):
+        """Store a successful suggestion list along with how long it took to generate"""
+        if not self.enabled or not suggestions:
+            return
+        expires = time.time() + self.ttl
+        suggestions = list(suggestions)
+        self._remember(key, suggestions, latency, expires)
+        self._count('stores')
+
+        conn = self._connection()
+        if conn is None:
+            return
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO suggestions (key, suggestions, latency, expires) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(suggestions, ensure_ascii=False), latency, expires)
+            )
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % PRUNE_EVERY == 0
+            if prune:
+                conn.execute('DELETE FROM suggestions WHERE expires <= ?', (time.time(),))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Suggestion cache write failed: {e}")
+
+    def note_bypass(self):
+        self._count('bypassed')
+
+    def stats(self):
+        """Hit rate and time saved, for the stats endpoint"""
+        with self._lock:
+            counters = dict(self.stats_counters)
+            memory_entries = len(self._memory)
+        lookups = counters['memory_hits'] + counters['disk_hits'] + counters['misses']
+        hits = counters['memory_hits'] + counters['disk_hits']
+        counters['saved_seconds'] = round(counters['saved_seconds'], 3)
+        return {
+            'enabled': self.enabled,
+            'namespace': self.namespace,
+            'disk_tier': self.path if self._disk_error is None else f'unavailable: {self._disk_error}',
+            'ttl_seconds': self.ttl,
+            'memory_entries': memory_entries,
+            'lookups': lookups,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            **counters
+        }
@@ -0,0 +1,242 @@
+"""
+Prefetched Suggestion Pools
+===========================
+
+"Generate more" used to mean one more blocking 10-suggestion AI call while
+the editor waited. SuggestionPool keeps a growing, de-duplicated pool of
+suggestions per (content, content type, context):
+
+- The first request for a pool starts a background job that generates
+  several batches. The request is answered as soon as the first batch lands.
+  Every batch is freshly generated, and whatever the suggestion cache holds
+  for the content (what /scrape showed) is excluded from the pool.
+- Later requests are served from the pool immediately, skipping anything
+  already shown to that session.
+- When a session is running low on unseen suggestions, another background
+  refill starts. Only one refill per pool runs at a time; batches run one
+  after another so identical prompts are not coalesced into one call.
+
+There is one pool per content, content type and context (the context is
+part of the prompt, so pools for different pages never mix). Sessions are
+named by the caller; requests that share a session id, or that have none,
+share what has been served. Pools are bounded in number, size and age. A
+session that has seen a full pool starts over from the beginning.
+
+Environment Variables:
+- SUGGESTION_POOL: set to 'false' to generate every "more" request directly
+- SUGGESTION_POOL_INITIAL_BATCHES: AI calls made when a pool is created (default 3)
+- SUGGESTION_POOL_REFILL_BATCHES: AI calls per refill (default 2)
+- SUGGESTION_POOL_MAX: most suggestions kept per pool (default 100)
+- SUGGESTION_POOL_KEYS: most pools kept (default 256)
+- SUGGESTION_POOL_TTL: seconds an idle pool is kept (default 1800)
+- SUGGESTION_POOL_WAIT: longest a request waits for a batch in seconds (default 60)
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from suggestion_cache import normalize_content
+
+logger = logging.getLogger(__name__)
+
+SUGGESTION_POOL_ENABLED = os.environ.get('SUGGESTION_POOL', 'true').lower() == 'true'
+SUGGESTION_POOL_INITIAL_BATCHES = int(os.environ.get('SUGGESTION_POOL_INITIAL_BATCHES', '3'))
+SUGGESTION_POOL_REFILL_BATCHES = int(os.environ.get('SUGGESTION_POOL_REFILL_BATCHES', '2'))
+SUGGESTION_POOL_MAX = int(os.environ.get('SUGGESTION_POOL_MAX', '100'))
+SUGGESTION_POOL_KEYS = int(os.environ.get('SUGGESTION_POOL_KEYS', '256'))
+SUGGESTION_POOL_TTL = float(os.environ.get('SUGGESTION_POOL_TTL', '1800'))
+SUGGESTION_POOL_WAIT = float(os.environ.get('SUGGESTION_POOL_WAIT', '60'))
+
+# Sessions remembered per pool
+MAX_SESSIONS_PER_POOL = 256
+
+
+class _Pool:
+    def __init__(self, content, content_type, context):
+        self.content = content
+        self.content_type = content_type
+        self.context = context
+        self.suggestions = []
+        self.seen_text = set()
+        self.sessions = OrderedDict()
+        self.refilling = False
+        self.batches_done = 0
+        self.last_error = None
+        self.touched = time.monotonic()
+        self.cond = threading.Condition()
+
+    def exclude(self, suggestions):
+        """Keep suggestions out of the pool without serving them"""
+        for suggestion in suggestions:
+            self.seen_text.add(normalize_content(suggestion).casefold())
+
+    def add(self, suggestions, limit):
+        added = 0
+        for suggestion in suggestions:
+            marker = normalize_content(suggestion).casefold()
+            if marker and marker not in self.seen_text and len(self.suggestions) < limit:
+                self.seen_text.add(marker)
+                self.suggestions.append(suggestion)
+                added += 1
+        return added
+
+
+class SuggestionPool:
+    """Per-(content, type, context) suggestion pools served without waiting on the AI"""
+
+    def __init__(self, ai, enabled=SUGGESTION_POOL_ENABLED, initial_batches=SUGGESTION_POOL_INITIAL_BATCHES,
+                 refill_batches=SUGGESTION_POOL_REFILL_BATCHES, max_suggestions=SUGGESTION_POOL_MAX,
+                 max_pools=SUGGESTION_POOL_KEYS, ttl=SUGGESTION_POOL_TTL, wait_timeout=SUGGESTION_POOL_WAIT):
+        self.ai = ai
+        # Stand-in lists some AI clients return instead of an error
+        self.placeholders = getattr(ai, 'PLACEHOLDER_SUGGESTIONS', ())
+        # Cached suggestions for a content, which a new pool must not hand out again
+        self.cached = getattr(ai, 'cached_suggestions', None)
+        self.enabled = enabled
+        self.initial_batches = max(1, initial_batches)
+        self.refill_batches = max(1, refill_batches)
+        self.max_suggestions = max(10, max_suggestions)
+        self.max_pools = max(1, max_pools)
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='suggestion-pool')
+        self.counters = {
+            'requests': 0,
+            'served_immediately': 0,
+            'waited': 0,
+            'refills': 0,
+            'generation_errors': 0,
+            'evicted': 0
+        }
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _get_pool(self, content, content_type, context):
+        key = (normalize_content(content), content_type, context)
+        now = time.monotonic()
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None and now - pool.touched > self.ttl and not pool.refilling:
+                del self._pools[key]
+                self.counters['evicted'] += 1
+                pool = None
+            if pool is None:
+                pool = self._pools[key] = _Pool(content, content_type, context)
+                while len(self._pools) > self.max_pools:
+                    self._pools.popitem(last=False)
+                    self.counters['evicted'] += 1
+            self._pools.move_to_end(key)
+            pool.touched = now
+            return pool
+
+    def _start_refill(self, pool, batches):
+        # Called with pool.cond held
+        pool.refilling = True
+        pool.last_error = None
+        self._count('refills')
+        # Refills are attributed to the request that triggered them
+        self._executor.submit(contextvars.copy_context().run, self._refill, pool, batches)
+
+    def _refill(self, pool, batches):
+        try:
+            if pool.batches_done == 0 and self.cached is not None:
+                shown = self.cached(pool.content, pool.content_type)
+                if shown:
+                    with pool.cond:
+                        pool.exclude(shown)
+            for batch in range(batches):
+                with pool.cond:
+                    if len(pool.suggestions) >= self.max_suggestions:
+                        break
+                # Pool batches never go into the cache, which keeps what /scrape showed. Only a new
+                # pool's first batch has a request waiting on it; the rest are prefetch, never hedged
+                result = self.ai.generate_fresh_suggestions(pool.content, pool.content_type, pool.context,
+                                                            store=False,
+                                                            interactive=batch == 0 and pool.batches_done == 0)
+
+                with pool.cond:
+                    pool.batches_done += 1
+                    suggestions = result.get('suggestions')
+                    if 'error' in result or not suggestions or suggestions in self.placeholders:
+                        pool.last_error = result.get('error', 'No suggestions generated')
+                        self._count('generation_errors')
+                        break
+                    pool.add(suggestions, self.max_suggestions)
+                    pool.cond.notify_all()
+        except Exception as e:
+            logger.error(f"Suggestion pool refill failed: {str(e)}")
+            with pool.cond:
+                pool.last_error = 'Failed to generate AI suggestions'
+            self._count('generation_errors')
+        finally:
+            with pool.cond:
+                pool.refilling = False
+                pool.cond.notify_all()
+
+    def take(self, content, content_type, context="", session_id=None, count=10):
+        """
+        Up to count suggestions this session (None: everyone without one) has not been given yet
+        Returns a result shaped like CerebrasAI.generate_content_suggestions
+        """
+        self._count('requests')
+        pool = self._get_pool(content, content_type, context)
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+
+        with pool.cond:
+            served = pool.sessions.setdefault(session_id, set())
+            pool.sessions.move_to_end(session_id)
+            while len(pool.sessions) > MAX_SESSIONS_PER_POOL:
+                pool.sessions.popitem(last=False)
+
+            while True:
+                unseen = [index for index in range(len(pool.suggestions)) if index not in served]
+
+                # Top the pool up in the background before this session runs dry
+                if (len(unseen) - count < count and not pool.refilling
+                        and len(pool.suggestions) < self.max_suggestions
+                        and (unseen or pool.last_error is None)):
+                    batches = self.initial_batches if pool.batches_done == 0 else self.refill_batches
+                    self._start_refill(pool, batches)
+
+                if unseen:
+                    chosen = unseen[:count]
+                    served.update(chosen)
+                    self._count('waited' if waited else 'served_immediately')
+                    return {'success': True, 'suggestions': [pool.suggestions[index] for index in chosen]}
+
+                if not pool.refilling:
+                    if pool.last_error is not None:
+                        error, pool.last_error = pool.last_error, None
+                        return {'error': error}
+                    if pool.suggestions:
+                        # Everything in a full pool has been shown: start over
+                        served.clear()
+                        continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {'error': 'Timed out waiting for AI suggestions'}
+                waited = True
+                pool.cond.wait(remaining)
+
+    def stats(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            counters = dict(self.counters)
+        return {
+            'enabled': self.enabled,
+            'pools': len(pools),
+            'pooled_suggestions': sum(len(pool.suggestions) for pool in pools),
+            'refilling': sum(1 for pool in pools if pool.refilling),
+            **counters
+        }
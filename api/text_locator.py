@@ -0,0 +1,157 @@
+"""
+Multi-pattern Text Locator
+==========================
+
+Finds many change strings in a document's visible text in one pass.
+
+TextLocator builds a single normalized projection of the text: NFKC,
+case-folded, every run of whitespace collapsed to one space, and a space
+added wherever the text crosses into a different block element. Text nodes
+are already entity-decoded by the parser and change strings are entity-
+decoded here. Each projected character remembers the offset of the source
+character it came from, so a match maps straight back to a source span.
+
+All patterns are matched together with an Aho-Corasick automaton: one
+scan of the projection, linear in its length plus the number of matches,
+with no per-pattern rescans and no backtracking.
+"""
+
+import html
+import re
+import unicodedata
+from collections import deque
+
+_TOKEN_RE = re.compile(r'\S+')
+
+# Elements that start a new line of text; crossing into or out of one separates words
+BLOCK_ELEMENTS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'body', 'br', 'dd', 'details', 'dialog', 'div',
+    'dl', 'dt', 'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4',
+    'h5', 'h6', 'header', 'hr', 'html', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section',
+    'summary', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'title', 'tr', 'ul'
+])
+
+_fold_cache = {}
+
+
+def _fold(token):
+    """NFKC + casefold, one source character at a time so offsets stay exact"""
+    folded = []
+    for offset, char in enumerate(token):
+        out = _fold_cache.get(char)
+        if out is None:
+            out = _fold_cache[char] = unicodedata.normalize('NFKC', char).casefold()
+        folded.extend((piece, offset) for piece in out)
+    return folded
+
+
+def normalize_pattern(text):
+    """Projection form of a change string"""
+    text = unicodedata.normalize('NFKC', html.unescape(text or '')).casefold()
+    return ' '.join(text.split())
+
+
+def block_of(node):
+    """Nearest block-level ancestor of a text node"""
+    for parent in node.parents:
+        if parent.name in BLOCK_ELEMENTS:
+            return parent
+    return None
+
+
+class _Automaton:
+    """Aho-Corasick automaton over a list of patterns"""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                following = self.goto[state].get(char)
+                if following is None:
+                    following = self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = following
+            self.out[state].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self.goto[state].items():
+                queue.append(following)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[following] = self.goto[fallback].get(char, 0)
+                self.out[following] = self.out[following] + self.out[self.fail[following]]
+
+    def first_matches(self, text, lengths):
+        """{pattern index: (start, end)} of each pattern's first occurrence in text"""
+        found = {}
+        wanted = len(lengths)
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                for index in out[state]:
+                    if index not in found:
+                        found[index] = (position + 1 - lengths[index], position + 1)
+                if len(found) == wanted:
+                    break
+        return found
+
+
+class TextLocator:
+    """Normalized projection of text segments with an offset map back to the source text"""
+
+    def __init__(self, segments):
+        """
+        segments: (text, source_offset, new_block) for each text node in order;
+        new_block is True when the node is in a different block element than the one before
+        """
+        chars = []
+        offsets = []
+        space_pending = False
+        for text, base, new_block in segments:
+            space_pending = space_pending or new_block
+            position = 0
+            for token in _TOKEN_RE.finditer(text):
+                if (space_pending or token.start() > position) and chars:
+                    chars.append(' ')
+                    offsets.append(base + position)
+                space_pending = False
+                word = token.group()
+                if word.isascii():
+                    chars.append(word.lower())
+                    offsets.extend(range(base + token.start(), base + token.end()))
+                else:
+                    for char, offset in _fold(word):
+                        chars.append(char)
+                        offsets.append(base + token.start() + offset)
+                position = token.end()
+            if position < len(text):
+                space_pending = True
+        self.text = ''.join(chars)
+        self.offsets = offsets
+
+    def find_first(self, patterns):
+        """
+        Locate the first occurrence of each pattern (already normalize_pattern'd) in one scan
+        Returns {pattern: (source_start, source_end)} for the patterns that occur
+        """
+        patterns = [pattern for pattern in dict.fromkeys(patterns) if pattern]
+        if not patterns or not self.text:
+            return {}
+        automaton = _Automaton(patterns)
+        matches = automaton.first_matches(self.text, [len(pattern) for pattern in patterns])
+        return {
+            patterns[index]: (self.offsets[start], self.offsets[end - 1] + 1)
+            for index, (start, end) in matches.items()
+        }
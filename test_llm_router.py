@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Tests for api/llm_router.py against stub OpenAI-compatible providers
+
+Each stub is a local HTTP server whose status and delay can be changed
+between requests. Runs under pytest or directly: python test_llm_router.py
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+
+from ai_throttle import AdaptiveConcurrencyController
+from llm_router import FAILURE_THRESHOLD, LLMProvider, LLMRouter
+
+PAYLOAD = {'messages': [{'role': 'user', 'content': 'Write a headline'}], 'max_tokens': 10}
+TIMEOUT = (1, 5)
+
+
+class StubProvider:
+    """A chat completions endpoint on localhost that answers with its own name"""
+
+    def __init__(self, name, status=200, delay=0.0):
+        self.name = name
+        self.status = status
+        self.delay = delay
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.requests += 1
+                time.sleep(stub.delay)
+                if stub.status == 200:
+                    reply = {'model': body['model'], 'choices': [{'message': {'content': stub.name}}]}
+                else:
+                    reply = {'error': {'message': f'{stub.name} unavailable'}}
+                out = json.dumps(reply).encode('utf-8')
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def provider(self):
+        return LLMProvider(self.name, f'http://127.0.0.1:{self.server.server_port}/v1/chat/completions',
+                           f'{self.name}-model')
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _answer(response):
+    return response.json()['choices'][0]['message']['content']
+
+
+def _counters(router, name):
+    return next(provider for provider in router.status()['providers'] if provider['name'] == name)
+
+
+def test_failover_on_server_error():
+    primary, backup = StubProvider('primary', status=503), StubProvider('backup')
+    try:
+        router = LLMRouter([primary.provider(), backup.provider()])
+        response = router.post(PAYLOAD, TIMEOUT)
+        assert response.status_code == 200
+        assert _answer(response) == 'backup'
+        assert response.json()['model'] == 'backup-model'
+        assert response.llm_provider.name == 'backup'
+        assert _counters(router, 'primary')['failures'] == 1
+    finally:
+        primary.close()
+        backup.close()
+
+
+def test_failover_on_connection_error():
+    backup = StubProvider('backup')
+    try:
+        unreachable = LLMProvider('unreachable', 'http://127.0.0.1:9/v1/chat/completions', 'model')
+        router = LLMRouter([unreachable, backup.provider()])
+        assert _answer(router.post(PAYLOAD, TIMEOUT)) == 'backup'
+        assert _counters(router, 'unreachable')['failures'] == 1
+    finally:
+        backup.close()
+
+
+def test_last_failed_response_when_every_provider_fails():
+    first, second = StubProvider('first', status=503), StubProvider('second', status=429)
+    try:
+        router = LLMRouter([first.provider(), second.provider()])
+        response = router.post(PAYLOAD, TIMEOUT)
+        assert response.status_code == 429
+        assert first.requests == 1 and second.requests == 1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_client_error_is_not_failed_over():
+    primary, backup = StubProvider('primary', status=400), StubProvider('backup')
+    try:
+        router = LLMRouter([primary.provider(), backup.provider()])
+        assert router.post(PAYLOAD, TIMEOUT).status_code == 400
+        assert backup.requests == 0
+    finally:
+        primary.close()
+        backup.close()
+
+
+def test_circuit_breaker_moves_failing_provider_back_until_cooldown():
+    primary, backup = StubProvider('primary', status=503), StubProvider('backup')
+    try:
+        router = LLMRouter([primary.provider(), backup.provider()], cooldown=0.5)
+        first = router.providers[0]
+        for _ in range(FAILURE_THRESHOLD - 1):
+            router._send(first, PAYLOAD, TIMEOUT, False)
+        # Still first: neither provider has a latency yet, and it has not tripped the breaker
+        assert router.ranked()[0] is first
+        router._send(first, PAYLOAD, TIMEOUT, False)
+        assert [provider.name for provider in router.ranked()] == ['backup', 'primary']
+        assert _counters(router, 'primary')['cooldown_seconds'] > 0
+
+        # While cooling down the primary is not tried at all
+        assert _answer(router.post(PAYLOAD, TIMEOUT)) == 'backup'
+        assert primary.requests == FAILURE_THRESHOLD
+
+        # Out of cooldown it is tried again when the provider ahead of it fails
+        primary.status, backup.status = 200, 503
+        time.sleep(0.6)
+        assert _counters(router, 'primary')['cooldown_seconds'] == 0
+        assert _answer(router.post(PAYLOAD, TIMEOUT)) == 'primary'
+        assert first.consecutive_failures == 0
+    finally:
+        primary.close()
+        backup.close()
+
+
+def test_ranking_prefers_the_faster_provider():
+    slow, fast = StubProvider('slow', delay=0.2), StubProvider('fast')
+    try:
+        router = LLMRouter([slow.provider(), fast.provider()])
+        for provider in router.providers:
+            router._send(provider, PAYLOAD, TIMEOUT, False)
+        assert [provider.name for provider in router.ranked()] == ['fast', 'slow']
+        assert _answer(router.post(PAYLOAD, TIMEOUT)) == 'fast'
+    finally:
+        slow.close()
+        fast.close()
+
+
+def test_hedge_wins_when_the_first_provider_is_slow():
+    slow, fast = StubProvider('slow', delay=1.0), StubProvider('fast')
+    try:
+        router = LLMRouter([slow.provider(), fast.provider()], hedge=True, hedge_delay=0.05)
+        started = time.perf_counter()
+        response = router.post(PAYLOAD, TIMEOUT, hedge=True)
+        assert _answer(response) == 'fast'
+        assert time.perf_counter() - started < 0.9
+        assert _counters(router, 'fast')['hedges_sent'] == 1
+        assert _counters(router, 'fast')['hedges_won'] == 1
+    finally:
+        slow.close()
+        fast.close()
+
+
+def test_no_hedge_when_the_first_provider_answers_in_time():
+    first, second = StubProvider('first'), StubProvider('second')
+    try:
+        router = LLMRouter([first.provider(), second.provider()], hedge=True, hedge_delay=0.5)
+        assert _answer(router.post(PAYLOAD, TIMEOUT, hedge=True)) == 'first'
+        assert second.requests == 0
+    finally:
+        first.close()
+        second.close()
+
+
+def test_only_interactive_requests_are_hedged():
+    slow, fast = StubProvider('slow', delay=0.3), StubProvider('fast')
+    try:
+        router = LLMRouter([slow.provider(), fast.provider()], hedge=True, hedge_delay=0.05)
+        assert _answer(router.post(PAYLOAD, TIMEOUT)) == 'slow'
+        assert fast.requests == 0
+    finally:
+        slow.close()
+        fast.close()
+
+
+def test_hedge_takes_a_throttle_slot_and_is_charged_tokens():
+    slow, fast = StubProvider('slow', delay=0.5), StubProvider('fast')
+    try:
+        throttle = AdaptiveConcurrencyController(initial_limit=2, max_limit=2)
+        router = LLMRouter([slow.provider(), fast.provider()], hedge=True, hedge_delay=0.05, throttle=throttle)
+        with throttle.slot(100):
+            assert _answer(router.post(PAYLOAD, TIMEOUT, hedge=True, estimated_tokens=300)) == 'fast'
+        status = throttle.status()
+        assert status['requests'] == 2
+        assert status['tokens_last_minute'] == 400
+        assert status['in_flight'] == 0
+    finally:
+        slow.close()
+        fast.close()
+
+
+def test_hedge_is_skipped_when_the_throttle_is_full():
+    slow, fast = StubProvider('slow', delay=0.3), StubProvider('fast')
+    try:
+        throttle = AdaptiveConcurrencyController(initial_limit=1, max_limit=1)
+        router = LLMRouter([slow.provider(), fast.provider()], hedge=True, hedge_delay=0.05, throttle=throttle)
+        with throttle.slot(100):
+            assert _answer(router.post(PAYLOAD, TIMEOUT, hedge=True, estimated_tokens=300)) == 'slow'
+        assert fast.requests == 0
+        assert _counters(router, 'fast')['hedges_throttled'] == 1
+        assert throttle.status()['requests'] == 1
+    finally:
+        slow.close()
+        fast.close()
+
+
+def test_failover_continues_after_both_hedged_providers_fail():
+    first, second, third = StubProvider('first', status=503), StubProvider('second', status=503), StubProvider('third')
+    try:
+        router = LLMRouter([first.provider(), second.provider(), third.provider()], hedge=True, hedge_delay=0.01)
+        first.delay = 0.1
+        assert _answer(router.post(PAYLOAD, TIMEOUT, hedge=True)) == 'third'
+    finally:
+        first.close()
+        second.close()
+        third.close()
+
+
+if __name__ == "__main__":
+    tests = [(name, test) for name, test in sorted(globals().items()) if name.startswith('test_') and callable(test)]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✓ {name}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ {name}: {e!r}")
+    print(f"{len(tests) - failed}/{len(tests)} passed")
+    sys.exit(1 if failed else 0)